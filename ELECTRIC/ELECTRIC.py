@@ -1,14 +1,48 @@
+import os
 import time
+import asyncio
 import numpy as np
-import pandas as pd
 
-from itertools import combinations
-
-from util import process_pdb, index_fragments, create_parser
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from util import (
+    process_pdb,
+    index_fragments,
+    fragment_scatter_index,
+    reduce_to_fragments,
+    fragment_map,
+    project_pairs,
+    create_parser,
+    output_filename,
+    read_arc_header,
+    load_topology,
+    load_frame_index,
+    write_coordinate_cache,
+    coordinate_cache_is_current,
+    read_coordinate_cache,
+    prefetch_frames,
+    read_trajectory_list,
+    trajectory_output_tags,
+    interleave_trajectories,
+    read_arc_frames,
+    read_arc_frames_mmap,
+    parse_frames,
+    parse_probe_groups,
+    analysis_frames,
+    ResultStore,
+    StreamingWriter,
+    RunningStatistics,
+    Checkpoint,
+    h5py,
+)
 
 # Use local MDI build
 import mdi.MDI_Library as mdi
 
+from mdi_pipeline import CommandPipeline
+from engine_pool import EnginePool
+
 from line_profiler import LineProfiler
 
 lp = LineProfiler()
@@ -42,134 +76,505 @@ def connect_to_engines(nengines):
         print("Connected!")
 
     # Verify the engine names
-    for iengine in range(nengines):
-        comm = engine_comm[iengine]
+    for_each_engine(check_engine_name, engine_comm)
 
-        # Determine the name of the engine
-        mdi.MDI_Send_Command("<NAME", comm)
-        name = mdi.MDI_Recv(mdi.MDI_NAME_LENGTH, mdi.MDI_CHAR, comm)
-        print(f"Engine name: {name}")
+    return engine_comm
 
-        if name[:8] != "NO_EWALD":
-            raise Exception("Unrecognized engine name", name)
 
-    return engine_comm
+def for_each_engine(function, engine_comm):
+    """
+    Call a function with the MDI communicator of each engine.
 
+    The engines are handled concurrently, so that the round trips to the engines overlap,
+    unless MDI communicates through MPI, which is not thread safe.
 
-@lp
-def collect_task(
-    comm, npoles, snapshot_coords, snap_num, atoms_pole_numbers, output, components
-):
+    Parameters
+    ---------
+    function : callable
+        Called with the MDI communicator of an engine.
+
+    engine_comm : list
+        The MDI communicators of the engines.
+
+    Returns
+    -------
+    results : list
+        The value returned by `function` for each engine.
     """
-    Receive all data associated with an engine's task.
+    if not mdi_thread_safe or len(engine_comm) < 2:
+        return [function(comm) for comm in engine_comm]
+
+    with ThreadPoolExecutor(max_workers=len(engine_comm)) as executor:
+        return list(executor.map(function, engine_comm))
+
+
+def check_engine_name(comm):
+    """
+    Verify that an engine is a Tinker engine without Ewald summation.
 
     Parameters
     ---------
     comm : MDI_Comm
-        The MDI communicator of the engine performing this task.
+        The MDI communicator of the engine.
+    """
+    # Determine the name of the engine
+    mdi.MDI_Send_Command("<NAME", comm)
+    name = mdi.MDI_Recv(mdi.MDI_NAME_LENGTH, mdi.MDI_CHAR, comm)
+    print(f"Engine name: {name}")
 
-    npoles : int
-        Number of poles involved in this calculation
+    if name[:8] != "NO_EWALD":
+        raise Exception("Unrecognized engine name", name)
 
-    snapshot_coords : np.ndarray
-        Nuclear coordinates at the snapshot associated with this task.
 
-    snap_num : int
-        The snapshot associated with this task.
+def send_probes(comm, probe_pole_indices):
+    """
+    Inform an engine of the probe atoms.
 
-    atoms_pole_numbers : list
-        A multidimensional list where each element gives the pole indices in that fragment.
+    Parameters
+    ---------
+    comm : MDI_Comm
+        The MDI communicator of the engine.
 
-    output : pd.DataFrame
-        The aggregated data from all tasks.
+    probe_pole_indices : list
+        The (1-indexed) pole index of each probe.
+    """
+    mdi.MDI_Send_Command(">NPROBES", comm)
+    mdi.MDI_Send(len(probe_pole_indices), 1, mdi.MDI_INT, comm)
+    mdi.MDI_Send_Command(">PROBES", comm)
+    mdi.MDI_Send(probe_pole_indices, len(probe_pole_indices), mdi.MDI_INT, comm)
+
+
+def send_fragments(comm, pole_fragments, nfragments):
+    """
+    Send the fragment of each pole to an engine which sums the field over the fragments.
+
+    Parameters
+    ---------
+    comm : MDI_Comm
+        The MDI communicator of the engine.
+
+    pole_fragments : np.ndarray
+        The fragment of each pole, as returned by `fragment_map`.
+
+    nfragments : int
+        The number of fragments.
+    """
+    mdi.MDI_Send_Command(">NFRAGMENTS", comm)
+    mdi.MDI_Send(nfragments, 1, mdi.MDI_INT, comm)
+    mdi.MDI_Send_Command(">FRAGMENTS", comm)
+    mdi.MDI_Send(pole_fragments, len(pole_fragments), mdi.MDI_INT, comm)
+
+
+def attach_engine(comm, probe_pole_indices, pole_fragments, nfield):
+    """
+    Set up an engine which has connected during the analysis, like the engines connected at the start.
+
+    Parameters
+    ---------
+    comm : MDI_Comm
+        The MDI communicator of the engine.
+
+    probe_pole_indices : list
+        The (1-indexed) pole index of each probe.
+
+    pole_fragments : np.ndarray or None
+        The fragment of each pole, if the engines sum the field over the fragments.
+
+    nfield : int
+        The number of poles, or of fragments if the engines sum the field over the fragments.
 
     Returns
     -------
-    output : pd.DataFrame
-        The aggregated data from all tasks, including the data collected by this function.
+    communicate : callable
+        Sends a task to the engine and receives the fields, as passed to `EnginePool.run`.
     """
+    check_engine_name(comm)
 
-    mdi.MDI_Recv(3 * npoles * len(probes), mdi.MDI_DOUBLE, comm, buf=dfield)
+    # The engine must support the optional commands negotiated with the engines connected at
+    # the start. As for those engines, <DFIELD and <UFIELD are not checked, since engines are
+    # not required to report the commands they support.
+    commands = [
+        command for command in field_commands if command not in ("<DFIELD", "<UFIELD")
+    ]
+    if pole_fragments is not None:
+        commands += [">NFRAGMENTS", ">FRAGMENTS"]
 
-    # Get the pairwise UFIELD
-    ufield = np.zeros((len(probes), npoles, 3))
-    mdi.MDI_Send_Command("<UFIELD", comm)
-    mdi.MDI_Recv(3 * npoles * len(probes), mdi.MDI_DOUBLE, comm, buf=ufield)
+    for command in commands:
+        if not engine_supports_command(comm, command):
+            raise Exception(f"The engine does not support {command}")
+
+    send_probes(comm, probe_pole_indices)
+    if pole_fragments is not None:
+        send_fragments(comm, pole_fragments, nfield)
+
+    return partial(compute_task, CommandPipeline(comm), field_buffers(nfield))
 
-    # Sum the appropriate values
-    fragment_labels = [
-        f"{by_type} {x} {n} dimension" for x in from_fragment for n in ["x", "y", "z"]
-    ]
 
-    fields = [ufield, dfield]
+def engines_support_command(engine_comm, command, node="@DEFAULT"):
+    """
+    Check whether every engine supports an MDI command.
+
+    Parameters
+    ---------
+    engine_comm : list
+        The MDI communicators of the engines.
 
-    totfield = np.zeros((len(probes), len(atoms_pole_numbers), 3))
+    command : str
+        The MDI command, for example "<TFIELD".
 
-    # Loop over the fields and add the data to the dataframes
-    for field in fields:
-        field_at_fragment = np.array(
-            [
-                field[x, atoms_pole_numbers[i] - 1].sum(axis=0)
-                for x in range(len(probes))
-                for i in range(len(atoms_pole_numbers))
-            ]
+    node : str, optional
+        The node of the engines at which the command is sent.
+
+    Returns
+    -------
+    supported : bool
+        Whether every engine reports that it supports `command` at `node`.
+    """
+    return all(
+        for_each_engine(
+            partial(engine_supports_command, command=command, node=node), engine_comm
         )
-        # reshape to keep as array for more calculations
-        # for array calculations, we want x, y, z components for a fragment to
-        # be together - add to totfield array.
-        totfield += field_at_fragment.reshape(len(probes), len(from_fragment), 3)
-
-    frame_data = pd.DataFrame(
-        totfield.reshape(len(probes), -1),
-        index=range(len(probes)),
-        columns=fragment_labels,
     )
 
-    frame_data = frame_data.T
 
-    # Rename the columns to be the probe atom number and the snapshot number.
-    frame_data.columns = [f"{probe} - frame {snap_num}" for probe in probes]
+def engine_supports_command(comm, command, node="@DEFAULT"):
+    """
+    Check whether an engine supports an MDI command.
+
+    Parameters are as for `engines_support_command`, except that `comm` is the MDI
+    communicator of a single engine.
+    """
+    try:
+        return bool(mdi.MDI_Check_Command_Exists(node, command, comm))
+    except Exception:
+        # Engines which do not report their nodes are assumed not to support the command.
+        return False
+
+
+def query_topology(comm, natoms):
+    """
+    Get the pole index and the molecule of each atom from an engine.
+
+    Parameters
+    ---------
+    comm : MDI_Comm
+        The MDI communicator of the engine.
+
+    natoms : int
+        Number of atoms in the system.
+
+    Returns
+    -------
+    ipoles : np.ndarray
+        The (1-indexed) pole index of each atom.
+
+    molecules : np.ndarray
+        The molecule number of each atom.
+    """
+    ipoles = np.empty(natoms, dtype=np.int32)
+    molecules = np.empty(natoms, dtype=np.int32)
+
+    pipeline = CommandPipeline(comm)
+    pipeline.request("<IPOLES", ipoles, mdi.MDI_INT)
+    pipeline.request("<MOLECULES", molecules, mdi.MDI_INT)
+    pipeline.run()
 
-    # multiply by the conversion factor
-    frame_data = frame_data * conversion_factor
+    return ipoles, molecules
+
+
+def collect_task(pipeline, snapshot_coords, slot, output, buffers):
+    """
+    Receive all data associated with an engine's task.
+
+    Parameters
+    ---------
+    pipeline : CommandPipeline
+        The command pipeline of the engine performing this task.
+
+    snapshot_coords : np.ndarray
+        Nuclear coordinates at the snapshot associated with this task.
+
+    slot : int
+        The position of the snapshot associated with this task among the analyzed frames
+        of its trajectory.
+
+    output : tuple
+        The analyses of the trajectory of the snapshot, and its Checkpoint (or None). The
+        analyses are a list with an element for each fragment grouping. Each element is a
+        tuple of the pole indices ordered by fragment and the offset of each fragment (as
+        returned by `fragment_scatter_index`), and the ResultStores of the probe groups (in
+        the order of `probe_groups`) to which the data collected by this function is added.
+
+    buffers : tuple
+        The arrays owned by this engine which the direct and induced fields are received
+        into, as returned by `field_buffers`.
+    """
+    field = receive_fields(pipeline, buffers)
+    analyze_task(field, snapshot_coords, slot, output)
+
+
+@lp
+def receive_fields(pipeline, buffers):
+    """
+    Receive the fields requested from an engine by `send_task`.
+
+    Parameters
+    ---------
+    pipeline : CommandPipeline
+        The command pipeline of the engine performing this task.
+
+    buffers : tuple
+        The arrays owned by this engine which the direct and induced fields are received
+        into, as returned by `field_buffers`.
+
+    Returns
+    -------
+    ufield : np.ndarray
+        The total (direct and induced) field at each probe from each pole, with shape
+        (probes, npoles, 3), or from each fragment if the engines sum the field over the
+        fragments. This is one of `buffers`, so it is overwritten by the next task of the engine.
+    """
+    pipeline.receive()
 
-    # Add the data to the output dataframe
-    components = pd.concat([components, frame_data], axis=1)
+    if len(buffers) == 1:
+        # The engine has already summed the direct and induced fields.
+        return buffers[0]
+
+    dfield, ufield = buffers
+
+    # Sum the direct and induced fields
+    ufield += dfield
+
+    return ufield
+
+
+@lp
+def analyze_task(ufield, snapshot_coords, slot, output):
+    """
+    Reduce the field of a snapshot to fragments, and store the results.
+
+    Parameters
+    ---------
+    ufield : np.ndarray
+        The total field at each probe from each pole, or from each fragment, as returned
+        by `receive_fields`.
+
+    snapshot_coords : np.ndarray
+        Nuclear coordinates at the snapshot associated with this task.
+
+    slot : int
+        The position of the snapshot associated with this task among the analyzed frames
+        of its trajectory.
+
+    output : tuple
+        The fragment groupings and ResultStores of the trajectory, and its Checkpoint, as
+        passed to `collect_task`.
+    """
+    analyses, checkpoint = output
 
     # Pairwise probe calculation - Get avg electric field
     # if user has specified that they want a projection.
-    probe_coordinates = [snapshot_coords[probes[i] - 1] for i in range(len(probes))]
+    probe_coordinates = snapshot_coords[probe_indices]
 
-    if projection:
-        # Get all combinations of probes
-        labels = [
-            f"{probes[i]} and {probes[j]} - frame {snap_num}"
-            for i, j in combinations(range(len(probes)), 2)
-        ]
-        fragment_labels = [f"{by_type} {x}" for x in from_fragment]
-        combos = [(i, j) for i, j in combinations(range(len(probes)), 2)]
-        efield = np.zeros((len(combos), len(from_fragment)))
-
-        for i, combo in enumerate(combos):
-            avg_field = (totfield[combo[0]] + totfield[combo[1]]) / 2
-            coord1 = probe_coordinates[combo[0]]
-            coord2 = probe_coordinates[combo[1]]
-            # Unit vector
-            dir_vec = (coord2 - coord1) / np.linalg.norm(coord2 - coord1)
-            efield_projection = np.dot(avg_field, dir_vec) * conversion_factor
-            efield[i] = efield_projection
-
-        # Add the data to the output dataframe
-        output = pd.concat(
-            [output, pd.DataFrame(efield.T, columns=labels, index=fragment_labels)],
-            axis=1,
-        )
+    for fragment_index, group_results in analyses:
+        if fragment_index is None:
+            # The engine has already summed the field over the fragments.
+            totfield = ufield
+        else:
+            # Sum over the poles of each fragment for the probes of all groups at once.
+            totfield = reduce_to_fragments(ufield, *fragment_index)
+
+        for group_index, results in zip(probe_group_indices, group_results):
+            group_field = totfield[group_index]
+
+            efield = None
+            if projection:
+                # Project the field onto the direction between the probes for all pairs at once.
+                efield = (
+                    project_pairs(group_field, probe_coordinates[group_index])
+                    * conversion_factor
+                )
+
+            # Store the data (multiplied by the conversion factor) for this frame
+            results.add_frame(slot, group_field * conversion_factor, efield)
+
+    if checkpoint is not None:
+        checkpoint.add(slot)
+
+
+def send_task(pipeline, snapshot_coords, buffers):
+    """
+    Send the coordinates of a snapshot to an engine, and request the fields.
+
+    The commands are sent together, without waiting for the replies in between. The fields
+    are not received here, so that the engine can work while other engines are given tasks.
+
+    Parameters
+    ---------
+    pipeline : CommandPipeline
+        The command pipeline of the engine.
+
+    snapshot_coords : np.ndarray
+        Nuclear coordinates at the snapshot, in the units of the engine.
+
+    buffers : tuple
+        The receive buffers of the engine, as returned by `field_buffers`.
+    """
+    pipeline.send(">COORDS", snapshot_coords, mdi.MDI_DOUBLE)
+
+    # Get the pairwise fields
+    for command, buf in zip(field_commands, buffers):
+        pipeline.request(command, buf, mdi.MDI_DOUBLE)
 
-    return output, components
+    pipeline.flush()
+
+
+def field_buffers(npoles):
+    """
+    Allocate the arrays which the fields calculated by an engine are received into.
+
+    Each engine owns one set of buffers, which is reused for all of its tasks.
+
+    Parameters
+    ---------
+    npoles : int
+        Number of poles involved in this calculation, or the number of fragments if the
+        engines sum the field over the fragments.
+
+    Returns
+    -------
+    buffers : tuple
+        An array with shape (probes, npoles, 3) for each command in `field_commands`: the
+        direct and the induced field, or the total field if the engines send their sum.
+    """
+    return tuple(np.empty((len(probes), npoles, 3)) for command in field_commands)
+
+
+def compute_task(pipeline, buffers, task):
+    """
+    Send a task to an engine, and receive the fields calculated by the engine.
+
+    Parameters
+    ---------
+    pipeline : CommandPipeline
+        The command pipeline of the engine.
+
+    buffers : tuple
+        The receive buffers of the engine, as returned by `field_buffers`.
+
+    task : tuple
+        The output of the trajectory of the snapshot (as passed to `analyze_task`), the slot
+        of the snapshot among the analyzed frames of the trajectory, and the nuclear
+        coordinates at the snapshot in the units of the engine.
+
+    Returns
+    -------
+    ufield : np.ndarray
+        The total field, as returned by `receive_fields`.
+    """
+    output, slot, snapshot_coords = task
+
+    start_dfield = time.time()
+
+    send_task(pipeline, snapshot_coords, buffers)
+    ufield = receive_fields(pipeline, buffers)
+
+    elapsed_dfield = time.time() - start_dfield
+    print(f"DField Retrieval:\t {elapsed_dfield}")
+
+    return ufield
+
+
+def store_task(task, ufield):
+    """
+    Analyze the fields calculated for a task by `compute_task`, and store the results.
+
+    Parameters
+    ---------
+    task : tuple
+        The output of the trajectory, the slot of the snapshot and the nuclear coordinates,
+        as passed to `compute_task`.
+
+    ufield : np.ndarray
+        The total field, as returned by `compute_task`.
+    """
+    output, slot, snapshot_coords = task
+    analyze_task(ufield, snapshot_coords, slot, output)
+
+
+async def run_engine_async(pipeline, buffers, tasks, lock, angstrom_to_bohr):
+    """
+    Analyze snapshots with one engine until there are no snapshots left, as a coroutine.
+
+    The blocking MDI calls of each engine run in a thread of their own, while the reduction
+    of the fields to fragments runs in the event loop, concurrently with the work of the
+    other engines.
+
+    Parameters
+    ---------
+    pipeline : CommandPipeline
+        The command pipeline of the engine.
+
+    buffers : tuple
+        The receive buffers of the engine, as returned by `field_buffers`.
+
+    tasks : iterator
+        The snapshots to analyze, as (output, slot, coords), shared by all engines. The
+        output of the trajectory of each snapshot is passed to `analyze_task`.
+
+    lock : asyncio.Lock
+        The lock guarding `tasks`.
+
+    angstrom_to_bohr : float
+        The conversion factor from the units of the trajectory to those of the engine.
+    """
+    loop = asyncio.get_running_loop()
+
+    # All communication with an engine happens on the same thread.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while True:
+            async with lock:
+                # Reading the trajectory may block, so it is done outside of the event loop.
+                task = await loop.run_in_executor(None, next, tasks, None)
+                if task is None:
+                    return
+
+                output, slot, coords = task
+                snapshot_coords = coords * angstrom_to_bohr
+
+            start_dfield = time.time()
+
+            await loop.run_in_executor(
+                executor, send_task, pipeline, snapshot_coords, buffers
+            )
+            ufield = await loop.run_in_executor(
+                executor, receive_fields, pipeline, buffers
+            )
+            analyze_task(ufield, snapshot_coords, slot, output)
+
+            elapsed_dfield = time.time() - start_dfield
+            print(f"DField Retrieval:\t {elapsed_dfield}")
+
+
+async def run_engines_async(engine_pipelines, engine_buffers, tasks, angstrom_to_bohr):
+    """
+    Analyze snapshots with all engines, each in a coroutine of its own.
+
+    Parameters are as for `run_engine_async`, except that `engine_pipelines` and
+    `engine_buffers` are the lists of the command pipelines and receive buffers of all engines.
+    """
+    lock = asyncio.Lock()
+    await asyncio.gather(
+        *[
+            run_engine_async(pipeline, buffers, tasks, lock, angstrom_to_bohr)
+            for pipeline, buffers in zip(engine_pipelines, engine_buffers)
+        ]
+    )
 
 
 if __name__ == "__main__":
     conversion_factor = 1440  # Conversion factor for Tinker units to Mv/cm.
+    checkpoint_filename = "electric_checkpoint.bin"
 
     ###########################################################################
     #
@@ -190,8 +595,33 @@ if __name__ == "__main__":
     # Process args for MDI
     mdi.MDI_Init(args.mdi)
 
-    snapshot_filename = args.snap
-    probes = [int(x) for x in args.probes.split()]
+    # Several trajectories are analyzed by the same engines, and their output files are
+    # named by trajectory.
+    trajectory_files = read_trajectory_list(args.snap)
+    if len(trajectory_files) > 1:
+        trajectory_tags = trajectory_output_tags(trajectory_files)
+    else:
+        trajectory_tags = [None]
+
+    # The engines calculate the field at the probes of all groups at once.
+    probe_groups = parse_probe_groups(args.probes)
+    probes = list(
+        dict.fromkeys(probe for name, group in probe_groups for probe in group)
+    )
+
+    # The positions of the probes in the coordinates
+    probe_indices = np.array(probes) - 1
+
+    # The positions of the probes of each group among the probes of all groups.
+    # A group of all probes in the same order uses the whole field, without a copy.
+    probe_group_indices = []
+    for name, group in probe_groups:
+        if group == probes:
+            probe_group_indices.append(slice(None))
+        else:
+            probe_group_indices.append(
+                np.array([probes.index(probe) for probe in group])
+            )
 
     # Compatibility check for arguments.
     if args.byres and args.bymol:
@@ -199,19 +629,70 @@ if __name__ == "__main__":
             "--byres and --bymol cannot be used together. Please only use one."
         )
 
+    if args.groupings and args.bymol:
+        parser.error(
+            "--bymol cannot be used with --groupings. Use --groupings molecule instead."
+        )
+
+    if args.groupings and "residue" in args.groupings and not args.byres:
+        parser.error("The residue grouping requires the pdb file given by --byres.")
+
+    if args.reduction == "engine" and args.groupings and len(set(args.groupings)) > 1:
+        parser.error("--reduction engine can only be used with a single grouping.")
+
+    # MDI communication over MPI is not thread safe.
+    mdi_thread_safe = "-method MPI" not in " ".join(args.mdi.split())
+
+    if args.elastic and (args.scheduler != "dynamic" or not mdi_thread_safe):
+        parser.error("--elastic requires the dynamic scheduler and MDI over TCP.")
+
+    if args.stream and args.output_format != "csv":
+        parser.error("--stream only writes csv files.")
+
+    if args.stream_chunk < 1:
+        parser.error("--stream-chunk must be at least 1.")
+
+    if args.statistics and (args.stream or args.output_format != "csv"):
+        parser.error("--statistics only writes csv files, and cannot be streamed.")
+
+    if args.statistics and args.restart:
+        parser.error("--restart cannot be used with --statistics.")
+
+    if args.coordinate_cache and len(trajectory_files) > 1:
+        parser.error("--coordinate-cache can only be used with a single trajectory.")
+
+    if args.output_format == "hdf5" and h5py is None:
+        parser.error("--output-format hdf5 requires h5py.")
+
+    dtype = np.float32 if args.float32 else np.float64
+
     if args.byres:
         residues = process_pdb(args.byres)[0]
 
-    if not args.components_only and len(probes) < 2:
+    if not args.components_only and min(len(group) for name, group in probe_groups) < 2:
         parser.error(
             """At least two probes must be specified if calculating electric field projection. 
                      Use --components-only to calculate electric field components at specified probe."""
         )
 
     print("Connecting to engines...")
-    engine_comm = connect_to_engines(nengines)
+    engine_pool = EnginePool(connect_to_engines(nengines), timeout=args.task_timeout)
+    engine_comm = engine_pool.engine_comm
     # Print the probe atoms
     print(f"Probes: {probes}")
+    if len(probe_groups) > 1:
+        for name, group in probe_groups:
+            print(f"Probe group {name}: {group}")
+
+    # Request the total field in one transfer if the engines support it.
+    # The commands used to request the fields are chosen once the groupings are known.
+    if args.fields == "split":
+        total_field = False
+    else:
+        total_field = engines_support_command(engine_comm, "<TFIELD")
+        if args.fields == "total" and not total_field:
+            raise Exception("--fields total requires engines which support <TFIELD")
+    print(f"Total field from engines: {total_field}")
 
     elapsed = time.time() - start
     print(f"Setup:\t {elapsed}")
@@ -222,23 +703,29 @@ if __name__ == "__main__":
     #
     ###########################################################################
 
-    # Get the number of atoms
-    mdi.MDI_Send_Command("<NATOMS", engine_comm[0])
-    natoms_engine = mdi.MDI_Recv(1, mdi.MDI_INT, engine_comm[0])
-    print(f"natoms: {natoms_engine}")
+    # Get the number of atoms and of multipole centers
+    counts = np.empty(2, dtype=np.int32)
+    pipeline = CommandPipeline(engine_comm[0])
+    pipeline.request("<NATOMS", counts[:1], mdi.MDI_INT)
+    pipeline.request("<NPOLES", counts[1:], mdi.MDI_INT)
+    pipeline.run()
 
-    # Get the number of multipole centers
-    mdi.MDI_Send_Command("<NPOLES", engine_comm[0])
-    npoles = mdi.MDI_Recv(1, mdi.MDI_INT, engine_comm[0])
+    natoms_engine, npoles = int(counts[0]), int(counts[1])
+    print(f"natoms: {natoms_engine}")
     print("npoles: " + str(npoles))
 
-    # Get the indices of the multipole centers per atom
-    mdi.MDI_Send_Command("<IPOLES", engine_comm[0])
-    ipoles = mdi.MDI_Recv(natoms_engine, mdi.MDI_INT, engine_comm[0])
-
-    # Get the molecule information
-    mdi.MDI_Send_Command("<MOLECULES", engine_comm[0])
-    molecules = np.array(mdi.MDI_Recv(natoms_engine, mdi.MDI_INT, engine_comm[0]))
+    # Get the indices of the multipole centers per atom, and the molecule information.
+    # These are read from the topology sidecar of the trajectory if it is used.
+    if args.topology_cache:
+        ipoles, molecules = load_topology(
+            trajectory_files[0],
+            natoms_engine,
+            npoles,
+            partial(query_topology, engine_comm[0], natoms_engine),
+            sources=args.topology_cache,
+        )
+    else:
+        ipoles, molecules = query_topology(engine_comm[0], natoms_engine)
 
     # Get the residue information
     # Residue information comes from pdb.
@@ -265,19 +752,28 @@ if __name__ == "__main__":
     probe_pole_indices = [int(ipoles[atom_number - 1]) for atom_number in probes]
 
     # Get the atom and pole numbers for the molecules/residues of interest.
-    atoms_pole_numbers = []
-    if args.bymol:
-        by_type = "molecule"
-        fragment_list = molecules
+    if args.groupings:
+        by_types = list(dict.fromkeys(args.groupings))
+    elif args.bymol:
+        by_types = ["molecule"]
     elif args.byres:
-        by_type = "residue"
-        fragment_list = residues
+        by_types = ["residue"]
     else:
-        by_type = "atom"
-        # We are interested in all of the atoms.
-        fragment_list = list(range(1, natoms_engine + 1))
+        by_types = ["atom"]
+
+    groupings = []
+    for by_type in by_types:
+        if by_type == "molecule":
+            fragment_list = molecules
+        elif by_type == "residue":
+            fragment_list = residues
+        else:
+            # We are interested in all of the atoms.
+            fragment_list = list(range(1, natoms_engine + 1))
 
-    atoms_pole_numbers, from_fragment = index_fragments(fragment_list, ipoles)
+        atoms_pole_numbers, from_fragment = index_fragments(fragment_list, ipoles)
+        fragment_index = fragment_scatter_index(atoms_pole_numbers, npoles)
+        groupings.append((by_type, from_fragment, fragment_index))
 
     elapsed = time.time() - start
     print(f"Bookkeeping:\t {elapsed}")
@@ -289,11 +785,48 @@ if __name__ == "__main__":
     ###########################################################################
     start = time.time()
     # Inform Tinker of the probe atoms
-    for comm in engine_comm:
-        mdi.MDI_Send_Command(">NPROBES", comm)
-        mdi.MDI_Send(len(probes), 1, mdi.MDI_INT, comm)
-        mdi.MDI_Send_Command(">PROBES", comm)
-        mdi.MDI_Send(probe_pole_indices, len(probes), mdi.MDI_INT, comm)
+    for_each_engine(
+        partial(send_probes, probe_pole_indices=probe_pole_indices), engine_comm
+    )
+
+    # Let the engines sum the field over the fragments, if they support it.
+    # Only a single grouping can be sent, so the driver reduces several groupings itself.
+    if total_field:
+        field_commands = ["<TFIELD"]
+    else:
+        field_commands = ["<DFIELD", "<UFIELD"]
+
+    engine_reduction = False
+    if args.reduction != "driver" and len(groupings) == 1:
+        fragment_commands = [">NFRAGMENTS", ">FRAGMENTS"] + [
+            "<F" + command[1:] for command in field_commands
+        ]
+        engine_reduction = all(
+            engines_support_command(engine_comm, command)
+            for command in fragment_commands
+        )
+        if args.reduction == "engine" and not engine_reduction:
+            raise Exception(
+                "--reduction engine requires engines which support "
+                + ", ".join(fragment_commands)
+            )
+    print(f"Fragment reduction by engines: {engine_reduction}")
+
+    nfield = npoles
+    pole_fragments = None
+    if engine_reduction:
+        by_type, from_fragment, fragment_index = groupings[0]
+        pole_fragments = fragment_map(*fragment_index, npoles)
+        nfield = len(from_fragment)
+
+        for_each_engine(
+            partial(send_fragments, pole_fragments=pole_fragments, nfragments=nfield),
+            engine_comm,
+        )
+
+        # The engines send the fields summed over the fragments.
+        field_commands = ["<F" + command[1:] for command in field_commands]
+        groupings = [(by_type, from_fragment, None)]
 
     angstrom_to_bohr = mdi.MDI_Conversion_Factor("angstrom", "atomic_unit_of_length")
     elapsed - time.time() - start
@@ -305,24 +838,149 @@ if __name__ == "__main__":
     #
     ###########################################################################
 
-    # Check that engine and trajectory are compatible.
-    # Process first two lines of snapshot to get information.
-    with open(snapshot_filename, "r") as snapshot_file:
-        first_line = snapshot_file.readline()
-        natoms = int(first_line.split()[0])
-        second_line = snapshot_file.readline().split()
-        if len(second_line) == 6:
-            # This line gives box information if length is 6.
-            # This means we will need to skip two lines for every frame.
-            skip_line = 2
+    start = time.time()
+
+    # The output of each trajectory: the fragment groupings and their results, and the
+    # checkpoint of the trajectory. The results are stored at the position of each frame
+    # among the analyzed frames of its trajectory. The results of each trajectory are also
+    # kept with the tag of their output files.
+    outputs = []
+    output_stores = []
+    trajectory_frames = []
+    readers = []
+
+    for snapshot_filename, trajectory_tag in zip(trajectory_files, trajectory_tags):
+        # Check that engine and trajectory are compatible.
+        # Process first two lines of snapshot to get information,
+        # unless the coordinates are read from an up to date coordinate cache.
+        coordinates = None
+        if args.coordinate_cache and coordinate_cache_is_current(
+            args.coordinate_cache, snapshot_filename
+        ):
+            coordinates = np.load(args.coordinate_cache, mmap_mode="r")
+            natoms = coordinates.shape[1]
         else:
-            skip_line = 1
+            natoms, skip_line = read_arc_header(snapshot_filename)
 
-    if natoms != natoms_engine:
-        raise Exception(
-            f"Snapshot file and engine have inconsistent number of atoms \
+        if natoms != natoms_engine:
+            raise Exception(
+                f"Snapshot file and engine have inconsistent number of atoms \
                             Engine : {natoms_engine} \n Snapshot File : {natoms}"
-        )
+            )
+
+        if coordinates is None:
+            # Find the start of each frame, so that the frames to analyze can be read directly.
+            frame_offsets = load_frame_index(snapshot_filename, natoms, skip_line)
+
+            if args.coordinate_cache:
+                print(f"Writing coordinate cache {args.coordinate_cache}")
+                write_coordinate_cache(
+                    snapshot_filename,
+                    args.coordinate_cache,
+                    natoms,
+                    skip_line,
+                    frame_offsets,
+                )
+                coordinates = np.load(args.coordinate_cache, mmap_mode="r")
+
+        # Size the result storage from the frames which will be analyzed.
+        if coordinates is not None:
+            nframes = len(coordinates)
+        else:
+            nframes = len(frame_offsets)
+        selection = parse_frames(args.frames) if args.frames else None
+        frames = analysis_frames(nframes, equil, stride, selection)
+        print(f"Frames to analyze in {snapshot_filename}: {len(frames)} of {nframes}")
+
+        analyses = []
+        stores = []
+        tags = []
+        for by_type, from_fragment, fragment_index in groupings:
+            group_results = []
+            for group_name, group in probe_groups:
+                # Output files are named by trajectory when several trajectories are analyzed,
+                # by probe group when several groups are given, and by fragment type when
+                # several groupings are used.
+                tag = [trajectory_tag, group_name, by_type if args.groupings else None]
+                tag = "_".join(t for t in tag if t is not None) or None
+
+                if args.stream:
+                    results = StreamingWriter(
+                        frames,
+                        from_fragment,
+                        group,
+                        by_type,
+                        projection,
+                        tag=tag,
+                        chunk_size=args.stream_chunk,
+                        restart=args.restart,
+                    )
+                elif args.statistics:
+                    results = RunningStatistics(
+                        frames,
+                        from_fragment,
+                        group,
+                        by_type,
+                        projection,
+                        block_size=args.block_size,
+                    )
+                else:
+                    results = ResultStore(
+                        frames, from_fragment, group, by_type, projection
+                    )
+
+                group_results.append(results)
+                stores.append(results)
+                tags.append(tag)
+
+            analyses.append((fragment_index, group_results))
+
+        # Periodically save the completed frames, and load the frames completed before a restart.
+        # Streamed results are already on disk, and statistics do not keep the frames,
+        # so neither of them is checkpointed.
+        checkpoint = None
+        if not args.stream and not args.statistics:
+            checkpoint_path = output_filename(checkpoint_filename, trajectory_tag)
+            checkpoint = Checkpoint(
+                checkpoint_path,
+                stores,
+                args.checkpoint_interval,
+            )
+            if args.restart:
+                if os.path.exists(checkpoint_path):
+                    restored = checkpoint.restore()
+                    print(f"Frames restored from {checkpoint_path}: {restored}")
+                else:
+                    print(
+                        f"No checkpoint {checkpoint_path} found, starting from the beginning."
+                    )
+
+        # Only read the frames which have not been completed for every grouping.
+        completed = np.logical_and.reduce([results.filled for results in stores])
+        remaining = frames[~completed]
+        if len(remaining) < len(frames):
+            print(f"Frames already completed: {len(frames) - len(remaining)}")
+
+        # Read trajectory and do analysis
+        if coordinates is not None:
+            reader = read_coordinate_cache(coordinates, remaining)
+        elif args.mmap:
+            reader = read_arc_frames_mmap(
+                snapshot_filename, natoms, skip_line, remaining, frame_offsets
+            )
+        else:
+            reader = read_arc_frames(
+                snapshot_filename,
+                natoms,
+                skip_line,
+                frames=remaining,
+                offsets=frame_offsets,
+            )
+
+        outputs.append((analyses, checkpoint))
+        output_stores.append(list(zip(stores, tags)))
+        trajectory_frames.append(frames)
+        readers.append(reader)
 
     ###########################################################################
     #
@@ -330,94 +988,169 @@ if __name__ == "__main__":
     #
     ###########################################################################
 
-    start = time.time()
-    output = pd.DataFrame()
-    components = pd.DataFrame()
-
-    itask = 0
-    itask_to_snap_num = {}
-    snapshot_coords = [None for iengine in range(nengines)]
-
-    # Read trajectory and do analysis
-    for snap_num, snapshot in enumerate(
-        pd.read_csv(
-            snapshot_filename,
-            chunksize=natoms + skip_line,
-            header=None,
-            delim_whitespace=True,
-            names=range(15),
-            skiprows=skip_line,
-            index_col=None,
-        ),
-        1,
-    ):
-        if snap_num > equil:
-            if (snap_num - equil) % stride == 0:
+    # The frames of all trajectories are analyzed by the same engines, taking a frame from
+    # each trajectory in turn. The next frames are read while the engines are busy.
+    trajectory = prefetch_frames(
+        interleave_trajectories(readers), args.prefetch * nengines
+    )
+
+    # Each task holds the output of its trajectory, the position of its frame among the
+    # analyzed frames of the trajectory, and the coordinates of the frame.
+    tasks = (
+        (
+            outputs[itrajectory],
+            int(np.searchsorted(trajectory_frames[itrajectory], snap_num)),
+            coords,
+        )
+        for (itrajectory, snap_num), coords in trajectory
+    )
+
+    # Each engine receives its fields into the same arrays for every task.
+    engine_buffers = [field_buffers(nfield) for comm in engine_comm]
+
+    # The commands of each task are sent to an engine together.
+    engine_pipelines = [CommandPipeline(comm) for comm in engine_comm]
+
+    # MDI communication over MPI is not thread safe, so the engines are used in lock-step.
+    scheduler = args.scheduler
+    if scheduler != "batch" and not mdi_thread_safe:
+        scheduler = "batch"
+
+    try:
+        if scheduler == "asyncio":
+            # Each engine is driven by a coroutine, and the fields are reduced in the event loop.
+            asyncio.run(
+                run_engines_async(
+                    engine_pipelines,
+                    engine_buffers,
+                    tasks,
+                    angstrom_to_bohr,
+                )
+            )
+
+        elif scheduler == "dynamic":
+            if args.elastic:
+                # Engines which connect from now on are given frames as soon as they are set up.
+                engine_pool.accept(
+                    partial(
+                        attach_engine,
+                        probe_pole_indices=probe_pole_indices,
+                        pole_fragments=pole_fragments,
+                        nfield=nfield,
+                    )
+                )
+
+            # Each engine analyzes the next frame as soon as it is free.
+            # The results are stored by frame, so the output is in the same order.
+            # The frames of engines which fail are analyzed by the remaining engines.
+            # The coordinates are converted before the next snapshot is read into their buffer.
+            engine_pool.run(
+                (
+                    (output, slot, coords * angstrom_to_bohr)
+                    for output, slot, coords in tasks
+                ),
+                [
+                    partial(compute_task, pipeline, buffers)
+                    for pipeline, buffers in zip(engine_pipelines, engine_buffers)
+                ],
+                store_task,
+            )
+
+        else:
+            itask = 0
+            snapshot_coords = [None for iengine in range(nengines)]
+            slots = [None for iengine in range(nengines)]
+            task_outputs = [None for iengine in range(nengines)]
+
+            for output, slot, coords in tasks:
                 icomm = itask % nengines
-                itask_to_snap_num[itask] = snap_num
                 itask += 1
+                slots[icomm] = slot
+                task_outputs[icomm] = output
 
                 start_dfield = time.time()
 
-                # Pull out just coords, convert to numeric and use conversion factor.
-                # columns 2-4 of the pandas dataframe are the coordinates.
-                # Must create a copy to send to MDI.
-                snapshot_coords[icomm] = (
-                    (
-                        snapshot.iloc[:natoms, 2:5].apply(pd.to_numeric)
-                        * angstrom_to_bohr
-                    )
-                    .to_numpy()
-                    .copy()
-                )
+                # Use conversion factor.
+                # This creates a new array, which is sent to MDI.
+                snapshot_coords[icomm] = coords * angstrom_to_bohr
 
-                mdi.MDI_Send_Command(">COORDS", engine_comm[icomm])
-                mdi.MDI_Send(
+                # Note: We only request the fields here; we do NOT wait for Tinker to finish the calculation
+                # This allows us to farm out tasks to each of the engines simultaneously
+                send_task(
+                    engine_pipelines[icomm],
                     snapshot_coords[icomm],
-                    3 * natoms,
-                    mdi.MDI_DOUBLE,
-                    engine_comm[icomm],
+                    engine_buffers[icomm],
                 )
 
-                # Get the pairwise DFIELD
-                # Note: We only send the command here; we do NOT wait for Tinker to finish the calculation
-                # This allows us to farm out tasks to each of the engines simultaneously
-                dfield = np.zeros((len(probes), npoles, 3))
-                mdi.MDI_Send_Command("<DFIELD", engine_comm[icomm])
-
                 # After every engine has received a task, collect the data
                 if (icomm % nengines) == (nengines - 1):
                     for jcomm in range(nengines):
-                        output, components = collect_task(
-                            engine_comm[jcomm],
-                            npoles,
+                        collect_task(
+                            engine_pipelines[jcomm],
                             snapshot_coords[jcomm],
-                            itask_to_snap_num[itask - nengines + jcomm],
-                            atoms_pole_numbers,
-                            output,
-                            components,
+                            slots[jcomm],
+                            task_outputs[jcomm],
+                            engine_buffers[jcomm],
                         )
 
                     elapsed_dfield = time.time() - start_dfield
                     print(f"DField Retrieval:\t {elapsed_dfield}")
 
-    # Collect any tasks that have not yet been collected
-    for icomm in range(itask % nengines):
-        output, components = collect_task(
-            engine_comm[icomm],
-            npoles,
-            snapshot_coords[icomm],
-            itask_to_snap_num[itask - (itask % nengines) + icomm],
-            atoms_pole_numbers,
-            output,
-            components,
-        )
+            # Collect any tasks that have not yet been collected
+            for icomm in range(itask % nengines):
+                collect_task(
+                    engine_pipelines[icomm],
+                    snapshot_coords[icomm],
+                    slots[icomm],
+                    task_outputs[icomm],
+                    engine_buffers[icomm],
+                )
+    finally:
+        # Write the frames completed so far, so that they are kept for a restart even if
+        # the analysis has failed.
+        for analyses, checkpoint in outputs:
+            if checkpoint is not None:
+                checkpoint.close()
+
+    for stores in output_stores:
+        for results, tag in stores:
+            if args.stream:
+                results.close()
+                continue
+
+            if args.statistics:
+                if projection:
+                    results.projection_dataframe().to_csv(
+                        output_filename("proj_totfield_statistics.csv", tag)
+                    )
+
+                results.components_dataframe().to_csv(
+                    output_filename("ef_components_statistics.csv", tag)
+                )
+                continue
+
+            if args.output_format == "npz":
+                results.save_npz(output_filename("electric_field.npz", tag), dtype)
+                continue
+
+            if args.output_format == "hdf5":
+                results.save_hdf5(output_filename("electric_field.h5", tag), dtype)
+                continue
+
+            if projection:
+                results.projection_dataframe().to_csv(
+                    output_filename("proj_totfield.csv", tag)
+                )
 
-    if projection:
-        output.to_csv("proj_totfield.csv")
+            results.components_dataframe().to_csv(
+                output_filename("ef_components.csv", tag)
+            )
 
-    components.index.name = "Fragment and Dimension"
-    components.to_csv("ef_components.csv")
+    # The calculation is complete, so it will not need to be restarted. Only the checkpoints
+    # of this run are removed, since streamed and statistics runs do not write any.
+    for analyses, checkpoint in outputs:
+        if checkpoint is not None and os.path.exists(checkpoint.file_path):
+            os.remove(checkpoint.file_path)
 
     elapsed = time.time() - start
     print(f"Elapsed loop:{elapsed}")  #
@@ -425,6 +1158,11 @@ if __name__ == "__main__":
     with open("profile_output.txt", "w") as f:
         lp.print_stats(stream=f)
 
-    # Send the "EXIT" command to the engine
-    for comm in engine_comm:
-        mdi.MDI_Send_Command("EXIT", comm)
+    # Send the "EXIT" command to the engines which have not failed, and to the engines
+    # which have timed out, as they may still be running
+    for comm in engine_pool.close():
+        try:
+            mdi.MDI_Send_Command("EXIT", comm)
+        except mdi.MDI_Error:
+            # The engine has exited in the meantime.
+            pass
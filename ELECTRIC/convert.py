@@ -0,0 +1,41 @@
+"""
+Convert a Tinker trajectory (.arc) file into a binary coordinate cache
+which can be given to ELECTRIC with --coordinate-cache.
+"""
+
+from util import read_arc_header, write_coordinate_cache, output_filename
+
+import os
+import argparse
+
+import numpy as np
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("arc_file", help="The trajectory file to convert.")
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="The .npy file to write the coordinates to. By default, the name of the trajectory with the extension .npy.",
+        type=str,
+    )
+    parser.add_argument(
+        "--float32",
+        help="Store the coordinates in single precision, halving the size of the cache.",
+        action="store_true",
+    )
+
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.arc_file)[0] + ".npy"
+    dtype = np.float32 if args.float32 else np.float64
+
+    natoms, skip_line = read_arc_header(args.arc_file)
+    nframes = write_coordinate_cache(
+        args.arc_file, output, natoms, skip_line, dtype=dtype
+    )
+
+    print(f"Wrote {nframes} frames of {natoms} atoms to {output}")
+    if skip_line == 2:
+        print(f"Wrote box information to {output_filename(output, 'box')}")
@@ -0,0 +1,325 @@
+"""
+A pool of MDI engines which keeps analyzing tasks when some of the engines fail.
+"""
+
+import time
+import threading
+
+from collections import deque
+
+# Use local MDI build
+import mdi.MDI_Library as mdi
+
+
+class EnginePool:
+    """
+    The engines connected to the driver, and the health of each of them.
+
+    An engine fails if its communication raises an MDI error (for example because the engine
+    has crashed and its connection is closed), or if a task takes longer than `timeout`. The
+    task of a failed engine is given to the remaining engines, and the failed engine is not
+    given any further tasks. Any other exception is raised by `run`.
+
+    Engines which connect while the tasks are analyzed can be added to the pool with `accept`.
+
+    Parameters
+    ----------
+    engine_comm : list
+        The MDI communicators of the engines, as returned by `connect_to_engines`.
+
+    timeout : float, optional
+        The number of seconds after which an engine which has not finished its task is
+        considered to have failed. By default, there is no timeout.
+    """
+
+    def __init__(self, engine_comm, timeout=None):
+        self.engine_comm = list(engine_comm)
+        self.timeout = timeout
+        self.healthy = [True for comm in self.engine_comm]
+
+        self._condition = threading.Condition()
+
+        # Guards the iterator of the tasks, which is read without holding the condition.
+        self._tasks_lock = threading.Lock()
+
+        # The engines which have failed by timing out, and may still be running.
+        self._timed_out = set()
+
+        # The tasks of failed engines, which are analyzed before any new tasks.
+        self._retry = deque()
+
+        # The task of each busy engine, and the time at which it was started.
+        self._in_flight = {}
+
+        self._working = set()
+        self._exhausted = False
+        self._error = None
+
+        # The arguments of `run`, while the tasks are analyzed.
+        self._running = False
+        self._tasks = None
+        self._communicate = [None for comm in self.engine_comm]
+        self._analyze = None
+
+        self._closed = False
+
+    @property
+    def healthy_comm(self):
+        """
+        The MDI communicators of the engines which have not failed.
+        """
+        return [
+            comm for comm, healthy in zip(self.engine_comm, self.healthy) if healthy
+        ]
+
+    def run(self, tasks, communicate, analyze):
+        """
+        Analyze tasks with all healthy engines until there are no tasks left.
+
+        Each engine is driven by a thread of its own, and takes the next task as soon as it
+        has finished its previous one. A thread whose engine has timed out is abandoned, as
+        the blocking MDI call cannot be interrupted.
+
+        Parameters
+        ----------
+        tasks : iterator
+            The tasks to analyze. A task may be given to several engines in turn, so it must
+            not refer to memory which is reused by later tasks.
+
+        communicate : list
+            A callable for each engine, which is called with a task, sends it to the engine,
+            and returns the data received from the engine.
+
+        analyze : callable
+            Called with a task and the data returned by `communicate` for it. Each task is
+            analyzed exactly once, even if it was sent to several engines.
+
+        Raises
+        ------
+        Exception
+            If all engines fail before the tasks are finished, or if `communicate` raises
+            anything but an MDI error, or if `analyze` raises.
+        """
+        with self._condition:
+            self._exhausted = False
+            self._error = None
+
+            self._tasks = tasks
+            self._analyze = analyze
+            self._communicate[: len(communicate)] = communicate
+            self._running = True
+
+            for iengine, healthy in enumerate(self.healthy):
+                if healthy:
+                    self._start(iengine)
+
+            while self._working:
+                if self.timeout is None:
+                    self._condition.wait()
+                    continue
+
+                self._condition.wait(min(self.timeout, 1.0))
+
+                now = time.monotonic()
+                for iengine, (task, start) in list(self._in_flight.items()):
+                    if now - start > self.timeout:
+                        self._timed_out.add(iengine)
+                        self._fail(iengine, f"no reply after {self.timeout} s")
+
+            self._running = False
+
+            if self._error is not None:
+                raise self._error
+
+            unfinished = len(self._retry) + len(self._in_flight)
+            if unfinished or not self._exhausted:
+                raise Exception(
+                    "All engines have failed, and some tasks could not be analyzed"
+                )
+
+    def accept(self, setup):
+        """
+        Keep accepting engines in a background thread, and add them to the pool.
+
+        Each engine is added as soon as it has been set up, and is given tasks right away if
+        the tasks are being analyzed. Accepting blocks until an engine connects, so the thread
+        is abandoned when the driver exits.
+
+        Parameters
+        ----------
+        setup : callable
+            Called with the MDI communicator of each new engine. It prepares the engine for
+            the tasks, and returns the callable which communicates a task to the engine (as
+            passed to `run`). It raises an exception if the engine cannot be used.
+        """
+        thread = threading.Thread(target=self._listen, args=(setup,), daemon=True)
+        thread.start()
+
+    def close(self):
+        """
+        Stop adding engines, and return the MDI communicators of the engines to send EXIT.
+
+        These are the healthy engines, and the engines which have timed out, as they may still
+        be running. Engines which are accepted after this are sent EXIT.
+        """
+        with self._condition:
+            self._closed = True
+            return [
+                comm
+                for iengine, comm in enumerate(self.engine_comm)
+                if self.healthy[iengine] or iengine in self._timed_out
+            ]
+
+    def _listen(self, setup):
+        """
+        Accept engines until the pool is closed.
+        """
+        while True:
+            comm = mdi.MDI_Accept_Communicator()
+            if comm == mdi.MDI_COMM_NULL:
+                # For example, because the maximum number of communicators has been reached.
+                print("No more engines can be accepted.")
+                return
+
+            with self._condition:
+                closed = self._closed
+            if closed:
+                mdi.MDI_Send_Command("EXIT", comm)
+                continue
+
+            try:
+                communicate = setup(comm)
+            except Exception as e:
+                print(f"Engine could not be added ({e!r}).")
+                mdi.MDI_Send_Command("EXIT", comm)
+                continue
+
+            self._add(comm, communicate)
+
+    def _add(self, comm, communicate):
+        """
+        Add an engine which has been set up, and start it if the tasks are being analyzed.
+        """
+        with self._condition:
+            if self._closed:
+                mdi.MDI_Send_Command("EXIT", comm)
+                return
+
+            iengine = len(self.engine_comm)
+            self.engine_comm.append(comm)
+            self.healthy.append(True)
+            self._communicate.append(communicate)
+
+            print(
+                f"Engine {iengine} joined; continuing with {sum(self.healthy)} engine(s)."
+            )
+
+            if self._running:
+                self._start(iengine)
+
+    def _start(self, iengine):
+        """
+        Start the thread which analyzes tasks with an engine.
+
+        Must be called while holding the condition.
+        """
+        thread = threading.Thread(target=self._work, args=(iengine,), daemon=True)
+        self._working.add(iengine)
+        thread.start()
+
+    def _work(self, iengine):
+        """
+        Analyze tasks with one engine until there are no tasks left, or the engine fails.
+        """
+        tasks = self._tasks
+        communicate = self._communicate[iengine]
+        analyze = self._analyze
+
+        try:
+            while True:
+                task = self._next_task(iengine, tasks)
+                if task is None:
+                    return
+
+                try:
+                    data = communicate(task)
+                except mdi.MDI_Error as e:
+                    with self._condition:
+                        self._fail(iengine, repr(e))
+                    return
+
+                with self._condition:
+                    # The task has been given to another engine if this one timed out.
+                    if iengine not in self._in_flight:
+                        return
+                    del self._in_flight[iengine]
+                    self._condition.notify_all()
+
+                analyze(task, data)
+
+        except Exception as e:
+            with self._condition:
+                if self._error is None:
+                    self._error = e
+
+        finally:
+            with self._condition:
+                self._working.discard(iengine)
+                self._condition.notify_all()
+
+    def _next_task(self, iengine, tasks):
+        """
+        Take the next task for an engine, waiting while a task of another engine may still fail.
+
+        Returns None once all tasks have been taken and no other engine is busy.
+        """
+        while True:
+            with self._condition:
+                if self._error is not None or not self.healthy[iengine]:
+                    return None
+
+                if self._retry:
+                    task = self._retry.popleft()
+                    self._in_flight[iengine] = (task, time.monotonic())
+                    return task
+
+                if self._exhausted:
+                    if not self._in_flight:
+                        return None
+                    self._condition.wait()
+                    continue
+
+            # Reading a task may block, so the condition is not held, to let the other
+            # engines report back and the timeouts be checked in the meantime.
+            with self._tasks_lock:
+                task = next(tasks, None)
+
+            with self._condition:
+                if task is None:
+                    self._exhausted = True
+                    continue
+
+                self._in_flight[iengine] = (task, time.monotonic())
+                return task
+
+    def _fail(self, iengine, reason):
+        """
+        Mark an engine as failed, and give its task to the remaining engines.
+
+        Must be called while holding the condition.
+        """
+        if not self.healthy[iengine]:
+            return
+
+        self.healthy[iengine] = False
+        self._working.discard(iengine)
+
+        if iengine in self._in_flight:
+            task, start = self._in_flight.pop(iengine)
+            self._retry.append(task)
+
+        print(
+            f"Engine {iengine} failed ({reason}); "
+            f"continuing with {sum(self.healthy)} engine(s)."
+        )
+        self._condition.notify_all()
@@ -31,6 +31,10 @@ except (ValueError, AttributeError, OSError) as e:
     mdi = ctypes.WinDLL(mdi_path)
     MDI_COMMAND_LENGTH = ctypes.c_int.in_dll(mdi, "MDI_COMMAND_LENGTH").value
 
+class MDI_Error(Exception):
+    """ Raised when a call to the MDI Library fails, for example because a connection was lost. """
+    pass
+
 # MDI Variables
 MDI_COMMAND_LENGTH = ctypes.c_int.in_dll(mdi, "MDI_COMMAND_LENGTH").value
 MDI_NAME_LENGTH = ctypes.c_int.in_dll(mdi, "MDI_NAME_LENGTH").value
@@ -445,7 +449,7 @@ def MDI_Get_plugin_mode():
     plugin_mode = ctypes.c_int()
     ret = mdi.MDI_Get_plugin_mode(ctypes.byref(plugin_mode))
     if ret != 0:
-        raise Exception("MDI Error: MDI_Get_plugin_mode failed")
+        raise MDI_Error("MDI Error: MDI_Get_plugin_mode failed")
     return plugin_mode.value
 
 
@@ -456,7 +460,7 @@ def MDI_Get_python_plugin_mpi_world_ptr():
     python_plugin_mpi_world_ptr = ctypes.c_void_p()
     ret = mdi.MDI_Get_python_plugin_mpi_world_ptr(ctypes.byref(python_plugin_mpi_world_ptr))
     if ret != 0:
-        raise Exception("MDI Error: MDI_Get_python_plugin_mpi_world_ptr failed")
+        raise MDI_Error("MDI Error: MDI_Get_python_plugin_mpi_world_ptr failed")
     return python_plugin_mpi_world_ptr.value
 
 
@@ -560,7 +564,7 @@ def MDI_Init(arg1, arg2 = None):
     command = arg1.encode('utf-8')
     ret = mdi.MDI_Init_with_options(ctypes.c_char_p(command) )
     if ret != 0:
-        raise Exception("MDI Error: MDI_Init failed")
+        raise MDI_Error("MDI Error: MDI_Init failed")
 
     return ret
 
@@ -583,7 +587,7 @@ def MDI_Accept_communicator():
     comm = ctypes.c_int()
     ret = mdi.MDI_Accept_Communicator(ctypes.byref(comm))
     if ret != 0:
-        raise Exception("MDI Error: MDI_Accept_Communicator failed")
+        raise MDI_Error("MDI Error: MDI_Accept_Communicator failed")
     return comm.value
 def MDI_Accept_Communicator():
     return MDI_Accept_communicator()
@@ -601,13 +605,15 @@ def MDI_Send(arg1, arg2, arg3, arg4):
         arg_type = ctypes.c_int
         mdi_type = MDI_INT
         if use_numpy:
-            data_temp = arg1.astype(np.int32)
+            # only copy the array if it is not already contiguous with the right type
+            data_temp = np.ascontiguousarray(arg1, dtype=np.int32)
             data = data_temp.ctypes.data_as(ctypes.c_char_p)
     elif (arg3 == MDI_DOUBLE):
         arg_type = ctypes.c_double
         mdi_type = MDI_DOUBLE
         if use_numpy:
-            data_temp = arg1.astype(np.float64)
+            # only copy the array if it is not already contiguous with the right type
+            data_temp = np.ascontiguousarray(arg1, dtype=np.float64)
             data = data_temp.ctypes.data_as(ctypes.c_char_p)
     elif (arg3 == MDI_BYTE):
         arg_type = ctypes.c_char
@@ -642,10 +648,33 @@ def MDI_Send(arg1, arg2, arg3, arg4):
 
     ret = mdi.MDI_Send(data, arg2, ctypes.c_int(mdi_type), arg4)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Send failed")
+        raise MDI_Error("MDI Error: MDI_Send failed")
 
 # MDI_Recv
 mdi.MDI_Recv.restype = ctypes.c_int
+
+# Each prototype of MDI_Recv is a separate function object with its own argtypes,
+# so that the argtypes are not reassigned on every call, and calls from different
+# threads do not interfere with each other.
+def _recv_prototype(buf_type):
+    func = mdi["MDI_Recv"]
+    func.argtypes = [buf_type, ctypes.c_int, ctypes.c_int, ctypes.c_int]
+    func.restype = ctypes.c_int
+    return func
+
+_recv_char = _recv_prototype(ctypes.POINTER(ctypes.c_char))
+if found_numpy:
+    _recv_numpy = {
+        MDI_INT: (np.int32, _recv_prototype(np.ctypeslib.ndpointer(dtype=np.int32, flags='C_CONTIGUOUS'))),
+        MDI_DOUBLE: (np.float64, _recv_prototype(np.ctypeslib.ndpointer(dtype=np.float64, flags='C_CONTIGUOUS'))),
+    }
+_recv_ctypes = {
+    MDI_INT: ctypes.c_int,
+    MDI_DOUBLE: ctypes.c_double,
+    MDI_BYTE: ctypes.c_char,
+    MDI_CHAR: ctypes.c_char,
+}
+
 def MDI_Recv(arg2, arg3, arg4, buf = None):
     if buf is None:
         use_numpy = False
@@ -653,40 +682,22 @@ def MDI_Recv(arg2, arg3, arg4, buf = None):
         use_numpy = True
     if use_numpy and not found_numpy:
         raise Exception("MDI Error: Attempting to use a Numpy array, but the Numpy package was not found")
-    if (arg3 == MDI_INT):
-        if use_numpy:
-            mdi.MDI_Recv.argtypes = [np.ctypeslib.ndpointer(dtype=np.int32, flags='C_CONTIGUOUS'), 
-                                     ctypes.c_int, ctypes.c_int, ctypes.c_int]
-        else:
-            mdi.MDI_Recv.argtypes = [ctypes.POINTER(ctypes.c_char), ctypes.c_int, ctypes.c_int, ctypes.c_int]
-        arg_type = ctypes.c_int
-        mdi_type = MDI_INT
-    elif (arg3 == MDI_DOUBLE):
-        if use_numpy:
-            mdi.MDI_Recv.argtypes = [np.ctypeslib.ndpointer(dtype=np.float64, flags='C_CONTIGUOUS'), 
-                                     ctypes.c_int, ctypes.c_int, ctypes.c_int]
-        else:
-            mdi.MDI_Recv.argtypes = [ctypes.POINTER(ctypes.c_char), ctypes.c_int, ctypes.c_int, ctypes.c_int]
-        arg_type = ctypes.c_double
-        mdi_type = MDI_DOUBLE
-    elif (arg3 == MDI_BYTE):
-        mdi.MDI_Recv.argtypes = [ctypes.POINTER(ctypes.c_char), ctypes.c_int, ctypes.c_int, ctypes.c_int]
-        arg_type = ctypes.c_char
-        mdi_type = MDI_BYTE
-    elif (arg3 == MDI_CHAR):
-        mdi.MDI_Recv.argtypes = [ctypes.POINTER(ctypes.c_char), ctypes.c_int, ctypes.c_int, ctypes.c_int]
-        arg_type = ctypes.c_char
-        mdi_type = MDI_CHAR
-    else:
+    if arg3 not in _recv_ctypes:
         raise Exception("MDI Error: Unrecognized datatype in MDI_Recv")
+    arg_type = _recv_ctypes[arg3]
+
+    if use_numpy and arg3 in _recv_numpy:
+        func = _recv_numpy[arg3][1]
+    else:
+        func = _recv_char
 
     if not use_numpy:
         arg_size = ctypes.sizeof(arg_type)
         buf = (ctypes.c_char*(arg2*arg_size))()
 
-    ret = mdi.MDI_Recv(buf, arg2, ctypes.c_int(mdi_type), arg4)
+    ret = func(buf, arg2, ctypes.c_int(arg3), arg4)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Recv failed")
+        raise MDI_Error("MDI Error: MDI_Recv failed")
 
     if use_numpy:
         return None
@@ -701,10 +712,25 @@ def MDI_Recv(arg2, arg3, arg4, buf = None):
         if arg2 == 1:
             presult = result[0]
         else:
-            presult = [ result[i] for i in range(arg2) ]
+            presult = result[:]
 
     return presult
 
+# MDI_Recv, receiving directly into a new Numpy array
+def MDI_Recv_Numpy(arg2, arg3, arg4):
+    if not found_numpy:
+        raise Exception("MDI Error: Attempting to use a Numpy array, but the Numpy package was not found")
+    if arg3 not in _recv_numpy:
+        raise Exception("MDI Error: MDI_Recv_Numpy only supports MDI_INT and MDI_DOUBLE")
+    dtype, func = _recv_numpy[arg3]
+
+    buf = np.empty(arg2, dtype=dtype)
+    ret = func(buf, arg2, ctypes.c_int(arg3), arg4)
+    if ret != 0:
+        raise MDI_Error("MDI Error: MDI_Recv failed")
+
+    return buf
+
 # MDI_Send_Command
 mdi.MDI_Send_Command.argtypes = [ctypes.POINTER(ctypes.c_char), ctypes.c_int]
 mdi.MDI_Send_Command.restype = ctypes.c_int
@@ -712,7 +738,7 @@ def MDI_Send_command(arg1, arg2):
     command = arg1.encode('utf-8')
     ret = mdi.MDI_Send_Command(ctypes.c_char_p(command), arg2)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Send_Command failed")
+        raise MDI_Error("MDI Error: MDI_Send_Command failed")
 def MDI_Send_Command(arg1, arg2):
     return MDI_Send_command(arg1, arg2)
 
@@ -725,7 +751,7 @@ def MDI_Recv_command(arg2):
 
     ret = mdi.MDI_Recv_Command(arg1, arg2)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Recv_Command failed")
+        raise MDI_Error("MDI Error: MDI_Recv_Command failed")
 
     result = ctypes.cast(arg1, ctypes.POINTER(ctypes.c_char*MDI_COMMAND_LENGTH)).contents
     presult = ctypes.cast(result, ctypes.c_char_p).value
@@ -748,7 +774,7 @@ def MDI_Conversion_factor(arg1, arg2):
     conversion = ctypes.c_double()
     ret = mdi.MDI_Conversion_Factor(ctypes.c_char_p(in_unit), ctypes.c_char_p(out_unit), ctypes.byref(conversion))
     if ret != 0:
-        raise Exception("MDI Error: MDI_Conversion_Factor failed")
+        raise MDI_Error("MDI Error: MDI_Conversion_Factor failed")
     return conversion.value
 def MDI_Conversion_Factor(arg1, arg2):
     return MDI_Conversion_factor(arg1, arg2)
@@ -760,7 +786,7 @@ def MDI_Get_role():
     role = ctypes.c_int()
     ret = mdi.MDI_Get_Role(ctypes.byref(role))
     if ret != 0:
-        raise Exception("MDI Error: MDI_Get_Role failed")
+        raise MDI_Error("MDI Error: MDI_Get_Role failed")
     return role.value
 def MDI_Get_Role():
     return MDI_Get_role()
@@ -805,7 +831,7 @@ def MDI_Set_execute_command_func(func, class_obj):
 
     ret = mdi.MDI_Set_Execute_Command_Func( MDI_Execute_Command_c, class_obj_pointer )
     if ret != 0:
-        raise Exception("MDI Error: MDI_Set_Execute_Command_Func failed")
+        raise MDI_Error("MDI Error: MDI_Set_Execute_Command_Func failed")
 def MDI_Set_Execute_Command_Func(func, class_obj):
     return MDI_Set_execute_command_func(func, class_obj)
 
@@ -821,7 +847,7 @@ def MDI_Register_node(arg1):
     node = arg1.encode('utf-8')
     ret = mdi.MDI_Register_Node(ctypes.c_char_p(node))
     if ret != 0:
-        raise Exception("MDI Error: MDI_Register_Node failed")
+        raise MDI_Error("MDI Error: MDI_Register_Node failed")
 
     return ret
 def MDI_Register_Node(arg1):
@@ -838,7 +864,7 @@ def MDI_Check_node_exists(arg1, arg2):
 
     ret = mdi.MDI_Check_Node_Exists(ctypes.c_char_p(node), arg2, flag)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Check_Node_Exists failed")
+        raise MDI_Error("MDI Error: MDI_Check_Node_Exists failed")
     flag_cast = ctypes.cast(flag, ctypes.POINTER(ctypes.c_int)).contents
 
     return flag_cast.value
@@ -854,7 +880,7 @@ def MDI_Get_nnodes(arg2):
 
     ret = mdi.MDI_Get_NNodes(arg2, nnodes)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Get_NNodes failed")
+        raise MDI_Error("MDI Error: MDI_Get_NNodes failed")
     nnodes_cast = ctypes.cast(nnodes, ctypes.POINTER(ctypes.c_int)).contents
 
     return nnodes_cast.value
@@ -870,7 +896,7 @@ def MDI_Get_node(index, arg2):
 
     ret = mdi.MDI_Get_Node(index, arg2, node_name)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Get_Node failed")
+        raise MDI_Error("MDI Error: MDI_Get_Node failed")
 
     result = ctypes.cast(node_name, ctypes.POINTER(ctypes.c_char*MDI_COMMAND_LENGTH)).contents
     presult = ctypes.cast(result, ctypes.c_char_p).value
@@ -887,7 +913,7 @@ def MDI_Register_command(arg1, arg2):
     command = arg2.encode('utf-8')
     ret = mdi.MDI_Register_Command(ctypes.c_char_p(node), ctypes.c_char_p(command))
     if ret != 0:
-        raise Exception("MDI Error: MDI_Get_Callback failed")
+        raise MDI_Error("MDI Error: MDI_Get_Callback failed")
 
     return ret
 def MDI_Register_Command(arg1, arg2):
@@ -905,7 +931,7 @@ def MDI_Check_command_exists(arg1, command_name, arg2):
 
     ret = mdi.MDI_Check_Command_Exists(ctypes.c_char_p(node), ctypes.c_char_p(command), arg2, flag)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Check_Command_Exists failed")
+        raise MDI_Error("MDI Error: MDI_Check_Command_Exists failed")
     flag_cast = ctypes.cast(flag, ctypes.POINTER(ctypes.c_int)).contents
 
     return flag_cast.value
@@ -923,7 +949,7 @@ def MDI_Get_ncommands(arg1, arg2):
 
     ret = mdi.MDI_Get_NCommands(ctypes.c_char_p(node), arg2, ncommands)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Get_NCommands failed")
+        raise MDI_Error("MDI Error: MDI_Get_NCommands failed")
     ncommands_cast = ctypes.cast(ncommands, ctypes.POINTER(ctypes.c_int)).contents
 
     return ncommands_cast.value
@@ -941,7 +967,7 @@ def MDI_Get_command(node_name, index, arg2):
 
     ret = mdi.MDI_Get_Command(ctypes.c_char_p(node), index, arg2, command_name)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Get_Command failed")
+        raise MDI_Error("MDI Error: MDI_Get_Command failed")
 
     return c_ptr_to_py_str(command_name, MDI_COMMAND_LENGTH)
 def MDI_Get_Command(node_name, index, arg2):
@@ -955,7 +981,7 @@ def MDI_Register_callback(arg1, arg2):
     callback = arg2.encode('utf-8')
     ret =  mdi.MDI_Register_Callback(ctypes.c_char_p(node), ctypes.c_char_p(callback))
     if ret != 0:
-        raise Exception("MDI Error: MDI_Register_Callback failed")
+        raise MDI_Error("MDI Error: MDI_Register_Callback failed")
 
     return ret
 def MDI_Register_Callback(arg1, arg2):
@@ -973,7 +999,7 @@ def MDI_Check_callback_exists(arg1, callback_name, arg2):
 
     ret = mdi.MDI_Check_Callback_Exists(ctypes.c_char_p(node), ctypes.c_char_p(callback), arg2, flag)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Check_Callback_Exists failed")
+        raise MDI_Error("MDI Error: MDI_Check_Callback_Exists failed")
     flag_cast = ctypes.cast(flag, ctypes.POINTER(ctypes.c_int)).contents
 
     return flag_cast.value
@@ -991,7 +1017,7 @@ def MDI_Get_ncallbacks(arg1, arg2):
 
     ret = mdi.MDI_Get_NCallbacks(ctypes.c_char_p(node), arg2, ncallbacks)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Get_NCallbacks failed")
+        raise MDI_Error("MDI Error: MDI_Get_NCallbacks failed")
     ncallbacks_cast = ctypes.cast(ncallbacks, ctypes.POINTER(ctypes.c_int)).contents
 
     return ncallbacks_cast.value
@@ -1009,7 +1035,7 @@ def MDI_Get_callback(node_name, index, arg2):
 
     ret = mdi.MDI_Get_Callback(ctypes.c_char_p(node), index, arg2, callback_name)
     if ret != 0:
-        raise Exception("MDI Error: MDI_Get_Callback failed")
+        raise MDI_Error("MDI Error: MDI_Get_Callback failed")
 
     return c_ptr_to_py_str(callback_name, MDI_COMMAND_LENGTH)
 def MDI_Get_Callback(node_name, index, arg2):
@@ -1028,7 +1054,7 @@ def MDI_Plugin_get_argc():
     argc = ctypes.c_int()
     ret = mdi.MDI_Plugin_get_argc(ctypes.byref(argc))
     if ret != 0:
-        raise Exception("MDI Error: MDI_Plugin_get_argc failed")
+        raise MDI_Error("MDI Error: MDI_Plugin_get_argc failed")
     return argc.value
 
 # MDI_Plugin_get_arg
@@ -1038,5 +1064,5 @@ def MDI_Plugin_get_arg(index):
     arg = ctypes.c_char_p()
     ret = mdi.MDI_Plugin_get_arg(index, ctypes.byref(arg))
     if ret != 0:
-        raise Exception("MDI Error: MDI_Plugin_get_arg failed")
+        raise MDI_Error("MDI Error: MDI_Plugin_get_arg failed")
     return c_ptr_to_py_str(arg, len(arg.value) )
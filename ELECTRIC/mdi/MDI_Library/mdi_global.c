@@ -109,6 +109,34 @@ int vector_init(vector* v, size_t stride) {
   return 0;
 }
 
+/*! \brief Allocate storage for a number of elements in a vector
+ *
+ * Elements are not moved when new elements are appended, until the size of the vector exceeds
+ * the reserved capacity.
+ *
+ * \param [in]       v
+ *                   Pointer to the vector
+ * \param [in]       capacity
+ *                   Number of elements to allocate storage for
+ */
+int vector_reserve(vector* v, size_t capacity) {
+  if (capacity <= v->capacity) {
+    return 0;
+  }
+
+  void* new_data = malloc( v->stride * capacity );
+  if (!new_data) {
+    perror("Could not reserve vector storage");
+    exit(-1);
+  }
+  memcpy(new_data, v->data, v->size * v->stride);
+  free(v->data);
+  v->data = new_data;
+  v->capacity = capacity;
+
+  return 0;
+}
+
 /*! \brief Append a new element to the end of the vector
  *
  * \param [in]       v
@@ -301,6 +329,9 @@ int new_code() {
   // initialize the comms vector
   vector* comms_vec = malloc(sizeof(vector));
   vector_init(comms_vec, sizeof(communicator));
+  // reserve storage, so that accepting a communicator does not move the existing
+  // communicators while they are used by other threads
+  vector_reserve(comms_vec, COMMS_CAPACITY);
   new_code.comms = comms_vec;
 
   new_code.is_library = 0;
@@ -25,6 +25,7 @@
 #define COMMAND_LENGTH 12
 #define NAME_LENGTH 12
 #define PLUGIN_PATH_LENGTH 2048
+#define COMMS_CAPACITY 1024
 
 // Defined languages
 #define MDI_LANGUAGE_C 1
@@ -242,6 +243,7 @@ extern int world_rank;
 
 int vector_init(vector* v, size_t stride);
 int vector_push_back(vector* v, void* element);
+int vector_reserve(vector* v, size_t capacity);
 void* vector_get(vector* v, int index);
 int vector_delete(vector* v, int index);
 int vector_free(vector* v);
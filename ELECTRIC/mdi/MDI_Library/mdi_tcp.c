@@ -355,6 +355,18 @@ int tcp_accept_connection() {
       return 1;
     }
 
+    // The storage of the communicators is reserved, so that other threads can keep using
+    // them while a connection is accepted. Refuse connections which would not fit.
+    if ( this_code->comms->size >= COMMS_CAPACITY ) {
+#ifdef _WIN32
+      closesocket(connection);
+#else
+      close(connection);
+#endif
+      mdi_error("Could not accept connection: the maximum number of communicators has been reached");
+      return 1;
+    }
+
     MDI_Comm comm_id = new_communicator(this_code->id, MDI_TCP);
     communicator* new_comm = get_communicator(this_code->id, comm_id);
     new_comm->sockfd = connection;
@@ -502,7 +514,8 @@ int tcp_recv(void* buf, int count, MDI_Datatype datatype, MDI_Comm comm, int msg
     n+=nr;
   }
 
-  if (n == 0) { 
+  // the connection may also break after part of the data has been read
+  if (n < 0 || (size_t)n < count_t*datasize) {
     mdi_error("Error reading from socket: server has quit or connection broke");
     return 1;
   }
@@ -0,0 +1,108 @@
+"""
+Pipelined communication with MDI engines.
+
+MDI engines handle commands in the order they are received, so a driver does not need to
+wait for the reply to one command before sending the next. A `CommandPipeline` queues a
+sequence of commands and payloads for a communicator, sends them all at once, and then
+receives all replies into buffers provided by the caller. Over TCP, this costs roughly one
+round trip per sequence instead of one per command.
+"""
+
+import numpy as np
+
+# Use local MDI build
+import mdi.MDI_Library as mdi
+
+
+class CommandPipeline:
+    """
+    A queue of commands for one MDI communicator, which are sent together.
+
+    Commands are sent in the order they were queued. The replies are received in the same
+    order, after all commands have been sent.
+
+    Parameters
+    ----------
+    comm : MDI_Comm
+        The MDI communicator of the engine.
+
+    Examples
+    --------
+    >>> pipeline = CommandPipeline(comm)
+    >>> pipeline.send(">COORDS", coords, mdi.MDI_DOUBLE)
+    >>> pipeline.request("<DFIELD", dfield, mdi.MDI_DOUBLE)
+    >>> pipeline.request("<UFIELD", ufield, mdi.MDI_DOUBLE)
+    >>> pipeline.run()
+    """
+
+    def __init__(self, comm):
+        self.comm = comm
+        self._queued = []
+        self._pending = []
+
+    def send(self, command, data=None, datatype=mdi.MDI_DOUBLE):
+        """
+        Queue a command, and optionally the data sent with it.
+
+        Parameters
+        ----------
+        command : str
+            The MDI command, for example ">COORDS".
+
+        data : np.ndarray, optional
+            The data sent after the command. The array is not copied, so it must not be
+            modified before the pipeline is flushed.
+
+        datatype : int, optional
+            The MDI datatype of `data`. The default is MDI_DOUBLE.
+        """
+        self._queued.append((command, data, datatype, None))
+
+    def request(self, command, buf, datatype=mdi.MDI_DOUBLE):
+        """
+        Queue a command whose reply is received into `buf`.
+
+        Parameters
+        ----------
+        command : str
+            The MDI command, for example "<DFIELD".
+
+        buf : np.ndarray
+            A C-contiguous array with the size and type of the reply, which the reply is
+            received into when the pipeline is flushed.
+
+        datatype : int, optional
+            The MDI datatype of the reply, MDI_INT or MDI_DOUBLE. The default is MDI_DOUBLE.
+        """
+        self._queued.append((command, None, datatype, buf))
+
+    def flush(self):
+        """
+        Send all queued commands and data, without waiting for any replies.
+
+        The replies must be received with `receive` before the engine is sent anything else.
+        """
+        for command, data, datatype, buf in self._queued:
+            mdi.MDI_Send_Command(command, self.comm)
+            if data is not None:
+                mdi.MDI_Send(data, np.size(data), datatype, self.comm)
+            if buf is not None:
+                self._pending.append((buf, datatype))
+
+        self._queued = []
+
+    def receive(self):
+        """
+        Receive the replies to all flushed requests, in the order they were queued.
+        """
+        for buf, datatype in self._pending:
+            mdi.MDI_Recv(buf.size, datatype, self.comm, buf=buf)
+
+        self._pending = []
+
+    def run(self):
+        """
+        Send all queued commands and data, then receive all replies.
+        """
+        self.flush()
+        self.receive()
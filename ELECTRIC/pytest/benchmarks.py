@@ -0,0 +1,138 @@
+"""
+Benchmarks for the per-frame analysis performed by the driver.
+
+Run with `python benchmarks.py`. These are not collected by pytest.
+"""
+
+import os
+import sys
+import timeit
+
+import argparse
+
+import numpy as np
+
+from itertools import combinations
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+import util
+
+base_location = os.path.dirname(os.path.realpath(__file__))
+pdb_path = os.path.join(base_location, "..", "..", "test", "pytest_data", "ke15.pdb")
+
+
+def benchmark_fragment_reduction(nprobes=2, repeat=3):
+    """
+    Compare the loop over probes and fragments with the vectorized fragment reduction,
+    using the atoms and residues of ke15.pdb (48051 atoms, 255 residues).
+    """
+    residues = np.array(util.process_pdb(pdb_path)[0])
+    natoms = len(residues)
+
+    rng = np.random.default_rng(0)
+    field = rng.random((nprobes, natoms, 3))
+
+    cases = [
+        ("residue", residues, np.arange(natoms) + 1),
+        # Shuffle the pole indices so that the poles are not ordered by fragment.
+        ("residue, shuffled poles", residues, rng.permutation(natoms) + 1),
+        ("atom", np.arange(natoms) + 1, np.arange(natoms) + 1),
+    ]
+
+    for name, fragment_list, ipoles in cases:
+        atoms_pole_numbers = util.index_fragments(fragment_list, ipoles)[0]
+        fragment_index = util.fragment_scatter_index(atoms_pole_numbers, natoms)
+
+        def loop():
+            return np.array(
+                [
+                    field[x, atoms_pole_numbers[i] - 1].sum(axis=0)
+                    for x in range(nprobes)
+                    for i in range(len(atoms_pole_numbers))
+                ]
+            ).reshape(nprobes, len(atoms_pole_numbers), 3)
+
+        def vectorized():
+            return util.reduce_to_fragments(field, *fragment_index)
+
+        assert np.allclose(loop(), vectorized())
+
+        loop_time = min(timeit.repeat(loop, number=1, repeat=repeat))
+        vectorized_time = min(timeit.repeat(vectorized, number=1, repeat=repeat))
+
+        print(
+            f"Fragment reduction by {name} ({natoms} poles, "
+            f"{len(atoms_pole_numbers)} fragments, {nprobes} probes)"
+        )
+        print(f"    loop:       {loop_time:.6f} s")
+        print(f"    vectorized: {vectorized_time:.6f} s")
+        print(f"    speedup:    {loop_time / vectorized_time:.1f}x")
+
+
+def benchmark_pair_projection(nprobes=40, repeat=3):
+    """
+    Compare the loop over probe pairs with the batched projection of the field onto the
+    direction between each pair of probes, using the residues and atoms of ke15.pdb.
+    """
+    residues = np.array(util.process_pdb(pdb_path)[0])
+    natoms = len(residues)
+
+    rng = np.random.default_rng(0)
+    probe_coordinates = rng.random((nprobes, 3)) * 50
+    pairs = np.array(list(combinations(range(nprobes), 2)))
+
+    for name, nfragments in [
+        ("residue", len(np.unique(residues))),
+        ("atom", natoms),
+    ]:
+        totfield = rng.random((nprobes, nfragments, 3))
+
+        def loop():
+            efield = np.zeros((len(pairs), nfragments))
+            for i, combo in enumerate(pairs):
+                avg_field = (totfield[combo[0]] + totfield[combo[1]]) / 2
+                coord1 = probe_coordinates[combo[0]]
+                coord2 = probe_coordinates[combo[1]]
+                dir_vec = (coord2 - coord1) / np.linalg.norm(coord2 - coord1)
+                efield[i] = np.dot(avg_field, dir_vec)
+            return efield
+
+        def vectorized():
+            return util.project_pairs(totfield, probe_coordinates)
+
+        assert np.allclose(loop(), vectorized())
+
+        loop_time = min(timeit.repeat(loop, number=1, repeat=repeat))
+        vectorized_time = min(timeit.repeat(vectorized, number=1, repeat=repeat))
+
+        print(
+            f"Pair projection by {name} ({nfragments} fragments, "
+            f"{nprobes} probes, {len(pairs)} pairs)"
+        )
+        print(f"    loop:       {loop_time:.6f} s")
+        print(f"    vectorized: {vectorized_time:.6f} s")
+        print(f"    speedup:    {loop_time / vectorized_time:.1f}x")
+
+
+benchmarks = {
+    "reduction": benchmark_fragment_reduction,
+    "projection": benchmark_pair_projection,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "benchmark",
+        nargs="*",
+        default=list(benchmarks),
+        help=f"The benchmarks to run ({', '.join(benchmarks)}). All benchmarks are run if none are given.",
+    )
+    args = parser.parse_args()
+
+    for name in args.benchmark:
+        if name not in benchmarks:
+            parser.error(f"Unknown benchmark {name}")
+
+    for name in args.benchmark:
+        benchmarks[name]()
@@ -0,0 +1,238 @@
+"""
+A Python MDI engine which answers the commands used by the driver, for testing without Tinker.
+
+Every atom is a pole with a point charge (-0.8 for oxygen, 0.4 for hydrogen and 0 otherwise),
+and the molecules are found from the connectivity in the structure file. The direct field is
+the field of the point charges, and the induced field is a tenth of the direct field.
+
+The commands which sum the field over fragments (>NFRAGMENTS, >FRAGMENTS, <FDFIELD,
+<FUFIELD and <FTFIELD) and the total field (<TFIELD) are only registered when requested,
+so that both the per-pole and the per-fragment paths of the driver can be tested.
+
+The engine can also be made slow, or to crash or hang after a number of fields, to test the
+scheduling of frames over engines.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+import mdi.MDI_Library as mdi
+import util
+
+
+def read_structure(filename):
+    """
+    Read the atoms of the first frame of a Tinker xyz or arc file.
+
+    Returns
+    -------
+    charges : np.ndarray
+        The charge of each atom.
+
+    molecules : np.ndarray
+        The (1-indexed) molecule number of each atom.
+    """
+    natoms, skip_line = util.read_arc_header(filename)
+    with open(filename) as f:
+        lines = [line.split() for line in f.readlines()[skip_line : skip_line + natoms]]
+
+    charges = np.array([{"O": -0.8, "H": 0.4}.get(line[1][0], 0.0) for line in lines])
+
+    # Join bonded atoms into molecules.
+    parent = list(range(natoms))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for iatom, line in enumerate(lines):
+        for bonded in line[6:]:
+            parent[find(int(bonded) - 1)] = find(iatom)
+
+    roots = [find(iatom) for iatom in range(natoms)]
+    molecules = np.unique(roots, return_inverse=True)[1] + 1
+
+    return charges, molecules
+
+
+def direct_field(coords, charges, probes):
+    """
+    The field of every point charge at each probe, with shape (probes, atoms, 3).
+    """
+    field = np.zeros((len(probes), len(charges), 3))
+    for iprobe, probe in enumerate(probes):
+        r = coords[probe - 1] - coords
+        d = np.linalg.norm(r, axis=1)
+
+        # A probe does not feel its own field.
+        d[probe - 1] = np.inf
+
+        field[iprobe] = charges[:, None] * r / d[:, None] ** 3
+    return field
+
+
+def reduce_field(field, pole_fragments, nfragments):
+    """
+    Sum a field over the poles of each fragment.
+    """
+    reduced = np.zeros((field.shape[0], nfragments + 1, 3))
+    np.add.at(reduced, (slice(None), pole_fragments), field)
+
+    # Poles in fragment 0 are not in any fragment.
+    return reduced[:, 1:]
+
+
+def run(
+    structure,
+    total_field,
+    fragments,
+    delay=0.0,
+    crash_after=None,
+    hang_after=None,
+    register=True,
+):
+    """
+    Register the supported commands, and answer the commands of the driver until EXIT.
+
+    If `register` is False, no nodes or commands are registered, as for engines which do not
+    report the commands they support.
+    """
+    charges, molecules = read_structure(structure)
+    natoms = len(charges)
+
+    commands = [
+        "EXIT",
+        "<NAME",
+        "<NATOMS",
+        "<NPOLES",
+        "<IPOLES",
+        "<MOLECULES",
+        ">NPROBES",
+        ">PROBES",
+        ">COORDS",
+        "<DFIELD",
+        "<UFIELD",
+    ]
+    if total_field:
+        commands += ["<TFIELD"]
+    if fragments:
+        commands += [">NFRAGMENTS", ">FRAGMENTS", "<FDFIELD", "<FUFIELD"]
+        if total_field:
+            commands += ["<FTFIELD"]
+
+    if register:
+        mdi.MDI_Register_Node("@DEFAULT")
+        for command in commands:
+            mdi.MDI_Register_Command("@DEFAULT", command)
+
+    comm = mdi.MDI_Accept_Communicator()
+
+    coords = np.zeros((natoms, 3))
+    probes = None
+    nfragments = None
+    pole_fragments = None
+    nfields = 0
+
+    while True:
+        command = mdi.MDI_Recv_Command(comm)
+
+        if command not in commands:
+            raise Exception(f"Unsupported command {command}")
+
+        if command == "EXIT":
+            break
+        elif command == "<NAME":
+            mdi.MDI_Send("NO_EWALD", mdi.MDI_NAME_LENGTH, mdi.MDI_CHAR, comm)
+        elif command in ("<NATOMS", "<NPOLES"):
+            mdi.MDI_Send(natoms, 1, mdi.MDI_INT, comm)
+        elif command == "<IPOLES":
+            mdi.MDI_Send(np.arange(1, natoms + 1), natoms, mdi.MDI_INT, comm)
+        elif command == "<MOLECULES":
+            mdi.MDI_Send(molecules, natoms, mdi.MDI_INT, comm)
+        elif command == ">NPROBES":
+            nprobes = mdi.MDI_Recv(1, mdi.MDI_INT, comm)
+        elif command == ">PROBES":
+            probes = mdi.MDI_Recv_Numpy(nprobes, mdi.MDI_INT, comm)
+        elif command == ">NFRAGMENTS":
+            nfragments = mdi.MDI_Recv(1, mdi.MDI_INT, comm)
+        elif command == ">FRAGMENTS":
+            pole_fragments = mdi.MDI_Recv_Numpy(natoms, mdi.MDI_INT, comm)
+        elif command == ">COORDS":
+            mdi.MDI_Recv(3 * natoms, mdi.MDI_DOUBLE, comm, buf=coords)
+        else:
+            if nfields == crash_after:
+                os._exit(1)
+            if nfields == hang_after:
+                while True:
+                    time.sleep(60)
+            nfields += 1
+            time.sleep(delay)
+
+            field = direct_field(coords, charges, probes)
+
+            # The name of the field without the fragment prefix
+            name = command[2:] if command.startswith("<F") else command[1:]
+            if name == "UFIELD":
+                field = 0.1 * field
+            elif name == "TFIELD":
+                field = field + 0.1 * field
+
+            if command.startswith("<F"):
+                field = reduce_field(field, pole_fragments, nfragments)
+
+            field = np.ascontiguousarray(field)
+            mdi.MDI_Send(field, field.size, mdi.MDI_DOUBLE, comm)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("structure", help="A Tinker xyz or arc file.")
+    parser.add_argument("-mdi", help="Flags for MDI.", required=True)
+    parser.add_argument(
+        "--total-field", action="store_true", help="Support the <TFIELD command."
+    )
+    parser.add_argument(
+        "--fragments",
+        action="store_true",
+        help="Support summing the field over fragments.",
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.0,
+        help="The number of seconds to wait before sending each field.",
+    )
+    parser.add_argument(
+        "--crash-after",
+        type=int,
+        help="Exit without replying after sending this number of fields.",
+    )
+    parser.add_argument(
+        "--hang-after",
+        type=int,
+        help="Stop replying after sending this number of fields.",
+    )
+    parser.add_argument(
+        "--no-register",
+        action="store_true",
+        help="Do not register the nodes and commands of the engine.",
+    )
+    args = parser.parse_args()
+
+    mdi.MDI_Init(args.mdi)
+    run(
+        args.structure,
+        args.total_field,
+        args.fragments,
+        delay=args.delay,
+        crash_after=args.crash_after,
+        hang_after=args.hang_after,
+        register=not args.no_register,
+    )
@@ -3,9 +3,12 @@ Some functions to test the driver.
 """
 
 import os
+import json
 import sys
+import itertools
 
 import numpy as np
+import pandas as pd
 import pytest
 
 sys.path.append('../')
@@ -87,3 +90,593 @@ Residue Number       Starting atom        Residue Name
 
     assert reference_report in report
     assert num_lines == num_lines_reference+3
+
+
+def test_count_frames():
+    base_location = os.path.dirname(os.path.realpath(__file__))
+    arc_path = os.path.join(base_location, 'bench5', 'bench5.arc')
+
+    assert util.count_frames(arc_path, 648, 2) == 5
+
+
+@pytest.mark.parametrize("nframes, equil, stride, selection, expected", [
+    (5, 0, 1, None, [1, 2, 3, 4, 5]),
+    (5, 2, 1, None, [3, 4, 5]),
+    (5, 1, 2, None, [3, 5]),
+    (5, 5, 1, None, []),
+    (5, 0, 1, [2, 4, 6], [2, 4]),
+    (5, 1, 2, [2, 3, 4, 5], [3, 5]),
+])
+def test_analysis_frames(nframes, equil, stride, selection, expected):
+    assert list(util.analysis_frames(nframes, equil, stride, selection)) == expected
+
+
+@pytest.mark.parametrize("frames, expected", [
+    ('5', [5]),
+    ('1-3 10', [1, 2, 3, 10]),
+    ('10 1-3 2', [1, 2, 3, 10]),
+    ('4-6,8', [4, 5, 6, 8]),
+])
+def test_parse_frames(frames, expected):
+    assert list(util.parse_frames(frames)) == expected
+
+
+def test_result_store():
+    probes = [1, 40, 7]
+    fragments = [1, 2]
+    store = util.ResultStore([3, 5], fragments, probes, "molecule")
+
+    rng = np.random.default_rng(0)
+    totfield = rng.random((2, 3, 2, 3))
+    efield = rng.random((2, 3, 2))
+
+    # Frames may be added out of order.
+    store.add_frame(1, totfield[1], efield[1])
+    store.add_frame(0, totfield[0], efield[0])
+
+    components = store.components_dataframe()
+    assert components.index.name == "Fragment and Dimension"
+    assert list(components.index[:4]) == [
+        "molecule 1 x dimension",
+        "molecule 1 y dimension",
+        "molecule 1 z dimension",
+        "molecule 2 x dimension",
+    ]
+    assert list(components.columns[:4]) == [
+        "1 - frame 3", "40 - frame 3", "7 - frame 3", "1 - frame 5",
+    ]
+    assert components.loc["molecule 2 y dimension", "40 - frame 5"] == totfield[1, 1, 1, 1]
+
+    output = store.projection_dataframe()
+    assert list(output.index) == ["molecule 1", "molecule 2"]
+    assert list(output.columns) == [
+        "1 and 40 - frame 3", "1 and 7 - frame 3", "40 and 7 - frame 3",
+        "1 and 40 - frame 5", "1 and 7 - frame 5", "40 and 7 - frame 5",
+    ]
+    assert output.loc["molecule 1", "40 and 7 - frame 5"] == efield[1, 2, 0]
+
+
+@pytest.mark.parametrize('output_format', ['npz', 'hdf5'])
+def test_result_store_binary(tmp_path, output_format):
+    store = util.ResultStore([3, 5, 7], [1, 2], [1, 40, 7], 'molecule')
+    rng = np.random.default_rng(0)
+    totfield = rng.random((2, 3, 2, 3))
+    efield = rng.random((2, 3, 2))
+    store.add_frame(2, totfield[1], efield[1])
+    store.add_frame(0, totfield[0], efield[0])
+
+    if output_format == 'npz':
+        store.save_npz(tmp_path / 'electric_field.npz', np.float32)
+        data = np.load(tmp_path / 'electric_field.npz')
+        assert str(data['by_type']) == 'molecule'
+    else:
+        h5py = pytest.importorskip('h5py')
+        store.save_hdf5(tmp_path / 'electric_field.h5', np.float32)
+        data = h5py.File(tmp_path / 'electric_field.h5', 'r')
+        assert data.attrs['by_type'] == 'molecule'
+        assert [dim.label for dim in data['components'].dims] == ['frame', 'molecule', 'probe', 'dimension']
+
+    # Only the frames which were analyzed are stored.
+    assert list(data['frames'][:]) == [3, 7]
+    assert list(data['probes'][:]) == [1, 40, 7]
+    assert data['pairs'][:].tolist() == [[1, 40], [1, 7], [40, 7]]
+
+    components = data['components'][:]
+    assert components.dtype == np.float32
+    assert components.shape == (2, 2, 3, 3)
+    assert np.array_equal(components[1, 0, 2], totfield[1, 2, 0].astype(np.float32))
+
+    projection = data['projection'][:]
+    assert projection.shape == (2, 2, 3)
+    assert np.array_equal(projection[1], efield[1].T.astype(np.float32))
+
+
+def test_result_store_partial():
+    store = util.ResultStore([1, 2, 3], [1], [1, 2], "atom")
+    store.add_frame(1, np.ones((2, 1, 3)), np.ones((1, 1)))
+
+    assert list(store.components_dataframe().columns) == ["1 - frame 2", "2 - frame 2"]
+    assert list(store.projection_dataframe().columns) == ["1 and 2 - frame 2"]
+
+
+def test_running_statistics():
+    frames = list(range(1, 8))
+    rng = np.random.default_rng(0)
+    totfield = rng.random((7, 2, 3, 3))
+    efield = rng.random((7, 1, 3))
+
+    statistics = util.RunningStatistics(frames, [1, 2, 3], [1, 40], 'residue', block_size=3)
+    # Frames may be added out of order.
+    for slot in rng.permutation(7):
+        statistics.add_frame(slot, totfield[slot], efield[slot])
+
+    output = statistics.projection_dataframe()
+    assert list(output.index) == ['residue 1', 'residue 2', 'residue 3']
+    assert list(output.columns) == [
+        '1 and 40 - mean', '1 and 40 - standard deviation', '1 and 40 - min', '1 and 40 - max', '1 and 40 - block error',
+    ]
+    assert np.allclose(output['1 and 40 - mean'], efield[:, 0].mean(axis=0))
+    assert np.allclose(output['1 and 40 - standard deviation'], efield[:, 0].std(axis=0, ddof=1))
+    assert np.allclose(output['1 and 40 - min'], efield[:, 0].min(axis=0))
+    assert np.allclose(output['1 and 40 - max'], efield[:, 0].max(axis=0))
+
+    # The incomplete last block is not used for the error.
+    block_means = efield[:6, 0].reshape(2, 3, 3).mean(axis=1)
+    assert np.allclose(output['1 and 40 - block error'], block_means.std(axis=0, ddof=1) / np.sqrt(2))
+
+    components = statistics.components_dataframe()
+    assert components.index[4] == 'residue 2 y dimension'
+    assert components.columns[5] == '40 - mean'
+    assert np.isclose(components.loc['residue 2 y dimension', '40 - mean'], totfield[:, 1, 1, 1].mean())
+    assert np.isclose(components.loc['residue 3 z dimension', '1 - max'], totfield[:, 0, 2, 2].max())
+
+
+def test_streaming_writer(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    frames = [2, 4, 6, 8, 10]
+    rng = np.random.default_rng(0)
+    totfield = rng.random((5, 2, 3, 3))
+    efield = rng.random((5, 1, 3))
+
+    writer = util.StreamingWriter(frames, [1, 2, 3], [1, 40], 'residue', tag='residue', chunk_size=2)
+    # Frames may be added out of order, but are written in order.
+    for slot in [1, 0, 3]:
+        writer.add_frame(slot, totfield[slot], efield[slot])
+    assert writer.written == 2
+
+    # The progress records the ranges of the frames written, not every frame number.
+    with open('ef_components_long_residue.csv.progress') as f:
+        assert json.load(f)['frame ranges'] == [[2, 2, 2]]
+
+    with pytest.raises(Exception, match='were written for different frames'):
+        util.StreamingWriter([2, 5, 6, 8, 10], [1, 2, 3], [1, 40], 'residue', tag='residue', restart=True)
+
+    # Continue from the frames which were written.
+    restarted = util.StreamingWriter(frames, [1, 2, 3], [1, 40], 'residue', tag='residue', chunk_size=2, restart=True)
+    assert list(restarted.filled) == [True, True, False, False, False]
+    for slot in [4, 2, 3]:
+        restarted.add_frame(slot, totfield[slot], efield[slot])
+    restarted.close()
+    assert not os.path.exists('ef_components_long_residue.csv.progress')
+
+    components = pd.read_csv('ef_components_long_residue.csv', float_precision='round_trip')
+    assert list(components.columns) == ['frame', 'probe', 'residue', 'dimension', 'field']
+    assert len(components) == 5 * 2 * 3 * 3
+    assert list(components['frame'].unique()) == frames
+    row = components[(components['frame'] == 6) & (components['probe'] == 40) & (components['residue'] == 3) & (components['dimension'] == 'y')]
+    assert row['field'].item() == totfield[2, 1, 2, 1]
+
+    projection = pd.read_csv('proj_totfield_long_residue.csv', float_precision='round_trip')
+    assert list(projection.columns) == ['frame', 'probe 1', 'probe 2', 'residue', 'projection']
+    assert np.array_equal(projection['projection'], efield.ravel())
+
+
+def test_frame_ranges():
+    assert util.frame_ranges([1, 3, 5, 6, 7, 20]) == [[1, 2, 3], [6, 1, 2], [20, 1, 1]]
+    assert util.frame_ranges(np.arange(0, 100, 5)) == [[0, 5, 20]]
+    assert util.frame_ranges([]) == []
+
+
+def test_checkpoint(tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint.bin')
+    frames = [2, 4, 6, 8]
+    rng = np.random.default_rng(0)
+
+    stores = [util.ResultStore(frames, [1, 2], [1, 40], 'molecule'), util.ResultStore(frames, [1], [1, 40], 'residue')]
+    checkpoint = util.Checkpoint(checkpoint_path, stores, interval=2)
+    for slot in [3, 0, 2]:
+        for store in stores:
+            store.add_frame(slot, rng.random((2, len(store.fragments), 3)), rng.random((1, len(store.fragments))))
+        checkpoint.add(slot)
+
+    # Only complete intervals are written before the checkpoint is closed.
+    restarted = [util.ResultStore(frames, [1, 2], [1, 40], 'molecule'), util.ResultStore(frames, [1], [1, 40], 'residue')]
+    assert util.Checkpoint(checkpoint_path, restarted).restore() == 2
+    assert list(restarted[0].filled) == [True, False, False, True]
+
+    checkpoint.close()
+
+    # A partly written record is discarded.
+    with open(checkpoint_path, 'ab') as f:
+        f.write(b'partial')
+
+    restarted = [util.ResultStore(frames, [1, 2], [1, 40], 'molecule'), util.ResultStore(frames, [1], [1, 40], 'residue')]
+    checkpoint = util.Checkpoint(checkpoint_path, restarted)
+    assert checkpoint.restore() == 3
+    checkpoint.close()
+
+    for store, restored in zip(stores, restarted):
+        assert np.array_equal(store.filled, restored.filled)
+        assert np.array_equal(store.components, restored.components)
+        assert np.array_equal(store.projection, restored.projection)
+
+    # A checkpoint of a different calculation is not used.
+    with pytest.raises(Exception, match='different calculation'):
+        util.Checkpoint(checkpoint_path, [util.ResultStore(frames, [1, 2], [1, 7], 'molecule')]).restore()
+
+
+def test_checkpoint_probe_groups(tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint.bin')
+    frames = [2, 4]
+
+    stores = [util.ResultStore(frames, [1], [1, 40], 'molecule'), util.ResultStore(frames, [1], [7, 100], 'molecule')]
+    checkpoint = util.Checkpoint(checkpoint_path, stores)
+    for store in stores:
+        store.add_frame(1, np.ones((2, 1, 3)), np.ones((1, 1)))
+    checkpoint.add(1)
+    checkpoint.close()
+
+    # The probes of every group must match.
+    with pytest.raises(Exception, match='different calculation'):
+        other = [util.ResultStore(frames, [1], [1, 40], 'molecule'), util.ResultStore(frames, [1], [7, 101], 'molecule')]
+        util.Checkpoint(checkpoint_path, other).restore()
+
+
+@pytest.mark.parametrize("fragments, ipoles", [
+    ([1, 1, 1, 2, 2, 3, 3, 4, 4, 4], list(range(1, 11))),
+    ([2, 1, 2, 3, 1, 3, 4, 4, 2, 1], list(range(1, 11))),
+    ([1, 1, 1, 2, 2, 3, 3, 4, 4, 4], [10, 3, 2, 1, 4, 9, 8, 5, 7, 6]),
+])
+def test_reduce_to_fragments(fragments, ipoles):
+    atoms_pole_numbers = util.index_fragments(np.array(fragments), ipoles)[0]
+    fragment_index = util.fragment_scatter_index(atoms_pole_numbers, len(ipoles))
+
+    field = np.random.default_rng(0).random((3, len(ipoles), 3))
+
+    expected = np.array([
+        [field[x, poles - 1].sum(axis=0) for poles in atoms_pole_numbers]
+        for x in range(len(field))
+    ])
+
+    assert np.allclose(util.reduce_to_fragments(field, *fragment_index), expected)
+
+
+@pytest.mark.parametrize("fragments, ipoles", [
+    ([1, 1, 1, 2, 2, 3, 3, 4, 4, 4], list(range(1, 11))),
+    ([2, 1, 2, 3, 1, 3, 4, 4, 2, 1], list(range(1, 11))),
+    ([1, 1, 1, 2, 2, 3, 3, 4, 4, 4], [10, 3, 2, 1, 4, 9, 8, 5, 7, 6]),
+])
+def test_fragment_map(fragments, ipoles):
+    atoms_pole_numbers, from_fragment = util.index_fragments(np.array(fragments), ipoles)
+    fragment_index = util.fragment_scatter_index(atoms_pole_numbers, len(ipoles))
+
+    pole_fragments = util.fragment_map(*fragment_index, len(ipoles))
+
+    # Each pole is mapped to the position of the fragment of its atom.
+    for atom, pole in enumerate(ipoles):
+        assert from_fragment[pole_fragments[pole - 1] - 1] == fragments[atom]
+
+    # Summing by the map, as an engine does, matches the reduction by the driver.
+    field = np.random.default_rng(0).random((3, len(ipoles), 3))
+    summed = np.zeros((3, len(from_fragment) + 1, 3))
+    np.add.at(summed, (slice(None), pole_fragments), field)
+
+    assert np.allclose(summed[:, 1:], util.reduce_to_fragments(field, *fragment_index))
+
+
+@pytest.mark.parametrize('nprobes', [2, 3, 7])
+def test_project_pairs(nprobes):
+    rng = np.random.default_rng(0)
+    totfield = rng.random((nprobes, 5, 3))
+    probe_coordinates = rng.random((nprobes, 3))
+
+    efield = util.project_pairs(totfield, probe_coordinates)
+
+    assert efield.shape == (nprobes * (nprobes - 1) // 2, 5)
+    for i, (first, second) in enumerate(itertools.combinations(range(nprobes), 2)):
+        avg_field = (totfield[first] + totfield[second]) / 2
+        dir_vec = probe_coordinates[second] - probe_coordinates[first]
+        dir_vec /= np.linalg.norm(dir_vec)
+        assert np.allclose(efield[i], np.dot(avg_field, dir_vec))
+
+
+@pytest.mark.parametrize("file_name, tags, expected", [
+    ('proj_totfield.csv', [], 'proj_totfield.csv'),
+    ('proj_totfield.csv', [None], 'proj_totfield.csv'),
+    ('ef_components.csv', ['residue'], 'ef_components_residue.csv'),
+    ('ef_components.csv', [None, 'atom'], 'ef_components_atom.csv'),
+])
+def test_output_filename(file_name, tags, expected):
+    assert util.output_filename(file_name, *tags) == expected
+
+
+@pytest.mark.parametrize("groups, expected", [
+    (['1 40'], [(None, [1, 40])]),
+    (['bond: 1 40', 'site:40 7 100'], [('bond', [1, 40]), ('site', [40, 7, 100])]),
+])
+def test_parse_probe_groups(groups, expected):
+    assert util.parse_probe_groups(groups) == expected
+
+
+@pytest.mark.parametrize("groups, message", [
+    (['bond: 1 40', '7 100'], 'must be named'),
+    (['bond: 1 40', 'bond: 7 100'], 'unique'),
+])
+def test_parse_probe_groups_invalid(groups, message):
+    with pytest.raises(Exception, match=message):
+        util.parse_probe_groups(groups)
+
+
+def test_read_trajectory_list(tmp_path):
+    replicas = tmp_path / 'replicas'
+    replicas.mkdir()
+    manifest = replicas / 'trajectories.txt'
+    manifest.write_text('# Replicas\nreplica1.arc\n\n/data/replica2.arc\n')
+
+    file_paths = util.read_trajectory_list(['first.arc', f'@{manifest}'])
+    assert file_paths == ['first.arc', str(replicas / 'replica1.arc'), '/data/replica2.arc']
+
+
+@pytest.mark.parametrize('file_paths, expected', [
+    (['replica1.arc', 'data/replica2.arc'], ['replica1', 'replica2']),
+    (['data/replica1/traj.arc', 'data/replica2/traj.arc'], ['replica1_traj', 'replica2_traj']),
+    (['run/traj.arc', 'run/long/traj.arc'], ['traj', 'long_traj']),
+])
+def test_trajectory_output_tags(file_paths, expected):
+    assert util.trajectory_output_tags(file_paths) == expected
+
+
+def test_trajectory_output_tags_repeated():
+    with pytest.raises(Exception, match='more than once'):
+        util.trajectory_output_tags(['traj.arc', './traj.arc'])
+
+
+def test_interleave_trajectories():
+    def reader(nframes, value):
+        for snap_num in range(1, nframes + 1):
+            yield snap_num, np.full((2, 3), value)
+
+    frames = list(util.interleave_trajectories([reader(3, 0.0), reader(1, 1.0), reader(2, 2.0)]))
+
+    assert [frame for frame, coords in frames] == [(0, 1), (1, 1), (2, 1), (0, 2), (2, 2), (0, 3)]
+    assert [coords[0, 0] for frame, coords in frames] == [0.0, 1.0, 2.0, 0.0, 2.0, 0.0]
+
+
+def test_read_arc_frames():
+    base_location = os.path.dirname(os.path.realpath(__file__))
+    arc_path = os.path.join(base_location, 'bench5', 'bench5.arc')
+
+    frames = [(snap_num, coords.copy()) for snap_num, coords in util.read_arc_frames(arc_path, 648, 2)]
+
+    assert [snap_num for snap_num, coords in frames] == [1, 2, 3, 4, 5]
+    assert frames[0][1].shape == (648, 3)
+    assert np.array_equal(frames[0][1][0], [-8.740490, 5.313805, 0.067791])
+
+    # Only the requested frames are read.
+    selected = [(snap_num, coords.copy()) for snap_num, coords in util.read_arc_frames(arc_path, 648, 2, frames=[3, 5])]
+
+    assert [snap_num for snap_num, coords in selected] == [3, 5]
+    assert np.array_equal(selected[0][1], frames[2][1])
+    assert np.array_equal(selected[1][1], frames[4][1])
+
+
+def test_read_arc_frames_no_box(tmp_path):
+    arc_path = tmp_path / 'no_box.arc'
+    arc_path.write_text(
+        '     2  Water\n'
+        '     1  O      1.000000    2.000000    3.000000     1     2\n'
+        '     2  H      4.000000    5.000000    6.000000     2     1\n'
+        '     2  Water\n'
+        '     1  O     -1.000000   -2.000000   -3.000000     1     2\n'
+        '     2  H     -4.000000   -5.000000   -6.000000     2     1\n'
+        '     2  Water\n'
+        '     1  O     -1.000000   -2.000000   -3.000000     1     2\n'
+    )
+
+    assert util.count_frames(arc_path, 2, 1) == 2
+
+    frames = [(snap_num, coords.copy()) for snap_num, coords in util.read_arc_frames(arc_path, 2, 1)]
+
+    # The incomplete last frame is not read.
+    assert len(frames) == 2
+    assert np.array_equal(frames[1][1], [[-1, -2, -3], [-4, -5, -6]])
+
+
+def test_index_arc_frames():
+    base_location = os.path.dirname(os.path.realpath(__file__))
+    arc_path = os.path.join(base_location, 'bench5', 'bench5.arc')
+
+    offsets = util.index_arc_frames(arc_path, 648, 2)
+
+    assert len(offsets) == 5
+    assert offsets[0] == 0
+
+    with open(arc_path, 'rb') as f:
+        for offset in offsets:
+            f.seek(offset)
+            assert f.readline().split()[0] == b'648'
+
+    # Seeking to frames gives the same coordinates as reading through the file.
+    frames = [coords.copy() for snap_num, coords in util.read_arc_frames(arc_path, 648, 2)]
+    for snap_num, coords in util.read_arc_frames(arc_path, 648, 2, frames=[4, 2], offsets=offsets):
+        assert np.array_equal(coords, frames[snap_num - 1])
+
+
+def test_read_arc_frames_mmap():
+    base_location = os.path.dirname(os.path.realpath(__file__))
+    arc_path = os.path.join(base_location, 'bench5', 'bench5.arc')
+
+    offsets = util.index_arc_frames(arc_path, 648, 2)
+    frames = [coords.copy() for snap_num, coords in util.read_arc_frames(arc_path, 648, 2)]
+
+    mapped = [(snap_num, coords.copy()) for snap_num, coords in util.read_arc_frames_mmap(arc_path, 648, 2, [1, 3, 5], offsets)]
+
+    assert [snap_num for snap_num, coords in mapped] == [1, 3, 5]
+    for snap_num, coords in mapped:
+        assert np.array_equal(coords, frames[snap_num - 1])
+
+
+def test_read_arc_frames_mmap_fallback(tmp_path):
+    arc_path = tmp_path / 'mixed.arc'
+    arc_path.write_text(
+        '     2  Water\n'
+        '     1  O      1.000000    2.000000    3.000000     1     2\n'
+        '     2  H     -4.500000    5.000000   -6.000000     2     1\n'
+        '     2  Water\n'
+        '     1  O  -1.5 -2.25 -3.0 1 2\n'
+        '     2  H  4e-1 5.0 6.0 2 1\n'
+    )
+
+    offsets = util.index_arc_frames(arc_path, 2, 1)
+    frames = [coords.copy() for snap_num, coords in util.read_arc_frames_mmap(arc_path, 2, 1, [1, 2], offsets)]
+
+    assert np.array_equal(frames[0], [[1, 2, 3], [-4.5, 5, -6]])
+    # Frames without the fixed-width columns of the first frame are still read.
+    assert np.array_equal(frames[1], [[-1.5, -2.25, -3], [0.4, 5, 6]])
+
+
+def test_coordinate_cache(tmp_path):
+    base_location = os.path.dirname(os.path.realpath(__file__))
+    arc_path = os.path.join(base_location, 'bench5', 'bench5.arc')
+    cache_path = str(tmp_path / 'bench5.npy')
+
+    assert util.read_arc_header(arc_path) == (648, 2)
+    assert not util.coordinate_cache_is_current(cache_path, arc_path)
+
+    assert util.write_coordinate_cache(arc_path, cache_path, 648, 2) == 5
+    assert util.coordinate_cache_is_current(cache_path, arc_path)
+
+    coordinates = np.load(cache_path, mmap_mode='r')
+    assert coordinates.shape == (5, 648, 3)
+
+    frames = [coords.copy() for snap_num, coords in util.read_arc_frames(arc_path, 648, 2)]
+    for snap_num, coords in util.read_coordinate_cache(coordinates, [2, 5]):
+        assert np.array_equal(coords, frames[snap_num - 1])
+
+    box = np.load(tmp_path / 'bench5_box.npy')
+    assert box.shape == (5, 6)
+    assert np.array_equal(box[0], [18.643, 18.643, 18.643, 90, 90, 90])
+
+
+def test_coordinate_cache_source(tmp_path):
+    base_location = os.path.dirname(os.path.realpath(__file__))
+    arc_path = str(tmp_path / 'bench5.arc')
+    other_path = str(tmp_path / 'other.arc')
+    cache_path = str(tmp_path / 'bench5.npy')
+
+    with open(os.path.join(base_location, 'bench5', 'bench5.arc')) as f:
+        trajectory = f.read()
+    with open(arc_path, 'w') as f:
+        f.write(trajectory)
+    with open(other_path, 'w') as f:
+        f.write(trajectory)
+
+    util.write_coordinate_cache(arc_path, cache_path, 648, 2)
+    assert util.coordinate_cache_is_current(cache_path, arc_path)
+
+    # A cache of another trajectory is not used, even if it is newer.
+    assert not util.coordinate_cache_is_current(cache_path, other_path)
+
+    # Nor is the cache used once its trajectory has changed.
+    with open(arc_path, 'a') as f:
+        f.write(trajectory)
+    assert not util.coordinate_cache_is_current(cache_path, arc_path)
+
+    # A cache without a record of its trajectory is written again.
+    util.write_coordinate_cache(arc_path, cache_path, 648, 2)
+    os.remove(f'{cache_path}.source.json')
+    assert not util.coordinate_cache_is_current(cache_path, arc_path)
+
+
+@pytest.mark.parametrize('depth', [0, 1, 3])
+def test_prefetch_frames(depth):
+    base_location = os.path.dirname(os.path.realpath(__file__))
+    arc_path = os.path.join(base_location, 'bench5', 'bench5.arc')
+
+    frames = [(snap_num, coords.copy()) for snap_num, coords in util.read_arc_frames(arc_path, 648, 2)]
+    prefetched = [(snap_num, coords.copy()) for snap_num, coords in util.prefetch_frames(util.read_arc_frames(arc_path, 648, 2), depth)]
+
+    assert [snap_num for snap_num, coords in prefetched] == [1, 2, 3, 4, 5]
+    for (snap_num, coords), (prefetched_num, prefetched_coords) in zip(frames, prefetched):
+        assert np.array_equal(coords, prefetched_coords)
+
+    # Stopping early does not leave the reader waiting.
+    for snap_num, coords in util.prefetch_frames(util.read_arc_frames(arc_path, 648, 2), depth):
+        break
+
+
+def test_prefetch_frames_error():
+    def reader():
+        yield 1, np.zeros((2, 3))
+        raise ValueError('bad frame')
+
+    with pytest.raises(ValueError, match='bad frame'):
+        for snap_num, coords in util.prefetch_frames(reader(), 2):
+            pass
+
+
+def test_load_frame_index(tmp_path):
+    arc_path = tmp_path / 'traj.arc'
+    frame = (
+        '     2  Water\n'
+        '     1  O      1.000000    2.000000    3.000000     1     2\n'
+        '     2  H      4.000000    5.000000    6.000000     2     1\n'
+    )
+    arc_path.write_text(frame * 3)
+
+    offsets = util.load_frame_index(str(arc_path), 2, 1)
+    assert list(offsets) == [0, len(frame), 2 * len(frame)]
+    assert os.path.exists(f"{arc_path}.idx.npz")
+
+    # The cached index is used while the trajectory is unchanged.
+    np.savez(f"{arc_path}.idx.npz", key=np.load(f"{arc_path}.idx.npz")["key"], offsets=[0])
+    assert list(util.load_frame_index(str(arc_path), 2, 1)) == [0]
+
+    # The index is rebuilt when the trajectory changes.
+    arc_path.write_text(frame * 4)
+    assert len(util.load_frame_index(str(arc_path), 2, 1)) == 4
+
+
+def test_load_topology(tmp_path):
+    arc_path = str(tmp_path / 'traj.arc')
+    queries = []
+
+    def query():
+        queries.append(len(queries))
+        return np.array([1, 2, 3]), np.array([1, 1, 2])
+
+    ipoles, molecules = util.load_topology(arc_path, 3, 3, query)
+    assert list(ipoles) == [1, 2, 3]
+    assert list(molecules) == [1, 1, 2]
+    assert os.path.exists(f'{arc_path}.topology.npz')
+
+    # The sidecar is used while the engine reports the same system.
+    ipoles, molecules = util.load_topology(arc_path, 3, 3, query)
+    assert list(molecules) == [1, 1, 2]
+    assert len(queries) == 1
+
+    # The engine is queried again when the number of poles changes.
+    util.load_topology(arc_path, 3, 2, query)
+    assert len(queries) == 2
+
+    # The engine is queried again when the files which define the system change.
+    key_path = tmp_path / 'tinker.key'
+    key_path.write_text('parameters amoebabio18\n')
+    util.load_topology(arc_path, 3, 2, query, sources=[key_path])
+    util.load_topology(arc_path, 3, 2, query, sources=[key_path])
+    assert len(queries) == 3
+
+    key_path.write_text('parameters amoeba09\n')
+    os.utime(key_path, ns=(0, 0))
+    util.load_topology(arc_path, 3, 2, query, sources=[key_path])
+    assert len(queries) == 4
@@ -0,0 +1,106 @@
+"""
+Test the scheduling of tasks over engines by the engine pool, with engines simulated by
+functions.
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+mypath = os.path.dirname(os.path.realpath(__file__))
+
+# The engine pool uses the compiled MDI Library for its errors.
+pytestmark = pytest.mark.skipif(
+    not os.path.exists(os.path.join(mypath, "..", "mdi", "MDI_Library", "mdi_name")),
+    reason="the MDI Library has not been built",
+)
+
+sys.path.append(os.path.join(mypath, ".."))
+
+
+def run_pool(communicate, tasks, timeout=None):
+    from engine_pool import EnginePool
+
+    pool = EnginePool(list(range(len(communicate))), timeout=timeout)
+    analyzed = []
+    lock = threading.Lock()
+
+    def analyze(task, data):
+        with lock:
+            analyzed.append((task, data))
+
+    pool.run(iter(tasks), communicate, analyze)
+    return pool, sorted(analyzed)
+
+
+def test_engine_pool():
+    pool, analyzed = run_pool([lambda task: 2 * task, lambda task: 2 * task], range(10))
+
+    assert analyzed == [(task, 2 * task) for task in range(10)]
+    assert pool.close() == [0, 1]
+
+
+def test_engine_pool_mdi_error():
+    import mdi.MDI_Library as mdi
+
+    def crash(task):
+        raise mdi.MDI_Error("MDI Error: MDI_Recv failed")
+
+    # The task of the failed engine is analyzed by the other engine.
+    pool, analyzed = run_pool([crash, lambda task: 2 * task], range(10))
+
+    assert analyzed == [(task, 2 * task) for task in range(10)]
+    assert pool.healthy == [False, True]
+    assert pool.close() == [1]
+
+
+def test_engine_pool_error():
+    # Errors of the driver are raised, rather than failing every engine in turn.
+    def broken(task):
+        raise ValueError("operands could not be broadcast together")
+
+    with pytest.raises(ValueError, match="broadcast"):
+        run_pool([broken, broken], range(10))
+
+
+def test_engine_pool_timeout():
+    release = threading.Event()
+
+    def hang(task):
+        release.wait()
+        return 2 * task
+
+    pool, analyzed = run_pool([hang, lambda task: 2 * task], range(4), timeout=0.5)
+    release.set()
+
+    assert analyzed == [(task, 2 * task) for task in range(4)]
+
+    # The engine which timed out may still be running, so it is sent EXIT.
+    assert pool.close() == [0, 1]
+
+
+def test_engine_pool_slow_tasks():
+    # Engines report back while another engine waits for the next task to be read.
+    reading = threading.Event()
+    finished = threading.Event()
+
+    def tasks():
+        yield 0
+        reading.set()
+        assert finished.wait(5)
+        yield 1
+
+    def communicate(task):
+        if task == 0:
+            assert reading.wait(5)
+        return task
+
+    def analyze(task, data):
+        if task == 0:
+            finished.set()
+
+    from engine_pool import EnginePool
+
+    EnginePool([0, 1]).run(tasks(), [communicate, communicate], analyze)
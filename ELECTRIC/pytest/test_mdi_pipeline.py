@@ -0,0 +1,87 @@
+"""
+Test the order of the commands sent and the replies received by a command pipeline, with a
+fake MDI Library which records its calls.
+"""
+
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+mypath = os.path.dirname(os.path.realpath(__file__))
+
+# The command pipeline imports the compiled MDI Library.
+pytestmark = pytest.mark.skipif(
+    not os.path.exists(os.path.join(mypath, "..", "mdi", "MDI_Library", "mdi_name")),
+    reason="the MDI Library has not been built",
+)
+
+sys.path.append(os.path.join(mypath, ".."))
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """
+    Replace the MDI Library of the pipeline, and return the list of its calls.
+
+    Each received buffer is filled with the number of the call which received it.
+    """
+    import mdi_pipeline
+
+    calls = []
+
+    def send_command(command, comm):
+        calls.append(("command", command, comm))
+
+    def send(data, count, datatype, comm):
+        calls.append(("send", list(data), count, datatype, comm))
+
+    def recv(count, datatype, comm, buf=None):
+        calls.append(("recv", count, datatype, comm))
+        buf[:] = len(calls)
+
+    fake = types.SimpleNamespace(
+        MDI_INT=mdi_pipeline.mdi.MDI_INT,
+        MDI_DOUBLE=mdi_pipeline.mdi.MDI_DOUBLE,
+        MDI_Send_Command=send_command,
+        MDI_Send=send,
+        MDI_Recv=recv,
+    )
+    monkeypatch.setattr(mdi_pipeline, "mdi", fake)
+    return calls
+
+
+def test_pipeline_flush(calls):
+    from mdi_pipeline import CommandPipeline, mdi
+
+    INT, DOUBLE = mdi.MDI_INT, mdi.MDI_DOUBLE
+    pipeline = CommandPipeline(7)
+    first = np.zeros(2)
+    second = np.zeros(3, dtype=np.int32)
+    pipeline.send(">COORDS", np.array([1.0, 2.0]))
+    pipeline.request("<DFIELD", first)
+    pipeline.send("@")
+    pipeline.request("<IPOLES", second, INT)
+
+    # Nothing is sent until the pipeline is flushed, and nothing received until asked.
+    assert calls == []
+    pipeline.flush()
+    assert calls == [
+        ("command", ">COORDS", 7),
+        ("send", [1.0, 2.0], 2, DOUBLE, 7),
+        ("command", "<DFIELD", 7),
+        ("command", "@", 7),
+        ("command", "<IPOLES", 7),
+    ]
+
+    # The replies are received in the order of the requests.
+    pipeline.receive()
+    assert calls[5:] == [("recv", 2, DOUBLE, 7), ("recv", 3, INT, 7)]
+    assert np.all(first == 6)
+    assert np.all(second == 7)
+
+    # Flushed commands and received replies are not sent or received again.
+    pipeline.run()
+    assert len(calls) == 7
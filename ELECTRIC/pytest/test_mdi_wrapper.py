@@ -0,0 +1,124 @@
+"""
+Test the transfer of numpy arrays by the Python wrapper of the MDI Library, by echoing arrays
+between a driver and an engine which are both run from this file.
+"""
+
+import os
+import sys
+import socket
+import subprocess
+
+import numpy as np
+import pytest
+
+mypath = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(mypath, ".."))
+
+pytestmark = pytest.mark.skipif(
+    not os.path.exists(os.path.join(mypath, "..", "mdi", "MDI_Library", "mdi_name")),
+    reason="the MDI Library has not been built",
+)
+
+
+def sent_arrays():
+    """
+    The arrays sent by the driver, with the MDI datatype they are sent as.
+    """
+    field = np.arange(24.0).reshape(2, 3, 4)
+    return {
+        "contiguous": (field, "MDI_DOUBLE"),
+        "noncontiguous": (field[:, :, ::2], "MDI_DOUBLE"),
+        "transposed": (field.T, "MDI_DOUBLE"),
+        "float32": (field.astype(np.float32), "MDI_DOUBLE"),
+        "int64": (np.arange(5, dtype=np.int64), "MDI_INT"),
+    }
+
+
+def echo_engine(mdi_args):
+    """
+    Receive arrays into new numpy arrays, and send them back, until EXIT.
+    """
+    import mdi.MDI_Library as mdi
+
+    mdi.MDI_Init(mdi_args)
+    comm = mdi.MDI_Accept_Communicator()
+    while True:
+        command = mdi.MDI_Recv_Command(comm)
+        if command == "EXIT":
+            break
+
+        datatype = mdi.MDI_DOUBLE if command == ">DOUBLE" else mdi.MDI_INT
+        count = mdi.MDI_Recv(1, mdi.MDI_INT, comm)
+        data = mdi.MDI_Recv_Numpy(count, datatype, comm)
+        mdi.MDI_Send(data, count, datatype, comm)
+
+
+def echo_driver(mdi_args, output):
+    """
+    Send each array to the engine, and save the arrays received back.
+    """
+    import mdi.MDI_Library as mdi
+
+    mdi.MDI_Init(mdi_args)
+    comm = mdi.MDI_Accept_Communicator()
+
+    received = {}
+    for name, (data, datatype) in sent_arrays().items():
+        datatype = getattr(mdi, datatype)
+        command = ">DOUBLE" if datatype == mdi.MDI_DOUBLE else ">INT"
+        mdi.MDI_Send_Command(command, comm)
+        mdi.MDI_Send(data.size, 1, mdi.MDI_INT, comm)
+        mdi.MDI_Send(data, data.size, datatype, comm)
+        received[name] = mdi.MDI_Recv_Numpy(data.size, datatype, comm)
+
+    mdi.MDI_Send_Command("EXIT", comm)
+    np.savez(output, **received)
+
+
+def test_mdi_numpy_arrays(tmp_path):
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+
+    output = str(tmp_path / "received.npz")
+    driver = subprocess.Popen(
+        [
+            sys.executable,
+            __file__,
+            "driver",
+            output,
+            f"-role DRIVER -name driver -method TCP -port {port}",
+        ]
+    )
+    engine = subprocess.Popen(
+        [
+            sys.executable,
+            __file__,
+            "engine",
+            f"-role ENGINE -name echo -method TCP -port {port} -hostname localhost",
+        ]
+    )
+    assert driver.wait(timeout=60) == 0
+    assert engine.wait(timeout=60) == 0
+
+    received = np.load(output)
+    for name, (data, datatype) in sent_arrays().items():
+        # The arrays are sent in C order, converted to the type of the MDI datatype.
+        dtype = np.float64 if datatype == "MDI_DOUBLE" else np.int32
+        assert received[name].dtype == dtype
+        assert received[name].shape == (data.size,)
+        assert np.array_equal(received[name], data.ravel())
+
+
+def test_mdi_recv_numpy_datatype():
+    import mdi.MDI_Library as mdi
+
+    with pytest.raises(Exception, match="only supports MDI_INT and MDI_DOUBLE"):
+        mdi.MDI_Recv_Numpy(3, mdi.MDI_CHAR, 0)
+
+
+if __name__ == "__main__":
+    if sys.argv[1] == "driver":
+        echo_driver(sys.argv[3], sys.argv[2])
+    else:
+        echo_engine(sys.argv[2])
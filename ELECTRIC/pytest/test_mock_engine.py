@@ -0,0 +1,320 @@
+"""
+Run the driver with the Python mock engine, to test the paths which depend on the commands
+an engine supports.
+"""
+
+import os
+import re
+import sys
+import time
+import socket
+import subprocess
+
+import pandas as pd
+import pytest
+
+mypath = os.path.dirname(os.path.realpath(__file__))
+driver_path = os.path.join(mypath, "..", "ELECTRIC.py")
+engine_path = os.path.join(mypath, "mock_engine.py")
+snap_path = os.path.join(mypath, "bench5", "bench5.arc")
+
+# The mock engine and the driver need the compiled MDI Library.
+pytestmark = pytest.mark.skipif(
+    not os.path.exists(os.path.join(mypath, "..", "mdi", "MDI_Library", "mdi_name")),
+    reason="the MDI Library has not been built",
+)
+
+# The ways of giving frames to the engines, which all give the same output.
+schedulers = ["dynamic", "batch", "asyncio"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def run_driver(
+    cwd, driver_args, engine_args, nengines=1, extra_args=(), late_engines=()
+):
+    port = free_port()
+
+    # Extra arguments for the first engines, for example to make them fail.
+    engine_extra_args = list(extra_args) + [
+        [] for iengine in range(nengines - len(extra_args))
+    ]
+
+    driver_proc = subprocess.Popen(
+        [
+            sys.executable,
+            driver_path,
+            "-probes",
+            "1 40 100",
+            "-snap",
+            snap_path,
+            "-mdi",
+            f"-role DRIVER -name driver -method TCP -port {port}",
+            "--nengines",
+            str(nengines),
+        ]
+        + driver_args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+    )
+    engine_procs = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                engine_path,
+                snap_path,
+                "-mdi",
+                f"-role ENGINE -name NO_EWALD -method TCP -port {port} -hostname localhost",
+            ]
+            + engine_args
+            + engine_extra_args[iengine],
+            cwd=cwd,
+        )
+        for iengine in range(nengines)
+    ]
+
+    # Engines which connect after the analysis has started, given as (delay, arguments).
+    for delay, late_args in late_engines:
+        time.sleep(delay)
+        engine_procs.append(
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    engine_path,
+                    snap_path,
+                    "-mdi",
+                    f"-role ENGINE -name NO_EWALD -method TCP -port {port} -hostname localhost",
+                ]
+                + engine_args
+                + late_args,
+                cwd=cwd,
+            )
+        )
+        engine_extra_args.append(late_args)
+
+    driver_out, driver_err = driver_proc.communicate(timeout=300)
+    for engine_proc, extra in zip(engine_procs, engine_extra_args):
+        if "--hang-after" in extra:
+            engine_proc.kill()
+        engine_proc.communicate(timeout=300)
+
+    assert driver_proc.returncode == 0, driver_err.decode("utf-8")
+
+    return driver_out.decode("utf-8")
+
+
+def assert_same_output(reference_path, path, tag="", subset=False):
+    """
+    Compare the csv output in `path` to the reference output.
+
+    The output files are named with `tag`. If `subset` is True, the output may hold only some
+    of the columns of the reference, as for a group of the probes.
+    """
+    for file_name in ["proj_totfield", "ef_components"]:
+        reference = pd.read_csv(reference_path / f"{file_name}.csv", index_col=0)
+        result = pd.read_csv(path / f"{file_name}{tag}.csv", index_col=0)
+
+        if subset:
+            reference = reference[result.columns]
+
+        pd.testing.assert_frame_equal(reference, result, check_exact=False, rtol=1e-10)
+
+
+@pytest.fixture(scope="module")
+def reference_path(tmp_path_factory):
+    """
+    The output for the per-pole fields, summed over the molecules by the driver.
+    """
+    path = tmp_path_factory.mktemp("reference")
+    run_driver(path, ["--bymol", "--fields", "split", "--reduction", "driver"], [])
+    return path
+
+
+@pytest.mark.parametrize(
+    "engine_args, driver_args, total_field, engine_reduction",
+    [
+        ([], ["--bymol"], False, False),
+        (["--total-field"], ["--bymol"], True, False),
+        (["--fragments"], ["--bymol"], False, True),
+        (["--total-field", "--fragments"], ["--bymol"], True, True),
+        (
+            ["--total-field", "--fragments"],
+            ["--bymol", "--fields", "split"],
+            False,
+            True,
+        ),
+        (
+            ["--total-field", "--fragments"],
+            ["--bymol", "--reduction", "driver"],
+            True,
+            False,
+        ),
+        (
+            ["--total-field", "--fragments"],
+            ["--groupings", "molecule", "atom"],
+            True,
+            False,
+        ),
+    ],
+)
+@pytest.mark.parametrize("scheduler", schedulers)
+def test_mock_engine(
+    tmp_path,
+    reference_path,
+    engine_args,
+    driver_args,
+    total_field,
+    engine_reduction,
+    scheduler,
+):
+    # Every scheduler gives the same output as the reference.
+    output = run_driver(
+        tmp_path, driver_args + ["--scheduler", scheduler], engine_args, nengines=2
+    )
+
+    assert f"Total field from engines: {total_field}" in output
+    assert f"Fragment reduction by engines: {engine_reduction}" in output
+
+    # Output files are named by grouping when several groupings are used.
+    tag = "_molecule" if "--groupings" in driver_args else ""
+    assert_same_output(reference_path, tmp_path, tag)
+
+
+def test_mock_engine_reduction_unsupported(tmp_path):
+    with pytest.raises(AssertionError, match="--reduction engine requires"):
+        run_driver(tmp_path, ["--bymol", "--reduction", "engine"], [])
+
+
+def test_mock_engine_failures(tmp_path, reference_path):
+    extra_args = [["--crash-after", "0"], ["--hang-after", "1"], ["--crash-after", "2"]]
+
+    output = run_driver(
+        tmp_path,
+        ["--bymol", "--task-timeout", "5"],
+        [],
+        nengines=4,
+        extra_args=extra_args,
+    )
+
+    # The frames of the failed engines are analyzed by the remaining engine.
+    assert len(re.findall(r"Engine \d+ failed", output)) == 3
+
+    assert_same_output(reference_path, tmp_path)
+
+
+def test_mock_engine_all_failed(tmp_path):
+    with pytest.raises(AssertionError, match="All engines have failed"):
+        run_driver(
+            tmp_path,
+            ["--bymol"],
+            [],
+            nengines=2,
+            extra_args=[["--crash-after", "1"], ["--crash-after", "2"]],
+        )
+
+    # The frames completed before the engines failed are kept for a restart.
+    assert (tmp_path / "electric_checkpoint.bin").exists()
+
+
+@pytest.mark.parametrize("scheduler", schedulers)
+def test_mock_engine_restart(tmp_path, reference_path, scheduler):
+    # Interrupt a calculation by making the engines fail after a few frames.
+    with pytest.raises(AssertionError, match="All engines have failed"):
+        run_driver(
+            tmp_path,
+            ["--bymol"],
+            [],
+            nengines=2,
+            extra_args=[["--crash-after", "1"], ["--crash-after", "2"]],
+        )
+
+    output = run_driver(
+        tmp_path, ["--bymol", "--restart", "--scheduler", scheduler], [], nengines=2
+    )
+
+    # Each engine has completed at least one frame before failing.
+    restored = re.search(r"Frames restored from electric_checkpoint.bin: (\d+)", output)
+    assert int(restored.group(1)) > 0
+    assert not (tmp_path / "electric_checkpoint.bin").exists()
+
+    assert_same_output(reference_path, tmp_path)
+
+
+@pytest.mark.parametrize(
+    "driver_args", [["--stream", "--stream-chunk", "3"], ["--statistics"]]
+)
+def test_mock_engine_keep_checkpoint(tmp_path, driver_args):
+    # A checkpoint left by an interrupted calculation.
+    with pytest.raises(AssertionError, match="All engines have failed"):
+        run_driver(
+            tmp_path,
+            ["--bymol"],
+            [],
+            nengines=2,
+            extra_args=[["--crash-after", "1"], ["--crash-after", "2"]],
+        )
+    checkpoint = (tmp_path / "electric_checkpoint.bin").read_bytes()
+
+    # Runs which do not write a checkpoint leave it for a restart.
+    run_driver(tmp_path, ["--bymol"] + driver_args, [], nengines=2)
+
+    assert (tmp_path / "electric_checkpoint.bin").read_bytes() == checkpoint
+
+
+@pytest.mark.parametrize(
+    "first_args, late_engines",
+    [
+        (["--delay", "1"], [(2, []), (0, ["--total-field"])]),
+        # Engines which do not report their commands are accepted, whether they connect at the
+        # start or during the analysis.
+        (["--no-register", "--delay", "1"], [(2, ["--no-register"])]),
+    ],
+)
+def test_mock_engine_elastic(tmp_path, reference_path, first_args, late_engines):
+    # The first engine is slow, so that the later engines join while there are frames left.
+    output = run_driver(
+        tmp_path,
+        ["--bymol", "--elastic"],
+        [],
+        nengines=1,
+        extra_args=[first_args],
+        late_engines=late_engines,
+    )
+
+    assert "Engine 1 joined" in output
+    assert "Engine could not be added" not in output
+
+    assert_same_output(reference_path, tmp_path)
+
+
+def test_mock_engine_trajectories(tmp_path, reference_path):
+    # Two replicas, one of them given through a manifest.
+    for replica in ["replica1", "replica2"]:
+        with open(snap_path) as f, open(tmp_path / f"{replica}.arc", "w") as g:
+            g.write(f.read())
+    (tmp_path / "replicas.txt").write_text("replica2.arc\n")
+
+    snaps = [str(tmp_path / "replica1.arc"), f'@{tmp_path / "replicas.txt"}']
+    run_driver(tmp_path, ["-snap"] + snaps + ["--bymol"], [], nengines=2)
+
+    # Each trajectory has output files of its own.
+    for replica in ["replica1", "replica2"]:
+        assert_same_output(reference_path, tmp_path, f"_{replica}")
+
+
+def test_mock_engine_probe_groups(tmp_path, reference_path):
+    output = run_driver(
+        tmp_path, ["-probes", "bond: 1 40", "site: 40 100", "--bymol"], [], nengines=2
+    )
+
+    # The engines are sent each probe once.
+    assert "Probes: [1, 40, 100]" in output
+
+    # Each group has output files of its own, with the columns of its probes.
+    for group in ["bond", "site"]:
+        assert_same_output(reference_path, tmp_path, f"_{group}", subset=True)
@@ -1,7 +1,20 @@
 import numpy as np
 import pandas as pd
 
+import os
+import re
+import json
+import mmap
+import queue
 import argparse
+import threading
+
+from itertools import combinations, islice
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
 
 
 def create_parser():
@@ -27,8 +40,14 @@ def create_parser():
     )
     required.add_argument(
         "-snap",
-        help="The file name of the trajectory to analyze.",
+        help="""
+                The file name of the trajectory to analyze. Several trajectories of the same system
+                can be given, and are analyzed together by the same engines. An argument starting
+                with @ is a manifest, a text file listing one trajectory per line. When several
+                trajectories are analyzed, the output and checkpoint files are named by trajectory
+                (for example, proj_totfield_replica1.csv for replica1.arc).""",
         type=str,
+        nargs="+",
         required=True,
     )
 
@@ -37,8 +56,13 @@ def create_parser():
         help="""
                 Atom indices which are probes for the electric field calculations. 
                 For example, if you would like to calculate the electric field along 
-                the bond between atoms 1 and 2, you would use `-probes "1 2"`.""",
+                the bond between atoms 1 and 2, you would use `-probes "1 2"`.
+                Several named groups of probes can be analyzed in one pass over the trajectory,
+                for example `-probes "bond: 1 2" "site: 10 20 30"`. The field is calculated once
+                at every probe of all groups, and the output files are named by group
+                (for example, proj_totfield_bond.csv).""",
         type=str,
+        nargs="+",
         required=True,
     )
 
@@ -73,6 +97,190 @@ def create_parser():
         default=1,
     )
 
+    optional.add_argument(
+        "--frames",
+        help="""
+                The frames to analyze, given as frame numbers or inclusive ranges of frame numbers
+                separated by spaces. For example, `--frames "1-100 250 300-400"`. Frames are numbered
+                starting from 1, and --equil and --stride are applied to the frames given.""",
+        type=str,
+    )
+
+    optional.add_argument(
+        "--mmap",
+        help="""
+                Read the trajectory through a memory map of the file, taking the coordinates
+                of all atoms in a frame from their fixed-width columns at once. This is faster for
+                large trajectories, and lets the operating system share the file between runs.""",
+        action="store_true",
+    )
+
+    optional.add_argument(
+        "--scheduler",
+        help="""
+                How frames are given to the engines. With `dynamic`, each engine is given the next
+                frame as soon as it has finished its previous one. With `batch`, a frame is given to
+                every engine and all of them are waited for before the next frames are given out.
+                With `asyncio`, frames are given out as with `dynamic`, but each engine is driven
+                by a coroutine and the fields are reduced in the event loop while the engines work.
+                The batch scheduler is always used when MDI communicates through MPI.""",
+        choices=["dynamic", "batch", "asyncio"],
+        default="dynamic",
+    )
+
+    optional.add_argument(
+        "--task-timeout",
+        help="""
+                The number of seconds after which an engine which has not returned the fields of
+                a frame is considered to have failed. The frames of engines which fail, either by
+                timing out or by losing their connection, are analyzed by the remaining engines.
+                Only used by the dynamic scheduler. By default, there is no timeout.""",
+        type=float,
+        default=None,
+    )
+
+    optional.add_argument(
+        "--elastic",
+        help="""
+                Keep accepting engines while the trajectory is analyzed. The analysis starts once
+                the number of engines given by --nengines have connected, and each engine which
+                connects later is given frames as soon as it has been set up.
+                Requires the dynamic scheduler and MDI over TCP.""",
+        action="store_true",
+    )
+
+    optional.add_argument(
+        "--fields",
+        help="""
+                How the field is requested from the engines. With `total`, each engine sends the
+                sum of the direct and induced field in one transfer, through the `<TFIELD` command.
+                With `split`, the direct and induced fields are requested separately, through
+                `<DFIELD` and `<UFIELD`, and summed by the driver. With `auto`, `<TFIELD` is used
+                if every engine reports that it supports the command.""",
+        choices=["auto", "total", "split"],
+        default="auto",
+    )
+
+    optional.add_argument(
+        "--reduction",
+        help="""
+                Where the field is summed over the fragments. With `engine`, the driver sends the
+                fragment of each pole to the engines, which send the field due to each fragment
+                instead of each pole. With `driver`, the engines send the field due to each pole.
+                With `auto`, the engines sum the field if every engine reports that it supports
+                the fragment commands. The engines can only sum the field for a single grouping.""",
+        choices=["auto", "engine", "driver"],
+        default="auto",
+    )
+
+    optional.add_argument(
+        "--prefetch",
+        help="""
+                The number of frames per engine to read ahead in a background thread, so that
+                reading the trajectory overlaps with the calculations of the engines.
+                Use 0 to read each frame only when it is needed.""",
+        type=int,
+        default=2,
+    )
+
+    optional.add_argument(
+        "--output-format",
+        help="""
+                The format of the output. `csv` writes proj_totfield.csv and ef_components.csv.
+                `npz` and `hdf5` write electric_field.npz or electric_field.h5, binary files
+                holding the field components as an array with dimensions (frame, fragment, probe,
+                dimension), and the projections as an array with dimensions (frame, fragment, pair).
+                Writing HDF5 files requires h5py.""",
+        choices=["csv", "npz", "hdf5"],
+        default="csv",
+    )
+
+    optional.add_argument(
+        "--float32",
+        help="Store the fields in single precision in npz and hdf5 output.",
+        action="store_true",
+    )
+
+    optional.add_argument(
+        "--statistics",
+        help="""
+                Only keep running statistics over the frames (mean, standard deviation, minimum and
+                maximum) of the field components and projections of each fragment, instead of the
+                field at every frame. They are written to ef_components_statistics.csv and
+                proj_totfield_statistics.csv.""",
+        action="store_true",
+    )
+
+    optional.add_argument(
+        "--block-size",
+        help="""
+                With --statistics, also estimate the standard error of each mean from the means
+                of blocks of this many consecutive analyzed frames.""",
+        type=int,
+        default=0,
+    )
+
+    optional.add_argument(
+        "--stream",
+        help="""
+                Write the results to ef_components_long.csv and proj_totfield_long.csv as frames
+                are completed, with one row per frame, probe (or pair of probes), fragment and
+                dimension, instead of keeping every frame in memory. With --restart, the
+                calculation continues from the last frames written.""",
+        action="store_true",
+    )
+
+    optional.add_argument(
+        "--stream-chunk",
+        help="""
+                With --stream, the number of consecutive completed frames written to the files at
+                once. Larger chunks write less often, but keep more frames in memory and repeat
+                more frames after a restart.""",
+        type=int,
+        default=10,
+    )
+
+    optional.add_argument(
+        "--checkpoint-interval",
+        help="""
+                The number of completed frames after which their results are written to the
+                checkpoint file electric_checkpoint.bin, so that an interrupted calculation can be
+                continued with --restart. Use 0 to disable checkpoints.""",
+        type=int,
+        default=100,
+    )
+
+    optional.add_argument(
+        "--restart",
+        help="""
+                Continue a calculation from electric_checkpoint.bin, only analyzing the frames
+                which it does not contain. The other arguments must be the same as for the
+                interrupted calculation.""",
+        action="store_true",
+    )
+
+    optional.add_argument(
+        "--coordinate-cache",
+        help="""
+                A binary (.npy) coordinate cache of the trajectory, as written by convert.py. The
+                coordinates are read from the cache instead of parsing the trajectory. If the cache
+                does not exist or was not written from the current trajectory, it is written first.""",
+        type=str,
+    )
+
+    optional.add_argument(
+        "--topology-cache",
+        help="""
+                Store the pole indices and molecules reported by the engine next to the trajectory
+                (with the extension .topology.npz), and read them from there in later runs instead
+                of querying the engine. The files which define the system of the engine must be
+                given, for example `--topology-cache tinker.key amoebabio18.prm bench5.xyz` for
+                the key, parameter and structure files. The topology is queried again if any of
+                these files, or the number of atoms or poles of the engine, have changed.""",
+        nargs="+",
+        metavar="FILE",
+    )
+
     optional.add_argument(
         "--byres",
         help="""
@@ -91,6 +299,17 @@ def create_parser():
         action="store_true",
     )
 
+    optional.add_argument(
+        "--groupings",
+        help="""
+                Calculate the electric field contributions for several fragment types with a single pass
+                over the trajectory, for example `--groupings residue atom`. The residue grouping
+                requires --byres to give the pdb file. The output files are named by fragment type
+                (for example, proj_totfield_residue.csv and ef_components_atom.csv).""",
+        nargs="+",
+        choices=["atom", "molecule", "residue"],
+    )
+
     optional.add_argument(
         "--components-only",
         help="""
@@ -244,16 +463,1908 @@ def index_fragments(fragment_list, ipoles):
     fragments : list
         A list of the fragment numbers.
     """
-    # Get the atom and pole numbers for the molecules/residues of interest.
-    atoms_pole_numbers = []
+    fragment_list = np.asarray(fragment_list)
+    ipoles = np.asarray(ipoles)
 
-    fragments = np.unique(fragment_list)
+    # Sort the atoms by fragment. The sort is stable, so atoms stay in order within a fragment.
+    order = np.argsort(fragment_list, kind="stable")
+    fragments, counts = np.unique(fragment_list[order], return_counts=True)
 
-    for fragment in fragments:
-        # These are the atom numbers for the atoms in the specified molecules
-        fragment_atoms = np.array(np.where(fragment_list == fragment)) + 1
-        # The pole indices for the specified molecule
-        pole_numbers = [ipoles[atom_index - 1] for atom_index in fragment_atoms[0]]
-        atoms_pole_numbers.append(np.array(pole_numbers))
+    # The pole indices for the atoms in each fragment
+    atoms_pole_numbers = np.split(ipoles[order], np.cumsum(counts)[:-1])
 
     return atoms_pole_numbers, fragments
+
+
+def fragment_scatter_index(atoms_pole_numbers, npoles):
+    """
+    Precompute the indices used to sum per-pole quantities into per-fragment quantities.
+
+    The pole indices of all fragments are concatenated into a single array, so that
+    the poles of each fragment are contiguous. The sum over each fragment can then
+    be computed for all probes and fragments with a single call to `np.add.reduceat`.
+
+    Parameters
+    ----------
+    atoms_pole_numbers : list
+        A multidimensional list where each element gives the pole indices in that fragment,
+        as returned by `index_fragments`.
+
+    npoles : int
+        The number of poles.
+
+    Returns
+    -------
+    pole_index : np.ndarray or None
+        The (0-indexed) pole indices, ordered by fragment. None if the poles are
+        already ordered by fragment, in which case no reordering is needed.
+
+    offsets : np.ndarray
+        The position in `pole_index` at which each fragment starts.
+    """
+    pole_index = np.concatenate(atoms_pole_numbers).astype(np.intp) - 1
+
+    lengths = np.array([len(poles) for poles in atoms_pole_numbers])
+    offsets = np.zeros(len(lengths), dtype=np.intp)
+    offsets[1:] = np.cumsum(lengths)[:-1]
+
+    if np.array_equal(pole_index, np.arange(npoles)):
+        pole_index = None
+
+    return pole_index, offsets
+
+
+def reduce_to_fragments(field, pole_index, offsets):
+    """
+    Sum a per-pole field over the poles of each fragment.
+
+    Parameters
+    ----------
+    field : np.ndarray
+        The field at each pole, with shape (n_probes, n_poles, 3).
+
+    pole_index : np.ndarray or None
+        The pole indices ordered by fragment, from `fragment_scatter_index`.
+
+    offsets : np.ndarray
+        The start of each fragment in `pole_index`, from `fragment_scatter_index`.
+
+    Returns
+    -------
+    fragment_field : np.ndarray
+        The field due to each fragment, with shape (n_probes, n_fragments, 3).
+    """
+    if pole_index is not None:
+        field = field[:, pole_index]
+
+    return np.add.reduceat(field, offsets, axis=1)
+
+
+def fragment_map(pole_index, offsets, npoles):
+    """
+    Find the fragment of each pole, as sent to engines which sum the field over the fragments.
+
+    Parameters
+    ----------
+    pole_index : np.ndarray or None
+        The pole indices ordered by fragment, from `fragment_scatter_index`.
+
+    offsets : np.ndarray
+        The start of each fragment in `pole_index`, from `fragment_scatter_index`.
+
+    npoles : int
+        The number of poles.
+
+    Returns
+    -------
+    pole_fragments : np.ndarray
+        The (1-indexed) position of the fragment of each pole among the fragments, or 0 for
+        poles which are not in any fragment.
+    """
+    if pole_index is None:
+        pole_index = np.arange(npoles)
+
+    lengths = np.diff(np.append(offsets, len(pole_index)))
+
+    pole_fragments = np.zeros(npoles, dtype=np.int32)
+    pole_fragments[pole_index] = np.repeat(np.arange(1, len(offsets) + 1), lengths)
+
+    return pole_fragments
+
+
+def project_pairs(totfield, probe_coordinates):
+    """
+    Project the average field at each pair of probes onto the direction between the probes.
+
+    The pairs are ordered as by `itertools.combinations`. Rather than looping over the pairs,
+    the projections of all pairs which share their first probe are calculated at once.
+
+    Parameters
+    ----------
+    totfield : np.ndarray
+        The field at each probe due to each fragment, with shape (n_probes, n_fragments, 3).
+
+    probe_coordinates : np.ndarray
+        The coordinates of the probes, with shape (n_probes, 3).
+
+    Returns
+    -------
+    efield : np.ndarray
+        The projected field for each pair of probes, with shape (n_pairs, n_fragments).
+    """
+    nprobes = len(probe_coordinates)
+    first, second = np.triu_indices(nprobes, 1)
+
+    # Unit vectors from the first to the second probe of each pair, halved to average the fields
+    direction = probe_coordinates[second] - probe_coordinates[first]
+    direction /= 2 * np.linalg.norm(direction, axis=1, keepdims=True)
+
+    efield = np.empty((len(first), totfield.shape[1]))
+    start = 0
+    for i in range(nprobes - 1):
+        end = start + nprobes - 1 - i
+        pair_direction = direction[start:end]
+
+        # The field at probe i, and at each probe paired with it, along the pair directions
+        np.matmul(pair_direction, totfield[i].T, out=efield[start:end])
+        efield[start:end] += np.einsum("jfk,jk->jf", totfield[i + 1 :], pair_direction)
+
+        start = end
+
+    return efield
+
+
+def parse_probe_groups(groups):
+    """
+    Parse the probe groups given to -probes.
+
+    Each group is given as its name, a colon and the atom numbers of its probes separated by
+    spaces, for example "bond: 1 40". A single group may be given without a name.
+
+    Parameters
+    ----------
+    groups : list
+        The probe groups.
+
+    Returns
+    -------
+    probe_groups : list
+        The name of each group (None for a single unnamed group), and the atom numbers of
+        its probes.
+    """
+    probe_groups = []
+    for group in groups:
+        name, separator, atoms = group.rpartition(":")
+        name = name.strip() if separator else None
+
+        if len(groups) > 1 and not name:
+            raise Exception(
+                f"The probe group '{group}' must be named, as in 'bond: 1 40'."
+            )
+
+        probe_groups.append((name, [int(atom) for atom in atoms.split()]))
+
+    names = [name for name, probes in probe_groups]
+    if len(set(names)) < len(names):
+        raise Exception("The names of the probe groups must be unique.")
+
+    return probe_groups
+
+
+def output_filename(file_name, *tags):
+    """
+    Add tags to an output file name.
+
+    Parameters
+    ----------
+    file_name : str
+        The file name, for example proj_totfield.csv.
+
+    tags : str
+        Tags to add before the file extension. Tags which are None are skipped.
+
+    Returns
+    -------
+    file_name : str
+        The tagged file name, for example proj_totfield_residue.csv.
+    """
+    root, extension = os.path.splitext(file_name)
+    return "_".join([root] + [str(tag) for tag in tags if tag is not None]) + extension
+
+
+def read_trajectory_list(names):
+    """
+    Expand the trajectories given to -snap into a list of trajectory files.
+
+    A name starting with @ is a manifest: a text file listing one trajectory per line. Blank
+    lines and lines starting with # are skipped, and relative paths are relative to the
+    directory of the manifest.
+
+    Parameters
+    ----------
+    names : list
+        The trajectory files and manifests.
+
+    Returns
+    -------
+    file_paths : list
+        The trajectory files, in the order given.
+    """
+    file_paths = []
+    for name in names:
+        if not name.startswith("@"):
+            file_paths.append(name)
+            continue
+
+        manifest = name[1:]
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    file_paths.append(os.path.join(os.path.dirname(manifest), line))
+
+    if not file_paths:
+        raise Exception("No trajectories were given.")
+
+    return file_paths
+
+
+def trajectory_output_tags(file_paths):
+    """
+    Choose the tag which names the output files of each trajectory.
+
+    Trajectories are tagged by their file name without the extension. If these are not
+    unique, for example for replica1/traj.arc and replica2/traj.arc, they are tagged by
+    their path from the common directory of the trajectories (replica1_traj and replica2_traj).
+
+    Parameters
+    ----------
+    file_paths : list
+        The trajectory files.
+
+    Returns
+    -------
+    tags : list
+        The tag of each trajectory, to be passed to `output_filename`.
+    """
+    tags = [os.path.splitext(os.path.basename(path))[0] for path in file_paths]
+    if len(set(tags)) == len(tags):
+        return tags
+
+    file_paths = [os.path.abspath(path) for path in file_paths]
+    common = os.path.dirname(os.path.commonprefix(file_paths))
+    tags = [
+        os.path.splitext(os.path.relpath(path, common))[0].replace(os.sep, "_")
+        for path in file_paths
+    ]
+    if len(set(tags)) < len(tags):
+        raise Exception("The same trajectory was given more than once.")
+
+    return tags
+
+
+def count_frames(file_path, natoms, skip_line):
+    """
+    Count the number of frames in a Tinker trajectory file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the trajectory file.
+
+    natoms : int
+        The number of atoms in each frame.
+
+    skip_line : int
+        The number of header lines in each frame (2 if box information is present, otherwise 1).
+
+    Returns
+    -------
+    nframes : int
+        The number of complete frames in the trajectory.
+    """
+    nlines = 0
+    last_character = b"\n"
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 24), b""):
+            nlines += block.count(b"\n")
+            last_character = block[-1:]
+
+    # The last line may not end with a newline character.
+    if last_character != b"\n":
+        nlines += 1
+
+    return nlines // (natoms + skip_line)
+
+
+def read_arc_frames(
+    file_path, natoms, skip_line, frames=None, offsets=None, buffer=None
+):
+    """
+    Read the coordinates from each frame of a Tinker trajectory (.arc) file.
+
+    Only the coordinate columns are parsed, and they are written into the same
+    buffer for every frame, so the coordinates of a frame must be used (or copied)
+    before the next frame is read.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the trajectory file.
+
+    natoms : int
+        The number of atoms in each frame.
+
+    skip_line : int
+        The number of header lines in each frame (2 if box information is present, otherwise 1).
+
+    frames : np.ndarray, optional
+        The (1-indexed) frame numbers to read. Other frames are skipped without being parsed.
+        All frames are read if not given.
+
+    offsets : np.ndarray, optional
+        The byte offset of the start of each frame, as returned by `index_arc_frames`.
+        When given with `frames`, the reader seeks directly to each requested frame.
+
+    buffer : np.ndarray, optional
+        A float64 array with shape (natoms, 3) to write the coordinates into.
+
+    Yields
+    ------
+    snap_num : int
+        The (1-indexed) frame number.
+
+    coords : np.ndarray
+        The coordinates (in Angstrom) of the atoms in the frame, with shape (natoms, 3).
+    """
+    if buffer is None:
+        buffer = np.empty((natoms, 3))
+
+    with open(file_path, "rb") as f:
+        if frames is not None and offsets is not None:
+            for snap_num in frames:
+                f.seek(offsets[snap_num - 1])
+                if _read_arc_frame(f, natoms, skip_line, buffer):
+                    yield int(snap_num), buffer
+            return
+
+        if frames is not None:
+            frames = set(int(frame) for frame in frames)
+            last_frame = max(frames, default=0)
+
+        snap_num = 0
+        while frames is None or snap_num < last_frame:
+            snap_num += 1
+            if frames is not None and snap_num not in frames:
+                # Skip the frame without parsing it.
+                lines = list(islice(f, natoms + skip_line))
+                if len(lines) < natoms + skip_line:
+                    return
+                continue
+
+            if not _read_arc_frame(f, natoms, skip_line, buffer):
+                return
+
+            yield snap_num, buffer
+
+
+def _read_arc_frame(f, natoms, skip_line, buffer):
+    """
+    Parse the coordinates of the frame which starts at the current position of f into buffer.
+
+    Returns False if the frame is incomplete.
+    """
+    header = [f.readline() for _ in range(skip_line)]
+    lines = list(islice(f, natoms))
+
+    # Stop at the end of the file, or at an incomplete frame.
+    if len(lines) < natoms:
+        return False
+
+    # Columns 2-4 are the coordinates.
+    buffer[:] = np.loadtxt(lines, usecols=(2, 3, 4), ndmin=2)
+
+    return True
+
+
+def _arc_coordinate_columns(line):
+    """
+    Find the fixed-width columns which hold the coordinates in an atom line of a Tinker trajectory.
+
+    Tinker writes the coordinates as three right-aligned fixed-point fields of equal width,
+    following the atom name.
+
+    Returns
+    -------
+    columns : tuple or None
+        The start of the first coordinate field, the width of each field and the position
+        of the decimal point within a field, or None if the line does not have this layout.
+    """
+    tokens = [match.span() for match in re.finditer(rb"\S+", line)]
+    if len(tokens) < 5:
+        return None
+
+    # The fields are right-aligned, so their width is the distance between the ends of the coordinates.
+    width = tokens[3][1] - tokens[2][1]
+    start = tokens[2][1] - width
+    if tokens[4][1] - tokens[3][1] != width or start < tokens[1][1]:
+        return None
+
+    # The decimal point must be in the same place in each field.
+    fields = [line[start + i * width : start + (i + 1) * width] for i in range(3)]
+    point = fields[0].find(b".")
+    if point < 0 or any(field.find(b".") != point for field in fields):
+        return None
+
+    return start, width, point
+
+
+def read_arc_frames_mmap(file_path, natoms, skip_line, frames, offsets, buffer=None):
+    """
+    Read the coordinates of frames of a Tinker trajectory (.arc) file through a memory map.
+
+    The coordinates of all atoms in a frame are converted from their fixed-width columns with
+    vectorized operations on the mapped bytes, so no Python code runs per line. The pages of
+    the file are managed by the operating system, so they are shared with other processes
+    reading the same trajectory. Frames which do not have the fixed-width layout of the
+    first frame are parsed in the same way as `read_arc_frames`.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the trajectory file.
+
+    natoms : int
+        The number of atoms in each frame.
+
+    skip_line : int
+        The number of header lines in each frame (2 if box information is present, otherwise 1).
+
+    frames : np.ndarray
+        The (1-indexed) frame numbers to read.
+
+    offsets : np.ndarray
+        The byte offset of the start of each frame, as returned by `index_arc_frames`.
+
+    buffer : np.ndarray, optional
+        A float64 array with shape (natoms, 3) to write the coordinates into.
+
+    Yields
+    ------
+    snap_num : int
+        The (1-indexed) frame number.
+
+    coords : np.ndarray
+        The coordinates (in Angstrom) of the atoms in the frame, with shape (natoms, 3).
+    """
+    if buffer is None:
+        buffer = np.empty((natoms, 3))
+
+    if len(offsets) == 0:
+        return
+
+    with open(file_path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        data = np.frombuffer(mapped, dtype=np.uint8)
+        try:
+            # Get the layout of the coordinate columns from the first atom line.
+            line_start = offsets[0]
+            for _ in range(skip_line):
+                line_start = mapped.find(b"\n", line_start) + 1
+            columns = _arc_coordinate_columns(
+                mapped[line_start : mapped.find(b"\n", line_start)]
+            )
+
+            for snap_num in frames:
+                frame_start = offsets[snap_num - 1]
+                if snap_num < len(offsets):
+                    frame_end = offsets[snap_num]
+                else:
+                    frame_end = len(data)
+
+                parsed = columns is not None and _parse_fixed_width_frame(
+                    data[frame_start:frame_end], natoms, skip_line, columns, buffer
+                )
+
+                if not parsed:
+                    f.seek(frame_start)
+                    if not _read_arc_frame(f, natoms, skip_line, buffer):
+                        return
+
+                yield int(snap_num), buffer
+        finally:
+            # The mapped file cannot be closed while an array is using its memory.
+            del data
+
+
+def _parse_fixed_width_frame(frame, natoms, skip_line, columns, buffer):
+    """
+    Parse the coordinates of a frame from the fixed-width columns of its atom lines into buffer.
+
+    The digits of every field are converted at once to an integer number of the smallest
+    decimal unit, which is then divided by the scale of the decimal point. This gives the
+    same values as parsing each field as text.
+
+    Parameters
+    ----------
+    frame : np.ndarray
+        The bytes of the frame, as uint8.
+
+    columns : tuple
+        The start of the first coordinate field, the width of each field and the position
+        of the decimal point, as returned by `_arc_coordinate_columns`.
+
+    Returns
+    -------
+    parsed : bool
+        False if the frame does not have the expected layout.
+    """
+    start, width, point = columns
+
+    newlines = np.flatnonzero(frame == 10)
+    line_starts = newlines[skip_line - 1 : skip_line - 1 + natoms] + 1
+    line_ends = np.append(newlines, len(frame))[skip_line : skip_line + natoms]
+
+    # Every atom line must be long enough to hold the coordinate fields.
+    if len(line_starts) < natoms or np.any(line_ends - line_starts < start + 3 * width):
+        return False
+
+    # The characters of the coordinate fields, with one row per field.
+    fields = frame[line_starts[:, None] + start + np.arange(3 * width)].reshape(
+        3 * natoms, width
+    )
+
+    # Fields may only contain digits, spaces and a minus sign around the decimal point.
+    digits = fields - np.uint8(ord("0"))
+    is_digit = digits < 10
+    is_minus = fields == ord("-")
+    if not np.all(fields[:, point] == ord(".")):
+        return False
+    is_digit[:, point] = True
+    if not np.all(is_digit | is_minus | (fields == ord(" "))):
+        return False
+    is_digit[:, point] = False
+
+    # The value of each digit position, skipping the decimal point.
+    position = np.arange(width)
+    exponent = np.where(position < point, width - 2 - position, width - 1 - position)
+    place_value = np.where(position == point, 0.0, 10.0**exponent)
+
+    values = (digits * is_digit).astype(np.float64) @ place_value
+    values /= 10.0 ** (width - 1 - point)
+    values *= 1 - 2 * (is_minus.astype(np.float64) @ np.ones(width))
+
+    buffer[:] = values.reshape(natoms, 3)
+
+    return True
+
+
+def index_arc_frames(file_path, natoms, skip_line):
+    """
+    Find the byte offset of the start of each frame in a Tinker trajectory file.
+
+    The file is read once in large blocks, without parsing any lines.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the trajectory file.
+
+    natoms : int
+        The number of atoms in each frame.
+
+    skip_line : int
+        The number of header lines in each frame (2 if box information is present, otherwise 1).
+
+    Returns
+    -------
+    offsets : np.ndarray
+        The byte offset of the first line of each complete frame.
+    """
+    lines_per_frame = natoms + skip_line
+
+    # Byte offsets of the lines following each frame.
+    frame_ends = []
+    nlines = 0
+    position = 0
+    last_character = b"\n"
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 24), b""):
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+            line_numbers = nlines + np.arange(1, len(newlines) + 1)
+            frame_ends.append(
+                position + newlines[line_numbers % lines_per_frame == 0] + 1
+            )
+
+            nlines += len(newlines)
+            position += len(block)
+            last_character = block[-1:]
+
+    # The last line may not end with a newline character.
+    if last_character != b"\n":
+        nlines += 1
+
+    nframes = nlines // lines_per_frame
+    offsets = np.concatenate([[0]] + frame_ends).astype(np.int64)
+
+    return offsets[:nframes]
+
+
+def load_frame_index(file_path, natoms, skip_line):
+    """
+    Load the frame offsets of a trajectory from its index file, creating the index if needed.
+
+    The index is stored next to the trajectory (with the extension .idx.npz), and is
+    rebuilt if the size or modification time of the trajectory have changed.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the trajectory file.
+
+    natoms : int
+        The number of atoms in each frame.
+
+    skip_line : int
+        The number of header lines in each frame (2 if box information is present, otherwise 1).
+
+    Returns
+    -------
+    offsets : np.ndarray
+        The byte offset of the first line of each complete frame.
+    """
+    index_path = f"{file_path}.idx.npz"
+    stat = os.stat(file_path)
+    key = np.array([stat.st_size, stat.st_mtime_ns, natoms, skip_line], dtype=np.int64)
+
+    try:
+        with np.load(index_path) as index:
+            if np.array_equal(index["key"], key):
+                return index["offsets"]
+    except (OSError, KeyError, ValueError):
+        pass
+
+    offsets = index_arc_frames(file_path, natoms, skip_line)
+
+    # The index is only a cache, so it does not matter if it cannot be written.
+    try:
+        with open(index_path, "wb") as f:
+            np.savez(f, key=key, offsets=offsets)
+    except OSError:
+        pass
+
+    return offsets
+
+
+def load_topology(file_path, natoms, npoles, query, sources=()):
+    """
+    Load the pole indices and molecules of the system from the topology sidecar of a trajectory,
+    querying them from an engine if needed.
+
+    The topology is stored next to the trajectory (with the extension .topology.npz), and is
+    queried again if the number of atoms or poles reported by the engine have changed, or if
+    the path, size or modification time of any of the files which define the system of the
+    engine have changed.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the trajectory file.
+
+    natoms : int
+        The number of atoms reported by the engine.
+
+    npoles : int
+        The number of poles reported by the engine.
+
+    query : callable
+        Called without arguments to query the pole index and the molecule of each atom from
+        an engine, if the sidecar cannot be used.
+
+    sources : list, optional
+        The files which define the system of the engine, such as its key file, parameter
+        files and structure file.
+
+    Returns
+    -------
+    ipoles : np.ndarray
+        The (1-indexed) pole index of each atom.
+
+    molecules : np.ndarray
+        The molecule number of each atom.
+    """
+    topology_path = f"{file_path}.topology.npz"
+
+    files = []
+    for source in sources:
+        stat = os.stat(source)
+        files.append([os.path.abspath(source), stat.st_size, stat.st_mtime_ns])
+    key = json.dumps({"natoms": natoms, "npoles": npoles, "files": files})
+
+    try:
+        with np.load(topology_path) as topology:
+            if str(topology["key"]) == key:
+                return topology["ipoles"], topology["molecules"]
+    except (OSError, KeyError, ValueError):
+        pass
+
+    ipoles, molecules = query()
+
+    # The sidecar is only a cache, so it does not matter if it cannot be written.
+    try:
+        with open(topology_path, "wb") as f:
+            np.savez(f, key=key, ipoles=ipoles, molecules=molecules)
+    except OSError:
+        pass
+
+    return ipoles, molecules
+
+
+def read_arc_header(file_path):
+    """
+    Read the number of atoms and the number of header lines per frame of a Tinker trajectory.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the trajectory file.
+
+    Returns
+    -------
+    natoms : int
+        The number of atoms in each frame.
+
+    skip_line : int
+        The number of header lines in each frame (2 if box information is present, otherwise 1).
+    """
+    with open(file_path, "r") as snapshot_file:
+        first_line = snapshot_file.readline()
+        natoms = int(first_line.split()[0])
+        second_line = snapshot_file.readline().split()
+        if len(second_line) == 6:
+            # This line gives box information if length is 6.
+            # This means we will need to skip two lines for every frame.
+            skip_line = 2
+        else:
+            skip_line = 1
+
+    return natoms, skip_line
+
+
+def write_coordinate_cache(
+    file_path, cache_path, natoms, skip_line, offsets=None, dtype=np.float64
+):
+    """
+    Convert a Tinker trajectory (.arc) file into a binary coordinate cache.
+
+    The coordinates are written to a .npy file as one contiguous array with shape
+    (frames, natoms, 3), in Angstrom. If the trajectory has box information, the six box
+    parameters of each frame are written to a second .npy file with shape (frames, 6),
+    named by `output_filename(cache_path, "box")`.
+
+    Once the cache is complete, the path, size and modification time of the trajectory and
+    the number of frames are recorded next to the cache (with the extension .source.json),
+    so that `coordinate_cache_is_current` can check that the cache is of the trajectory.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the trajectory file.
+
+    cache_path : str
+        The path of the .npy file to write the coordinates to.
+
+    natoms : int
+        The number of atoms in each frame.
+
+    skip_line : int
+        The number of header lines in each frame (2 if box information is present, otherwise 1).
+
+    offsets : np.ndarray, optional
+        The byte offset of the start of each frame, as returned by `index_arc_frames`.
+        The trajectory is indexed if not given.
+
+    dtype : np.dtype, optional
+        The data type of the stored coordinates (float64 or float32).
+
+    Returns
+    -------
+    nframes : int
+        The number of frames written.
+    """
+    if offsets is None:
+        offsets = index_arc_frames(file_path, natoms, skip_line)
+    nframes = len(offsets)
+
+    # Write the frames straight into the file, so the trajectory never has to fit in memory.
+    coordinates = np.lib.format.open_memmap(
+        cache_path, mode="w+", dtype=dtype, shape=(nframes, natoms, 3)
+    )
+    frames = np.arange(1, nframes + 1)
+    for snap_num, coords in read_arc_frames_mmap(
+        file_path, natoms, skip_line, frames, offsets
+    ):
+        coordinates[snap_num - 1] = coords
+    coordinates.flush()
+    del coordinates
+
+    if skip_line == 2:
+        box = np.empty((nframes, 6))
+        with open(file_path, "rb") as f:
+            for i, offset in enumerate(offsets):
+                f.seek(offset)
+                f.readline()
+                box[i] = f.readline().split()
+        np.save(output_filename(cache_path, "box"), box)
+
+    stat = os.stat(file_path)
+    source = {
+        "path": os.path.realpath(file_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "frames": nframes,
+    }
+    with open(f"{cache_path}.source.json", "w") as f:
+        json.dump(source, f)
+
+    return nframes
+
+
+def coordinate_cache_is_current(cache_path, file_path):
+    """
+    Check whether a coordinate cache exists and was written from the current trajectory.
+
+    The trajectory recorded by `write_coordinate_cache` must have the same path, size and
+    modification time as `file_path`, and the cache must hold all of its frames.
+
+    Parameters
+    ----------
+    cache_path : str
+        The path of the coordinate cache.
+
+    file_path : str
+        The path to the trajectory file. The cache is considered current if the trajectory
+        does not exist.
+
+    Returns
+    -------
+    current : bool
+        True if the cache can be used in place of the trajectory.
+    """
+    if not os.path.exists(cache_path):
+        return False
+
+    if not os.path.exists(file_path):
+        return True
+
+    try:
+        with open(f"{cache_path}.source.json") as f:
+            source = json.load(f)
+        nframes = np.load(cache_path, mmap_mode="r").shape[0]
+    except (OSError, ValueError):
+        return False
+
+    stat = os.stat(file_path)
+    return source == {
+        "path": os.path.realpath(file_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "frames": nframes,
+    }
+
+
+def read_coordinate_cache(coordinates, frames, buffer=None):
+    """
+    Read the coordinates of frames from a binary coordinate cache.
+
+    Parameters
+    ----------
+    coordinates : np.ndarray
+        The cached coordinates with shape (frames, natoms, 3), usually opened with
+        `np.load(cache_path, mmap_mode="r")` so that only the frames read are loaded.
+
+    frames : np.ndarray
+        The (1-indexed) frame numbers to read.
+
+    buffer : np.ndarray, optional
+        A float64 array with shape (natoms, 3) to write the coordinates into.
+
+    Yields
+    ------
+    snap_num : int
+        The (1-indexed) frame number.
+
+    coords : np.ndarray
+        The coordinates (in Angstrom) of the atoms in the frame, with shape (natoms, 3).
+    """
+    if buffer is None:
+        buffer = np.empty(coordinates.shape[1:])
+
+    for snap_num in frames:
+        buffer[:] = coordinates[snap_num - 1]
+        yield int(snap_num), buffer
+
+
+def prefetch_frames(trajectory, depth):
+    """
+    Read frames from a trajectory reader in a background thread.
+
+    The reader runs ahead of the caller by up to `depth` frames. Each frame is copied into one
+    of `depth + 1` buffers, so the memory used is bounded no matter how far the caller falls
+    behind. A buffer is reused once the caller asks for the next frame, so, as with the readers
+    themselves, the coordinates of a frame must be used (or copied) before the next frame is read.
+
+    Parameters
+    ----------
+    trajectory : iterator
+        A trajectory reader yielding (snap_num, coords), such as `read_arc_frames`. The frame
+        numbers are passed on as they are, so `interleave_trajectories` can also be used.
+
+    depth : int
+        The maximum number of frames to read ahead. If less than 1, frames are read from
+        `trajectory` directly.
+
+    Yields
+    ------
+    snap_num : int
+        The (1-indexed) frame number.
+
+    coords : np.ndarray
+        The coordinates (in Angstrom) of the atoms in the frame, with shape (natoms, 3).
+    """
+    if depth < 1:
+        yield from trajectory
+        return
+
+    ready = queue.Queue()
+    free = queue.Queue()
+    for i in range(depth + 1):
+        free.put(None)
+
+    stop = threading.Event()
+
+    def read():
+        try:
+            for snap_num, coords in trajectory:
+                buffer = free.get()
+                if stop.is_set():
+                    return
+                if buffer is None:
+                    buffer = np.empty_like(coords)
+                buffer[:] = coords
+                ready.put((snap_num, buffer))
+            ready.put(None)
+        except Exception as error:
+            ready.put(error)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+
+    try:
+        while True:
+            item = ready.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            snap_num, buffer = item
+            yield snap_num, buffer
+            free.put(buffer)
+    finally:
+        # Release the reader if the caller stops early.
+        stop.set()
+        free.put(None)
+        reader.join()
+
+
+def interleave_trajectories(trajectories):
+    """
+    Take frames from several trajectory readers in turn.
+
+    One frame is taken from each trajectory that has frames left, so that the frames of all
+    trajectories are analyzed at the same time. As with the readers themselves, the
+    coordinates of a frame must be used (or copied) before the next frame of the same
+    trajectory is read.
+
+    Parameters
+    ----------
+    trajectories : list
+        Trajectory readers yielding (snap_num, coords), such as `read_arc_frames`.
+
+    Yields
+    ------
+    frame : tuple
+        The position of the trajectory in `trajectories`, and the (1-indexed) frame number.
+
+    coords : np.ndarray
+        The coordinates (in Angstrom) of the atoms in the frame, with shape (natoms, 3).
+    """
+    readers = [
+        (itrajectory, iter(reader)) for itrajectory, reader in enumerate(trajectories)
+    ]
+    while readers:
+        remaining = []
+        for itrajectory, reader in readers:
+            frame = next(reader, None)
+            if frame is None:
+                continue
+
+            snap_num, coords = frame
+            yield (itrajectory, snap_num), coords
+            remaining.append((itrajectory, reader))
+        readers = remaining
+
+
+def parse_frames(frames):
+    """
+    Parse a selection of frames.
+
+    Parameters
+    ----------
+    frames : str
+        Frame numbers or inclusive ranges of frame numbers separated by spaces,
+        for example "1-100 250 300-400".
+
+    Returns
+    -------
+    selection : np.ndarray
+        The sorted, unique frame numbers.
+    """
+    selection = []
+    for item in frames.replace(",", " ").split():
+        first, _, last = item.partition("-")
+        if last:
+            selection.extend(range(int(first), int(last) + 1))
+        else:
+            selection.append(int(first))
+
+    return np.unique(np.array(selection, dtype=int))
+
+
+def analysis_frames(nframes, equil, stride, selection=None):
+    """
+    Calculate the frame numbers which will be analyzed.
+
+    Parameters
+    ----------
+    nframes : int
+        The number of frames in the trajectory.
+
+    equil : int
+        The number of frames to skip at the beginning of the trajectory.
+
+    stride : int
+        The number of frames between analyzed frames.
+
+    selection : np.ndarray, optional
+        The frame numbers selected by the user. If given, only these frames are analyzed.
+
+    Returns
+    -------
+    frames : np.ndarray
+        The (1-indexed) frame numbers to analyze.
+    """
+    frames = np.arange(equil + stride, nframes + 1, stride)
+
+    if selection is not None:
+        frames = np.intersect1d(frames, selection)
+
+    return frames
+
+
+class ResultStore:
+    """
+    Preallocated storage for the electric field at the probes for every analyzed frame.
+
+    Results for each frame are written in place into arrays which are sized when the
+    store is created, and are only converted to the ELECTRIC output layout at the end
+    of the calculation.
+
+    Parameters
+    ----------
+    frames : np.ndarray
+        The frame numbers which will be analyzed.
+
+    fragments : list
+        The fragment numbers.
+
+    probes : list
+        The atom numbers of the probes.
+
+    by_type : str
+        The type of fragment (atom, molecule or residue).
+
+    projection : bool, optional
+        Store the projection of the field between each pair of probes when True.
+    """
+
+    def __init__(self, frames, fragments, probes, by_type, projection=True):
+        self.frames = np.asarray(frames)
+        self.fragments = fragments
+        self.probes = list(probes)
+        self.by_type = by_type
+
+        if projection:
+            self.pairs = list(combinations(range(len(self.probes)), 2))
+        else:
+            self.pairs = None
+
+        # n_frames x n_fragments x n_probes x 3
+        self.components = np.zeros(
+            (len(self.frames), len(fragments), len(self.probes), 3)
+        )
+
+        # n_frames x n_fragments x n_pairs
+        if projection:
+            self.projection = np.zeros(
+                (len(self.frames), len(fragments), len(self.pairs))
+            )
+        else:
+            self.projection = None
+
+        self.filled = np.zeros(len(self.frames), dtype=bool)
+
+    def add_frame(self, slot, totfield, efield=None):
+        """
+        Store the results for one frame.
+
+        Parameters
+        ----------
+        slot : int
+            The position of the frame in `frames`.
+
+        totfield : np.ndarray
+            The field at each probe due to each fragment, with shape (n_probes, n_fragments, 3).
+
+        efield : np.ndarray, optional
+            The projected field for each probe pair, with shape (n_pairs, n_fragments).
+        """
+        self.components[slot] = totfield.transpose(1, 0, 2)
+        if efield is not None:
+            self.projection[slot] = efield.T
+        self.filled[slot] = True
+
+    def _filled(self, data):
+        if self.filled.all():
+            return self.frames, data
+        return self.frames[self.filled], data[self.filled]
+
+    def components_dataframe(self):
+        """
+        Convert the stored field components to the layout of ef_components.csv.
+
+        Returns
+        -------
+        components : pd.DataFrame
+            The field components with one row per fragment and dimension, and
+            one column per probe and frame.
+        """
+        frames, data = self._filled(self.components)
+
+        index = [
+            f"{self.by_type} {x} {n} dimension"
+            for x in self.fragments
+            for n in ["x", "y", "z"]
+        ]
+        columns = [
+            f"{probe} - frame {frame}" for frame in frames for probe in self.probes
+        ]
+
+        data = data.transpose(1, 3, 0, 2).reshape(len(index), len(columns))
+
+        components = pd.DataFrame(data, index=index, columns=columns)
+        components.index.name = "Fragment and Dimension"
+
+        return components
+
+    def projection_dataframe(self):
+        """
+        Convert the stored projections to the layout of proj_totfield.csv.
+
+        Returns
+        -------
+        output : pd.DataFrame
+            The projected field with one row per fragment, and one column
+            per probe pair and frame.
+        """
+        frames, data = self._filled(self.projection)
+
+        index = [f"{self.by_type} {x}" for x in self.fragments]
+        columns = [
+            f"{self.probes[i]} and {self.probes[j]} - frame {frame}"
+            for frame in frames
+            for i, j in self.pairs
+        ]
+
+        data = data.transpose(1, 0, 2).reshape(len(index), len(columns))
+
+        return pd.DataFrame(data, index=index, columns=columns)
+
+    def _arrays(self, dtype):
+        frames, components = self._filled(self.components)
+        arrays = {
+            "frames": frames,
+            "fragments": np.asarray(self.fragments),
+            "probes": np.asarray(self.probes),
+            "components": components.astype(dtype),
+        }
+        if self.projection is not None:
+            arrays["pairs"] = np.asarray(self.probes)[np.array(self.pairs)]
+            arrays["projection"] = self._filled(self.projection)[1].astype(dtype)
+        return arrays
+
+    def save_npz(self, file_name, dtype=np.float64):
+        """
+        Save the stored results to a compressed .npz file.
+
+        The file holds the arrays `frames`, `fragments` and `probes`, the field components
+        with shape (frames, fragments, probes, 3), and, if projections are stored, the probe
+        atoms of each pair as `pairs` and the projections with shape (frames, fragments, pairs).
+        The type of fragment is stored as `by_type`.
+
+        Parameters
+        ----------
+        file_name : str
+            The name of the file to write.
+
+        dtype : np.dtype, optional
+            The data type of the stored fields (float64 or float32).
+        """
+        np.savez_compressed(
+            file_name, by_type=np.array(self.by_type), **self._arrays(dtype)
+        )
+
+    def save_hdf5(self, file_name, dtype=np.float64):
+        """
+        Save the stored results to an HDF5 file.
+
+        The file holds the same arrays as written by `save_npz`, as datasets which are
+        compressed and chunked by frame, with the dimensions of the fields labeled.
+        This requires h5py.
+
+        Parameters
+        ----------
+        file_name : str
+            The name of the file to write.
+
+        dtype : np.dtype, optional
+            The data type of the stored fields (float64 or float32).
+        """
+        if h5py is None:
+            raise ImportError("Writing HDF5 files requires h5py.")
+
+        arrays = self._arrays(dtype)
+        labels = {
+            "components": ["frame", self.by_type, "probe", "dimension"],
+            "projection": ["frame", self.by_type, "pair"],
+        }
+
+        with h5py.File(file_name, "w") as f:
+            f.attrs["by_type"] = self.by_type
+            f.attrs["units"] = "MV/cm"
+            for name, data in arrays.items():
+                if name in labels:
+                    chunks = (1,) + data.shape[1:] if len(data) else None
+                    dataset = f.create_dataset(
+                        name, data=data, chunks=chunks, compression="gzip"
+                    )
+                    for dim, label in zip(dataset.dims, labels[name]):
+                        dim.label = label
+                else:
+                    f.create_dataset(name, data=data)
+
+
+class _RunningMoments:
+    """
+    Running mean, variance, minimum and maximum of arrays, updated with Welford's algorithm.
+
+    If `block_size` is given, the mean of each block of `block_size` consecutive frames is
+    also accumulated, to estimate the standard error of the mean from the spread of the
+    block means. Frames may be added in any order; only incomplete blocks are kept.
+    """
+
+    def __init__(self, shape, block_size=0):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+
+        self.block_size = block_size
+        self.blocks = {}
+        self.block_count = 0
+        self.block_mean = np.zeros(shape)
+        self.block_m2 = np.zeros(shape)
+
+    def add(self, slot, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        np.minimum(self.min, value, out=self.min)
+        np.maximum(self.max, value, out=self.max)
+
+        if self.block_size > 0:
+            block = slot // self.block_size
+            total, count = self.blocks.pop(block, (0, 0))
+            total = total + value
+            count += 1
+
+            if count < self.block_size:
+                self.blocks[block] = (total, count)
+            else:
+                self.block_count += 1
+                delta = total / count - self.block_mean
+                self.block_mean += delta / self.block_count
+                self.block_m2 += delta * (total / count - self.block_mean)
+
+    def std(self):
+        if self.count < 2:
+            return np.full_like(self.mean, np.nan)
+        return np.sqrt(self.m2 / (self.count - 1))
+
+    def block_error(self):
+        if self.block_count < 2:
+            return np.full_like(self.mean, np.nan)
+        return np.sqrt(self.block_m2 / (self.block_count - 1) / self.block_count)
+
+
+class RunningStatistics:
+    """
+    Running statistics of the electric field at the probes over the analyzed frames.
+
+    The mean, standard deviation, minimum and maximum of every field component and projection
+    are updated as each frame is added, so memory does not grow with the number of frames.
+    Optionally, the standard error of the mean is estimated from the means of blocks of
+    consecutive frames.
+
+    Parameters
+    ----------
+    frames : np.ndarray
+        The frame numbers which will be analyzed.
+
+    fragments : list
+        The fragment numbers.
+
+    probes : list
+        The atom numbers of the probes.
+
+    by_type : str
+        The type of fragment (atom, molecule or residue).
+
+    projection : bool, optional
+        Accumulate the projection of the field between each pair of probes when True.
+
+    block_size : int, optional
+        The number of consecutive frames in each block used for the block average error.
+        No error is estimated if less than 1.
+    """
+
+    def __init__(
+        self, frames, fragments, probes, by_type, projection=True, block_size=0
+    ):
+        self.frames = np.asarray(frames)
+        self.fragments = fragments
+        self.probes = list(probes)
+        self.by_type = by_type
+        self.block_size = block_size
+
+        self.components = _RunningMoments(
+            (len(fragments), len(self.probes), 3), block_size
+        )
+
+        if projection:
+            self.pairs = list(combinations(range(len(self.probes)), 2))
+            self.projection = _RunningMoments(
+                (len(fragments), len(self.pairs)), block_size
+            )
+        else:
+            self.pairs = None
+            self.projection = None
+
+        self.filled = np.zeros(len(self.frames), dtype=bool)
+        self.lock = threading.Lock()
+
+    def add_frame(self, slot, totfield, efield=None):
+        """
+        Add the results for one frame to the statistics.
+
+        Parameters
+        ----------
+        slot : int
+            The position of the frame in `frames`.
+
+        totfield : np.ndarray
+            The field at each probe due to each fragment, with shape (n_probes, n_fragments, 3).
+
+        efield : np.ndarray, optional
+            The projected field for each probe pair, with shape (n_pairs, n_fragments).
+        """
+        with self.lock:
+            self.components.add(slot, totfield.transpose(1, 0, 2))
+            if efield is not None:
+                self.projection.add(slot, efield.T)
+            self.filled[slot] = True
+
+    def _statistics(self, moments):
+        statistics = {
+            "mean": moments.mean,
+            "standard deviation": moments.std(),
+            "min": moments.min,
+            "max": moments.max,
+        }
+        if self.block_size > 0:
+            statistics["block error"] = moments.block_error()
+        return statistics
+
+    def components_dataframe(self):
+        """
+        Summarize the statistics of the field components.
+
+        Returns
+        -------
+        components : pd.DataFrame
+            One row per fragment and dimension, as in ef_components.csv, and one column
+            per probe and statistic.
+        """
+        statistics = self._statistics(self.components)
+
+        index = [
+            f"{self.by_type} {x} {n} dimension"
+            for x in self.fragments
+            for n in ["x", "y", "z"]
+        ]
+        columns = [f"{probe} - {name}" for probe in self.probes for name in statistics]
+
+        # n_fragments x 3 x n_probes x n_statistics
+        data = np.stack(list(statistics.values()), axis=-1).transpose(0, 2, 1, 3)
+
+        components = pd.DataFrame(
+            data.reshape(len(index), len(columns)), index=index, columns=columns
+        )
+        components.index.name = "Fragment and Dimension"
+
+        return components
+
+    def projection_dataframe(self):
+        """
+        Summarize the statistics of the projected field.
+
+        Returns
+        -------
+        output : pd.DataFrame
+            One row per fragment, as in proj_totfield.csv, and one column per probe pair
+            and statistic.
+        """
+        statistics = self._statistics(self.projection)
+
+        index = [f"{self.by_type} {x}" for x in self.fragments]
+        columns = [
+            f"{self.probes[i]} and {self.probes[j]} - {name}"
+            for i, j in self.pairs
+            for name in statistics
+        ]
+
+        # n_fragments x n_pairs x n_statistics
+        data = np.stack(list(statistics.values()), axis=-1)
+
+        return pd.DataFrame(
+            data.reshape(len(index), len(columns)), index=index, columns=columns
+        )
+
+
+def frame_ranges(frames):
+    """
+    Describe frame numbers as ranges of evenly spaced frames.
+
+    Parameters
+    ----------
+    frames : np.ndarray
+        The frame numbers.
+
+    Returns
+    -------
+    ranges : list
+        The ranges in the order of the frames, each as [first frame, step, number of frames].
+        A single frame has a step of 1.
+
+    Examples
+    --------
+    >>> frame_ranges([1, 3, 5, 6, 7, 20])
+    [[1, 2, 3], [6, 1, 2], [20, 1, 1]]
+    """
+    frames = [int(frame) for frame in frames]
+    ranges = []
+    start = 0
+    while start < len(frames):
+        if start + 1 == len(frames):
+            ranges.append([frames[start], 1, 1])
+            break
+
+        step = frames[start + 1] - frames[start]
+        end = start + 2
+        while end < len(frames) and frames[end] - frames[end - 1] == step:
+            end += 1
+
+        ranges.append([frames[start], step, end - start])
+        start = end
+
+    return ranges
+
+
+class StreamingWriter:
+    """
+    Write the electric field at the probes to CSV files in a long layout as frames are completed.
+
+    Each row of ef_components holds the frame, probe, fragment, dimension and field, and each row
+    of proj_totfield holds the frame, the two probes, the fragment and the projected field.
+    Frames may be added in any order, but are written in the order of `frames`, in chunks of
+    `chunk_size` frames, so only the frames waiting to be written are kept in memory.
+
+    After each chunk, the number of frames written, the ranges of their frame numbers and the
+    size of the files are saved to a progress file next to the components, so that an
+    interrupted calculation can be restarted.
+
+    Parameters
+    ----------
+    frames : np.ndarray
+        The frame numbers which will be analyzed.
+
+    fragments : list
+        The fragment numbers.
+
+    probes : list
+        The atom numbers of the probes.
+
+    by_type : str
+        The type of fragment (atom, molecule or residue).
+
+    projection : bool, optional
+        Write the projection of the field between each pair of probes when True.
+
+    tag : str, optional
+        A tag added to the output file names, as by `output_filename`.
+
+    chunk_size : int, optional
+        The number of frames written at once.
+
+    restart : bool, optional
+        Continue the files of an interrupted calculation, as recorded by the progress file.
+    """
+
+    def __init__(
+        self,
+        frames,
+        fragments,
+        probes,
+        by_type,
+        projection=True,
+        tag=None,
+        chunk_size=10,
+        restart=False,
+    ):
+        self.frames = np.asarray(frames)
+        self.fragments = np.asarray(fragments)
+        self.probes = np.asarray(probes)
+        self.by_type = by_type
+        self.chunk_size = chunk_size
+
+        if projection:
+            self.pairs = np.array(list(combinations(range(len(self.probes)), 2)))
+        else:
+            self.pairs = None
+
+        self.components_path = output_filename("ef_components_long.csv", tag)
+        self.projection_path = output_filename("proj_totfield_long.csv", tag)
+        self.progress_path = f"{self.components_path}.progress"
+
+        self.ranges = frame_ranges(self.frames)
+        self.filled = np.zeros(len(self.frames), dtype=bool)
+        self.written = 0
+        self.pending = {}
+        self.chunk = []
+        self.lock = threading.Lock()
+
+        progress = None
+        if restart and os.path.exists(self.progress_path):
+            with open(self.progress_path) as f:
+                progress = json.load(f)
+
+        if progress is not None:
+            # Drop anything written after the last complete chunk.
+            self.written = progress["frames"]
+            if self._written_ranges() != progress["frame ranges"]:
+                raise Exception(
+                    f"The output files {self.components_path} were written for different frames."
+                )
+            self.filled[: self.written] = True
+
+            self.components_file = open(self.components_path, "r+")
+            self.components_file.truncate(progress["components size"])
+            self.components_file.seek(0, os.SEEK_END)
+            if projection:
+                self.projection_file = open(self.projection_path, "r+")
+                self.projection_file.truncate(progress["projection size"])
+                self.projection_file.seek(0, os.SEEK_END)
+        else:
+            self.components_file = open(self.components_path, "w")
+            self.components_file.write(f"frame,probe,{by_type},dimension,field\n")
+            if projection:
+                self.projection_file = open(self.projection_path, "w")
+                self.projection_file.write(
+                    f"frame,probe 1,probe 2,{by_type},projection\n"
+                )
+
+    def add_frame(self, slot, totfield, efield=None):
+        """
+        Add the results for one frame, writing them once all earlier frames have been written.
+
+        Parameters
+        ----------
+        slot : int
+            The position of the frame in `frames`.
+
+        totfield : np.ndarray
+            The field at each probe due to each fragment, with shape (n_probes, n_fragments, 3).
+
+        efield : np.ndarray, optional
+            The projected field for each probe pair, with shape (n_pairs, n_fragments).
+        """
+        with self.lock:
+            # After a restart, a frame may already have been written for this grouping.
+            if slot < self.written:
+                return
+
+            self.pending[slot] = (totfield, efield)
+            self.filled[slot] = True
+
+            # Frames completed out of order wait until the frames before them are done.
+            next_slot = self.written + len(self.chunk)
+            while next_slot in self.pending:
+                self.chunk.append((next_slot, *self.pending.pop(next_slot)))
+                next_slot += 1
+
+            if len(self.chunk) >= self.chunk_size:
+                self._write()
+
+    def _write(self):
+        if not self.chunk:
+            return
+
+        frames = self.frames[[slot for slot, totfield, efield in self.chunk]]
+        nfragments = len(self.fragments)
+        nprobes = len(self.probes)
+
+        totfield = np.stack([totfield for slot, totfield, efield in self.chunk])
+        components = pd.DataFrame(
+            {
+                "frame": np.repeat(frames, nprobes * nfragments * 3),
+                "probe": np.tile(np.repeat(self.probes, nfragments * 3), len(frames)),
+                "fragment": np.tile(
+                    np.repeat(self.fragments, 3), len(frames) * nprobes
+                ),
+                "dimension": np.tile(
+                    ["x", "y", "z"], len(frames) * nprobes * nfragments
+                ),
+                "field": totfield.ravel(),
+            }
+        )
+        components.to_csv(self.components_file, header=False, index=False)
+        self.components_file.flush()
+
+        if self.pairs is not None:
+            efield = np.stack([efield for slot, totfield, efield in self.chunk])
+            npairs = len(self.pairs)
+            projection = pd.DataFrame(
+                {
+                    "frame": np.repeat(frames, npairs * nfragments),
+                    "probe 1": np.tile(
+                        np.repeat(self.probes[self.pairs[:, 0]], nfragments),
+                        len(frames),
+                    ),
+                    "probe 2": np.tile(
+                        np.repeat(self.probes[self.pairs[:, 1]], nfragments),
+                        len(frames),
+                    ),
+                    "fragment": np.tile(self.fragments, len(frames) * npairs),
+                    "projection": efield.ravel(),
+                }
+            )
+            projection.to_csv(self.projection_file, header=False, index=False)
+            self.projection_file.flush()
+
+        self.written += len(self.chunk)
+        self.chunk = []
+
+        progress = {
+            "frames": self.written,
+            "frame ranges": self._written_ranges(),
+            "components size": self.components_file.tell(),
+        }
+        if self.pairs is not None:
+            progress["projection size"] = self.projection_file.tell()
+
+        # Replace the progress file in one step, so that it is never partly written.
+        with open(f"{self.progress_path}.tmp", "w") as f:
+            json.dump(progress, f)
+        os.replace(f"{self.progress_path}.tmp", self.progress_path)
+
+    def _written_ranges(self):
+        """
+        The ranges of the frame numbers which have been written, as by `frame_ranges`.
+        """
+        ranges = []
+        remaining = self.written
+        for first, step, count in self.ranges:
+            if remaining <= 0:
+                break
+
+            count = min(count, remaining)
+            # The step of a single frame depends on the next frame, which is not written yet.
+            ranges.append([first, step if count > 1 else 1, count])
+            remaining -= count
+
+        return ranges
+
+    def close(self):
+        """
+        Write the remaining frames and close the files.
+        """
+        with self.lock:
+            # Frames which were never completed leave a gap, so write the rest in order.
+            for slot in sorted(self.pending):
+                self.chunk.append((slot, *self.pending.pop(slot)))
+            self._write()
+
+            self.components_file.close()
+            if self.pairs is not None:
+                self.projection_file.close()
+
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+
+
+class Checkpoint:
+    """
+    An appendable binary file holding the results of completed frames, so that an
+    interrupted calculation can be restarted.
+
+    The file starts with a line describing the calculation, followed by one fixed-size
+    record per completed frame, holding the frame number and the results of that frame
+    in every ResultStore. Records are written in groups of `interval` frames.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the checkpoint file.
+
+    stores : list
+        The ResultStores of the calculation, which all analyze the same frames. They may
+        hold the results of different groups of probes.
+
+    interval : int, optional
+        The number of completed frames to collect before they are written.
+        If less than 1, nothing is written.
+    """
+
+    def __init__(self, file_path, stores, interval=100):
+        self.file_path = file_path
+        self.stores = stores
+        self.interval = interval
+        self.frames = stores[0].frames
+
+        description = {
+            "probes": [int(probe) for probe in stores[0].probes],
+            "groupings": [[store.by_type, len(store.fragments)] for store in stores],
+            "projection": stores[0].projection is not None,
+        }
+
+        # The stores of different probe groups have probes of their own.
+        probe_groups = [[int(probe) for probe in store.probes] for store in stores]
+        if any(group != description["probes"] for group in probe_groups):
+            description["probe groups"] = probe_groups
+
+        self.header = (json.dumps(description) + "\n").encode()
+
+        fields = [("frame", np.int64)]
+        for i, store in enumerate(stores):
+            fields.append((f"components {i}", np.float64, store.components.shape[1:]))
+            if store.projection is not None:
+                fields.append(
+                    (f"projection {i}", np.float64, store.projection.shape[1:])
+                )
+        self.dtype = np.dtype(fields)
+
+        self.pending = []
+        self.file = None
+        self.lock = threading.Lock()
+
+    def restore(self):
+        """
+        Load the results of the frames completed in a previous run into the ResultStores.
+
+        A partly written record at the end of the file (from a run which was killed while
+        writing) is discarded, and later records are appended after the last complete one.
+
+        Returns
+        -------
+        nframes : int
+            The number of frames restored.
+        """
+        with open(self.file_path, "rb") as f:
+            header = f.readline()
+            if header != self.header:
+                raise Exception(
+                    f"The checkpoint {self.file_path} was written by a different calculation."
+                )
+            data = f.read()
+
+        nrecords = len(data) // self.dtype.itemsize
+        records = np.frombuffer(data, dtype=self.dtype, count=nrecords)
+
+        if not np.isin(records["frame"], self.frames).all():
+            raise Exception(
+                f"The checkpoint {self.file_path} contains frames which are not analyzed."
+            )
+        slots = np.searchsorted(self.frames, records["frame"])
+
+        for i, store in enumerate(self.stores):
+            store.components[slots] = records[f"components {i}"]
+            if store.projection is not None:
+                store.projection[slots] = records[f"projection {i}"]
+            store.filled[slots] = True
+
+        self.file = open(self.file_path, "r+b")
+        self.file.truncate(len(self.header) + nrecords * self.dtype.itemsize)
+        self.file.seek(0, os.SEEK_END)
+
+        return nrecords
+
+    def add(self, slot):
+        """
+        Mark a frame as completed, writing the completed frames if there are enough of them.
+
+        Parameters
+        ----------
+        slot : int
+            The position of the frame in `frames`.
+        """
+        if self.interval < 1:
+            return
+
+        with self.lock:
+            self.pending.append(slot)
+            if len(self.pending) >= self.interval:
+                self._write()
+
+    def _write(self):
+        if not self.pending:
+            return
+
+        if self.file is None:
+            self.file = open(self.file_path, "wb")
+            self.file.write(self.header)
+
+        records = np.zeros(len(self.pending), dtype=self.dtype)
+        records["frame"] = self.frames[self.pending]
+        for i, store in enumerate(self.stores):
+            records[f"components {i}"] = store.components[self.pending]
+            if store.projection is not None:
+                records[f"projection {i}"] = store.projection[self.pending]
+
+        self.file.write(records.tobytes())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = []
+
+    def close(self):
+        """
+        Write any remaining completed frames and close the file.
+        """
+        with self.lock:
+            self._write()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -15,30 +15,62 @@ parser.add_argument('-filename', help='The projected electric field file to calc
 args = parser.parse_args()
 
 fn = args.filename
-current = pd.read_csv(fn)
 
-fragment_type = current.iloc[0].values[0].split()[0]
+if fn.endswith('.npz') or fn.endswith('.h5'):
+    # Binary output from --output-format npz or hdf5, with frames as the first dimension.
+    if fn.endswith('.npz'):
+        data = np.load(fn)
+        fragment_type = str(data['by_type'])
+    else:
+        import h5py
+        data = h5py.File(fn, 'r')
+        fragment_type = data.attrs['by_type']
 
-probes = [x.split('-')[0].strip() for x in current.columns[1:]]
-probes = np.unique(probes)
+    projection = data['projection'][:].astype(np.float64)
+    fragments = data['fragments'][:]
 
-n_probe = len(probes)
+    for i, (probe_1, probe_2) in enumerate(data['pairs'][:]):
+        probe_pair = f'{probe_1} and {probe_2}'
 
-for probe_pair in probes:
-    cols = [x for x in current.columns if probe_pair in x]
-    bond_values = current[cols]
-    means = bond_values.mean(axis=1)
-    std = bond_values.std(axis=1)
-    means.name = probe_pair
-    means.index.name = fragment_type
-    means.index += 1
+        means = pd.Series(projection[:, :, i].mean(axis=0), index=fragments)
+        std = pd.Series(projection[:, :, i].std(axis=0, ddof=1), index=fragments)
+        means.name = probe_pair
+        means.index.name = fragment_type
 
-    std.name = "standard deviation"
-    std.index.name = fragment_type
-    std.index += 1
+        std.name = "standard deviation"
+        std.index.name = fragment_type
 
-    concat = pd.concat([means, std], axis=1)
+        concat = pd.concat([means, std], axis=1)
 
-    file_name = probe_pair.replace(" ", "_")
-    file_name = file_name + '.csv'
-    concat.to_csv(file_name, header=True)
+        file_name = probe_pair.replace(" ", "_")
+        file_name = file_name + '.csv'
+        concat.to_csv(file_name, header=True)
+
+else:
+    current = pd.read_csv(fn)
+
+    fragment_type = current.iloc[0].values[0].split()[0]
+
+    probes = [x.split('-')[0].strip() for x in current.columns[1:]]
+    probes = np.unique(probes)
+
+    n_probe = len(probes)
+
+    for probe_pair in probes:
+        cols = [x for x in current.columns if probe_pair in x]
+        bond_values = current[cols]
+        means = bond_values.mean(axis=1)
+        std = bond_values.std(axis=1)
+        means.name = probe_pair
+        means.index.name = fragment_type
+        means.index += 1
+
+        std.name = "standard deviation"
+        std.index.name = fragment_type
+        std.index += 1
+
+        concat = pd.concat([means, std], axis=1)
+
+        file_name = probe_pair.replace(" ", "_")
+        file_name = file_name + '.csv'
+        concat.to_csv(file_name, header=True)